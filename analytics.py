@@ -0,0 +1,267 @@
+import threading
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from config import ANALYTICS_WINDOW_SIZE, ANALYTICS_WINDOW_HOURS
+from db import db
+from data_version import data_version
+from metrics import timed
+
+
+def to_amount(value):
+    """把记录的数量转换为数字，无法转换时返回None"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_seconds(record_time):
+    """记录时间距1970-01-01的秒数，与数据库DATETIME一样精确到秒"""
+    return int(record_time.replace(microsecond=0).timestamp())
+
+
+def format_minutes(minutes):
+    """把分钟数格式化为“X小时Y分钟”"""
+    minutes = int(round(minutes))
+    hours, minutes = divmod(minutes, 60)
+    if hours and minutes:
+        return f"{hours}小时{minutes}分钟"
+    if hours:
+        return f"{hours}小时"
+    return f"{minutes}分钟"
+
+
+class EventWindow:
+    """一个租户一类记录的滑动窗口：按时间排序的最近若干次记录的时间和数量
+
+    窗口只保留最近size次、且距最新一次不超过span秒的记录。相邻间隔的平均值等于
+    (最新时间 - 最早时间) / (次数 - 1)，数量按单位维护累计值，查询都不需要遍历窗口。
+    """
+
+    __slots__ = ('size', 'span', 'times', 'amounts', '_amount_sums')
+
+    def __init__(self, size, span):
+        self.size = size
+        self.span = span
+        # 记录时间（距1970-01-01的秒数），升序
+        self.times = []
+        # 与times对应的(数量, 单位)
+        self.amounts = []
+        # 单位 -> [数量总和, 有数量的次数]
+        self._amount_sums = {}
+
+    def __len__(self):
+        return len(self.times)
+
+    def _add_amount(self, amount, sign):
+        value, unit = amount
+        if value is None:
+            return
+        item = self._amount_sums.setdefault(unit, [0.0, 0])
+        item[0] += sign * value
+        item[1] += sign
+        if item[1] == 0:
+            del self._amount_sums[unit]
+
+    def _pop(self, index):
+        self.times.pop(index)
+        self._add_amount(self.amounts.pop(index), -1)
+
+    def add(self, seconds, amount=None, unit=None):
+        """加入一次记录，相同时间的记录视为更新，早于窗口范围的记录被忽略"""
+        amount = (to_amount(amount), unit)
+        index = bisect_left(self.times, seconds)
+        if index < len(self.times) and self.times[index] == seconds:
+            self._add_amount(self.amounts[index], -1)
+            self.amounts[index] = amount
+            self._add_amount(amount, 1)
+            return
+        self.times.insert(index, seconds)
+        self.amounts.insert(index, amount)
+        self._add_amount(amount, 1)
+        # 先按次数、再按距最新一次的时间淘汰最早的记录，结果与记录加入的顺序无关
+        while len(self.times) > self.size:
+            self._pop(0)
+        while self.times[-1] - self.times[0] > self.span:
+            self._pop(0)
+
+    def remove(self, seconds):
+        """移除一次记录，不在窗口中时忽略"""
+        index = bisect_left(self.times, seconds)
+        if index < len(self.times) and self.times[index] == seconds:
+            self._pop(index)
+
+    def previous(self, seconds):
+        """早于指定时间的最近一次记录时间，没有时返回None"""
+        index = bisect_left(self.times, seconds)
+        return self.times[index - 1] if index else None
+
+    def summary(self, now):
+        """窗口的统计结果，间隔以分钟为单位"""
+        if not self.times:
+            return None
+        last = self.times[-1]
+        count = len(self.times)
+        avg_interval = (last - self.times[0]) / (count - 1) if count > 1 else None
+        last_value, last_unit = self.amounts[-1]
+        return {
+            'count': count,
+            'last_time': datetime.fromtimestamp(last).strftime('%Y-%m-%d %H:%M:%S'),
+            'minutes_since_last': round((now - last) / 60, 1),
+            'last_interval_minutes': round((last - self.times[-2]) / 60, 1) if count > 1 else None,
+            'avg_interval_minutes': round(avg_interval / 60, 1) if avg_interval else None,
+            'predicted_next': (
+                datetime.fromtimestamp(last + avg_interval).strftime('%Y-%m-%d %H:%M:%S') if avg_interval else None
+            ),
+            'overdue_minutes': (
+                round((now - last - avg_interval) / 60, 1) if avg_interval and now > last + avg_interval else 0
+            ),
+            'last_amount': last_value,
+            'last_amount_unit': last_unit,
+            'avg_amount': {unit: round(total / n, 1) for unit, (total, n) in self._amount_sums.items()},
+        }
+
+
+class IntervalAnalytics:
+    """按租户和记录类型维护最近记录的滑动窗口，回答距上次多久、平均间隔和预计下次时间
+
+    写库后由数据变更监听器增量更新，应用启动时用一次查询重建。
+    监听器只在写入的进程中调用，因此每个租户的窗口记录其对应的数据版本号（多个工作进程共享），
+    读取时版本号不一致说明其他进程写入过该租户，先从数据库重建该租户的窗口。
+    """
+
+    def __init__(self, window_size=ANALYTICS_WINDOW_SIZE, window_hours=ANALYTICS_WINDOW_HOURS,
+                 database=db, versions=data_version):
+        self.window_size = window_size
+        self.window_hours = window_hours
+        self.database = database
+        self.versions = versions
+        # 租户ID -> {记录类型: EventWindow}
+        self._windows = {}
+        # 租户ID -> 窗口对应的数据版本号；不在其中的租户按上次全部重建时的版本号快照计
+        self._versions = {}
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def _new_window(self):
+        return EventWindow(self.window_size, self.window_hours * 3600)
+
+    def _apply(self, windows, tenant_id, record_type, record_time, amount=None, amount_unit=None):
+        tenant = windows.setdefault(tenant_id, {})
+        window = tenant.get(record_type)
+        if window is None:
+            window = tenant[record_type] = self._new_window()
+        window.add(to_seconds(record_time), amount, amount_unit)
+
+    def on_record_change(self, event):
+        """数据变更监听器：插入和更新加入窗口，删除从窗口移除"""
+        tenant_id = event['tenant_id']
+        with self._lock:
+            if event['action'] == 'delete':
+                window = self._windows.get(tenant_id, {}).get(event['record_type'])
+                if window is not None:
+                    window.remove(to_seconds(event['record_time']))
+            else:
+                self._apply(self._windows, tenant_id, event['record_type'], event['record_time'],
+                            event.get('amount'), event.get('amount_unit'))
+            # 本次写入之前没有其他进程的写入时，窗口与新版本号一致
+            version = event.get('data_version')
+            if version is not None and self._version_of(tenant_id) == version - 1:
+                self._versions[tenant_id] = version
+
+    def _version_of(self, tenant_id):
+        """租户窗口对应的数据版本号，需持有锁；从未加载过时返回None"""
+        version = self._versions.get(tenant_id)
+        if version is None and self._snapshot is not None:
+            version = self.versions.get(tenant_id, self._snapshot)
+        return version
+
+    @timed('analytics.rebuild')
+    def rebuild(self, database=None):
+        """从数据库一次读取窗口时间范围内的记录重建所有窗口，返回读取的记录数，失败时返回None"""
+        database = database or self.database
+        since = datetime.now() - timedelta(hours=self.window_hours)
+        # 先取版本号再查询，查询期间的写入会使版本号不一致，读取时重建
+        snapshot = self.versions.snapshot()
+        windows = {}
+        count = 0
+        try:
+            for row in database.iter_recent_records(since):
+                self._apply(windows, row['tenant_id'], row['record_type'], row['record_time'],
+                            row['amount'], row['amount_unit'])
+                count += 1
+        except Exception as e:
+            print(f"重建记录间隔统计失败: {e}", flush=True)
+            return None
+        with self._lock:
+            # 重建期间增量更新的窗口以重建结果为准
+            self._windows = windows
+            self._versions = {}
+            self._snapshot = snapshot
+        print(f"记录间隔统计已重建，读取 {count} 条记录，{len(windows)} 个租户", flush=True)
+        return count
+
+    def _ensure_current(self, tenant_id):
+        """租户的窗口与当前数据版本号不一致时从数据库重建，查询失败时继续使用现有窗口"""
+        version = self.versions.get(tenant_id)
+        with self._lock:
+            if self._version_of(tenant_id) == version:
+                return
+        since = datetime.now() - timedelta(hours=self.window_hours)
+        windows = {}
+        try:
+            for row in self.database.iter_recent_records(since, tenant_id=tenant_id):
+                self._apply(windows, tenant_id, row['record_type'], row['record_time'],
+                            row['amount'], row['amount_unit'])
+        except Exception as e:
+            print(f"重建租户 {tenant_id} 的记录间隔统计失败: {e}", flush=True)
+            return
+        with self._lock:
+            self._windows[tenant_id] = windows.get(tenant_id, {})
+            self._versions[tenant_id] = version
+
+    def summary(self, tenant_id, record_type, now=None):
+        """租户一类记录的统计结果，没有记录时返回None"""
+        now = (now or datetime.now()).timestamp()
+        self._ensure_current(tenant_id)
+        with self._lock:
+            window = self._windows.get(tenant_id, {}).get(record_type)
+            return window.summary(now) if window else None
+
+    def summaries(self, tenant_id, now=None):
+        """租户各类记录的统计结果"""
+        now = (now or datetime.now()).timestamp()
+        self._ensure_current(tenant_id)
+        with self._lock:
+            return {
+                record_type: window.summary(now)
+                for record_type, window in self._windows.get(tenant_id, {}).items()
+                if len(window)
+            }
+
+    def describe(self, tenant_id, record_type, record_time):
+        """记录确认消息中附加的间隔信息，窗口中没有更早的记录时返回None"""
+        seconds = to_seconds(record_time)
+        self._ensure_current(tenant_id)
+        with self._lock:
+            window = self._windows.get(tenant_id, {}).get(record_type)
+            if window is None:
+                return None
+            previous = window.previous(seconds)
+            if previous is None:
+                return None
+            item = window.summary(seconds)
+        lines = [f"距上次{record_type}：{format_minutes((seconds - previous) / 60)}"]
+        if item['avg_interval_minutes']:
+            lines.append(f"近{item['count']}次平均间隔：{format_minutes(item['avg_interval_minutes'])}")
+            # 只有本条是最新的记录时才预计下次时间
+            if item['last_time'] == record_time.strftime('%Y-%m-%d %H:%M:%S'):
+                lines.append(f"预计下次：{item['predicted_next'][5:16]}")
+        return "\n".join(lines)
+
+# 创建记录间隔统计实例，写库后增量更新
+interval_analytics = IntervalAnalytics()
+db.add_change_listener(interval_analytics.on_record_change)
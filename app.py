@@ -1,72 +1,118 @@
-from fastapi import FastAPI, Request, Response, Depends, HTTPException, Query
-from fastapi.responses import JSONResponse, PlainTextResponse, HTMLResponse
+from fastapi import FastAPI, Request, Response, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, HTMLResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from typing import Optional, Dict, List, Any
 import json
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import uvicorn
 import hashlib
+import itertools
 import time
+import hmac
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote
 
-from config import APP_HOST, APP_PORT, CORP_ID
+from config import (
+    APP_HOST, APP_PORT, CORP_ID, REPLY_MODE, PASSIVE_REPLY_MAX_BYTES, PASSIVE_REPLY_DEADLINE,
+    INBOUND_ASYNC, REPORT_MAX_RANGE_DAYS, REPORT_PUSH_ENABLED, ADMIN_TOKEN, DEFAULT_TENANT, TOKEN
+)
 from db import db
+from data_version import data_version
 from wechat import wechat_api
 from message_parser import message_parser
+from outbox import outbox
+from idempotency import idempotency
+from wal import write_log
+from jobs import inbound_queue
+from report_cache import report_cache
+from report_render import report_renderer, period_range, TEMPLATES, MEDIA_TYPES
+from stats import compute_stats
+from search import search_records
+from export_records import iter_export, export_until, HAS_PYARROW, EXPORT_MEDIA_TYPES
+from charts import chart_cache
+from analytics import interval_analytics
+from live import record_hub, sse_stream, websocket_session
+from scheduler import report_scheduler
+from metrics import registry, CALLBACK_SECONDS, PARSE_TOTAL
+from responses import json_response
+from tenancy import tenant_resolver
+from tracing import TracingMiddleware, trace_log, current_trace_id
 
 # 辅助函数
-def get_record_type_emoji(record_type):
-    """获取记录类型对应的emoji"""
-    emoji_map = {
-        '吃': '🍼',
-        '大便': '💩',
-        '小便': '💦',
-        '睡': '😴',
-        '体温': '🌡️',
-        '吃药': '💊',
-        '其他': '📝'
-    }
-    return emoji_map.get(record_type, '📝')
+def build_daily_report(tenant_id, date_str, fmt='text'):
+    """查询数据库并按指定格式生成日报，查询失败时返回None"""
+    grouped_records = db.get_daily_records(tenant_id, date_str)
+    if grouped_records is None:
+        return None
+    return report_renderer.render_day(fmt, date_str, grouped_records)
 
-def generate_daily_report(date_str):
-    """生成指定日期的日报内容"""
-    grouped_records = db.get_daily_records(date_str)
-    
-    if not grouped_records:
-        date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-        date_display = date_obj.strftime('%Y年%m月%d日')
-        return f"未找到 {date_display} 的记录！"
-    
-    # 构建日报回复
-    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-    date_display = date_obj.strftime('%Y年%m月%d日')
-    
-    report = f"📅 {date_display}日报 📅\n"
-    report += f"{'='*30}\n\n"
-    
-    # 按类型输出记录
-    for record_type, records in grouped_records.items():
-        # 添加记录类型标题
-        type_emoji = get_record_type_emoji(record_type)
-        report += f"{type_emoji} {record_type}记录 ({len(records)}条):\n"
-        
-        # 添加记录详情
-        for idx, rec in enumerate(records, 1):
-            time_str = rec['record_time'].strftime('%H:%M')
-            amount_str = ""
-            if rec['amount']:
-                if rec['amount_unit']:
-                    amount_str = f" {rec['amount']}{rec['amount_unit']}"
-                else:
-                    amount_str = f" {rec['amount']}"
-            report += f"  {idx}. {time_str}{amount_str}\n"
-        
-        report += "\n"
-    
-    # 添加汇总信息
-    total_records = sum(len(records) for records in grouped_records.values())
-    report += f"{'='*30}\n"
-    report += f"共记录 {total_records} 条信息"
-    
-    return report
+def get_daily_report_entry(tenant_id, date_str, fmt='text'):
+    """获取租户指定日期、格式的日报缓存条目，未缓存时生成"""
+    return report_cache.get(tenant_id, date_str, fmt, lambda: build_daily_report(tenant_id, date_str, fmt))
+
+def generate_daily_report(tenant_id, date_str):
+    """生成租户指定日期的日报内容，同一日期的数据未变化时直接使用缓存"""
+    entry = get_daily_report_entry(tenant_id, date_str)
+    if entry is None:
+        date_display = datetime.strptime(date_str, '%Y-%m-%d').strftime('%Y年%m月%d日')
+        return f"获取 {date_display} 的记录失败，请稍后重试！"
+    return entry.content
+
+def get_daily_report_text(tenant_id, date_str):
+    """获取租户指定日期的日报文本，查询失败时返回None"""
+    entry = get_daily_report_entry(tenant_id, date_str)
+    return entry.content if entry else None
+
+def report_link_token(tenant_id, date_str):
+    """日报页面的访问令牌，当天有效；默认租户沿用原先的令牌，其他租户的令牌与密钥和租户ID绑定"""
+    if tenant_id == DEFAULT_TENANT:
+        return hashlib.md5(f"baby_report_{date_str}".encode()).hexdigest()[:10]
+    return hashlib.md5(f"baby_report_{TOKEN}_{tenant_id}_{date_str}".encode()).hexdigest()[:10]
+
+def report_link_query(tenant_id, date_str):
+    """日报页面链接的查询参数"""
+    query = f"date={date_str}&token={report_link_token(tenant_id, date_str)}"
+    if tenant_id != DEFAULT_TENANT:
+        query += f"&tenant={quote(tenant_id)}"
+    return query
+
+def tenant_api_token(tenant_id):
+    """租户数据接口的访问令牌，以TOKEN为密钥对租户ID计算HMAC，长期有效"""
+    return hmac.new((TOKEN or '').encode(), f"baby_api_{tenant_id}".encode(), hashlib.sha256).hexdigest()[:32]
+
+def tenant_authorized(connection, tenant_id, token):
+    """校验数据接口的访问令牌，令牌取自token参数或X-Tenant-Token请求头"""
+    token = token or connection.headers.get('x-tenant-token', '')
+    return hmac.compare_digest(token.encode(), tenant_api_token(tenant_id).encode())
+
+def forbidden_response():
+    """访问令牌无效时的响应"""
+    return JSONResponse(
+        status_code=403,
+        content={
+            'code': 403,
+            'message': '无效的访问令牌',
+            'data': None
+        }
+    )
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match中是否包含指定的ETag（弱比较）"""
+    etags = [tag.strip().replace('W/', '', 1) for tag in if_none_match.split(',')]
+    return '*' in etags or etag.replace('W/', '', 1) in etags
+
+def is_not_modified(request, entry):
+    """根据If-None-Match和If-Modified-Since判断客户端缓存是否仍然有效"""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        return etag_matches(if_none_match, entry.etag)
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return int(entry.last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
 
 app = FastAPI(
     title="老三日常记录系统",
@@ -74,6 +120,12 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# 记录每个请求的追踪ID和各阶段耗时
+app.add_middleware(TracingMiddleware)
+
+# 被动回复需要在回调请求内处理消息，此时不使用后台处理队列
+INBOUND_QUEUED = INBOUND_ASYNC and REPLY_MODE != 'passive'
+
 @app.get("/", response_class=PlainTextResponse)
 def index():
     """首页"""
@@ -89,6 +141,177 @@ async def wechat_callback_get(
     """处理企业微信回调验证请求"""
     return PlainTextResponse(wechat_api.verify_url(msg_signature, timestamp, nonce, echostr))
 
+def handle_text_message(content, from_user_name, chat_id=None):
+    """处理一条文本消息：解析、写库或查询，返回(回复内容, 是否可合并)，无需回复时返回None"""
+    # 按发送者或群聊确定所属的租户（家庭），读写都限定在该租户内
+    tenant_id = tenant_resolver.resolve(from_user_name, chat_id)
+    
+    # 尝试解析消息内容
+    record = message_parser.parse_message(content)
+    
+    if record:
+        print(f"成功解析消息为记录: {record.record_type}", flush=True)
+        print(f"记录详情: 时间={record.record_time}, 类型={record.record_type}, 是否删除指令={record.is_delete_command}, 是否日报查询={record.is_daily_report_command}", flush=True)
+        
+        # 检查是否是日报查询指令
+        if record.is_daily_report_command and record.report_date:
+            print(f"检测到日报查询指令，查询日期: {record.report_date}", flush=True)
+            PARSE_TOTAL.inc('report', '')
+            reply = generate_daily_report(tenant_id, record.report_date)
+            print(f"发送日报给用户ID: {from_user_name}", flush=True)
+            return reply, False
+        
+        # 检查是否是请求日报链接
+        elif content in ["日报链接", "获取日报链接", "日报url", "日报URL"]:
+            print(f"检测到日报链接请求", flush=True)
+            PARSE_TOTAL.inc('link', '')
+            
+            # 生成今天的日期和租户的token
+            today = datetime.now().date().strftime('%Y-%m-%d')
+            
+            # 构建链接
+            base_url = f"http://{APP_HOST}:{APP_PORT}"
+            view_link = f"{base_url}/daily-report?{report_link_query(tenant_id, today)}"
+            send_link = f"{view_link}&user_id={from_user_name}"
+            
+            # 构建回复
+            reply = f"📱 今日日报链接 📱\n\n"
+            reply += f"1. 查看日报:\n{view_link}\n\n"
+            reply += f"2. 发送日报到企业微信:\n{send_link}\n\n"
+            reply += f"3. 获取更多链接选项:\n{base_url}/report-link\n\n"
+            reply += f"4. 数据接口令牌（调用/api和/charts接口时作为token参数）:\n{tenant_api_token(tenant_id)}\n\n"
+            reply += "提示: 链接当天有效，每天更新"
+            
+            # 发送回复
+            user_id = from_user_name
+            print(f"发送日报链接给用户ID: {user_id}", flush=True)
+            return reply, False
+        
+        # 检查是否是删除指令
+        elif record.is_delete_command:
+            print(f"检测到删除指令，准备删除记录: {record.record_time}, {record.record_type}", flush=True)
+            PARSE_TOTAL.inc('delete', record.record_type)
+            # 删除记录，先写入本地日志，数据库不可用或较慢时先回复已记录
+            applied, result = write_log.delete(
+                tenant_id,
+                record_time=record.record_time,
+                record_type=record.record_type
+            )
+            
+            if not applied:
+                reply = f"已记录删除，数据库同步中\n时间：{record.record_time.strftime('%Y-%m-%d %H:%M')}\n类型：{record.record_type}"
+                print("删除指令已写入本地日志，等待写入数据库", flush=True)
+                return reply, True
+            elif result:
+                record_id = result['id']
+                print(f"记录已标记为删除，ID: {record_id}", flush=True)
+                
+                # 构建回复消息
+                reply = f"记录删除成功！\n时间：{record.record_time.strftime('%Y-%m-%d %H:%M')}\n类型：{record.record_type}"
+                
+                # 添加数量信息
+                if result.get('amount'):
+                    amount_str = result.get('amount')
+                    if result.get('amount_unit'):
+                        amount_str += result.get('amount_unit')
+                    reply += f"\n数量：{amount_str}"
+                
+                # 发送回复
+                user_id = from_user_name
+                print(f"发送删除确认给用户ID: {user_id}", flush=True)
+                return reply, True
+            else:
+                # 未找到要删除的记录
+                reply = f"未找到要删除的记录！\n时间：{record.record_time.strftime('%Y-%m-%d %H:%M')}\n类型：{record.record_type}"
+                print("未找到要删除的记录", flush=True)
+                return reply, True
+        else:
+            print(f"不是删除指令，准备插入/更新记录", flush=True)
+            # 存入数据库，先写入本地日志，数据库不可用或较慢时先回复已记录
+            applied, result = write_log.insert(
+                tenant_id,
+                record_time=record.record_time,
+                record_type=record.record_type,
+                amount=record.amount,
+                amount_unit=record.amount_unit,
+                description=record.description
+            )
+            
+            if not applied:
+                PARSE_TOTAL.inc('pending', record.record_type)
+                print("记录已写入本地日志，等待写入数据库", flush=True)
+                reply = f"已记录，数据库同步中\n时间：{record.record_time.strftime('%Y-%m-%d %H:%M')}\n类型：{record.record_type}"
+                formatted_amount = record.get_formatted_amount()
+                if formatted_amount:
+                    reply += f"\n数量：{formatted_amount}"
+                return reply, True
+            elif result:
+                record_id = result['id']
+                is_update = result.get('is_update', False)
+                PARSE_TOTAL.inc('update' if is_update else 'insert', record.record_type)
+                
+                print(f"记录已{'更新' if is_update else '插入'}数据库，ID: {record_id}", flush=True)
+                # 构建回复消息
+                reply = f"记录{'更新' if is_update else '添加'}成功！\n时间：{record.record_time.strftime('%Y-%m-%d %H:%M')}\n类型：{record.record_type}"
+                
+                # 添加数量信息
+                formatted_amount = record.get_formatted_amount()
+                if formatted_amount:
+                    reply += f"\n数量：{formatted_amount}"
+                
+                # 如果是更新记录，添加被覆盖的信息
+                if is_update:
+                    old_amount = result.get('old_amount')
+                    old_amount_unit = result.get('old_amount_unit')
+                    old_description = result.get('old_description')
+                    
+                    reply += "\n\n覆盖了之前的记录："
+                    if old_amount:
+                        old_formatted_amount = f"{old_amount}{old_amount_unit}" if old_amount_unit else old_amount
+                        reply += f"\n原数量：{old_formatted_amount}"
+                    if old_description and old_description != record.description:
+                        reply += f"\n原描述：{old_description}"
+                
+                # 添加距上次同类记录的时间、平均间隔和预计下次时间
+                interval_info = interval_analytics.describe(tenant_id, record.record_type, record.record_time)
+                if interval_info:
+                    reply += f"\n\n{interval_info}"
+                
+                # 发送回复
+                user_id = from_user_name  # 使用FromUserName作为用户ID
+                print(f"发送记录确认给用户ID: {user_id}", flush=True)
+                return reply, True
+            else:
+                PARSE_TOTAL.inc('failed', record.record_type)
+                print("记录插入数据库失败", flush=True)
+    else:
+        PARSE_TOTAL.inc('unparsed', '')
+        print(f"无法解析消息为记录: {content}", flush=True)
+    return None
+
+def deliver_reply(message, reply, nonce, started_at):
+    """投递回复：短消息作为被动回复放在回调响应中，较长或处理较慢的回复通过发送队列主动发送"""
+    content, coalesce = reply
+    if (REPLY_MODE == 'passive'
+            and time.monotonic() - started_at < PASSIVE_REPLY_DEADLINE
+            and len(content.encode('utf-8')) <= PASSIVE_REPLY_MAX_BYTES):
+        reply_xml = wechat_api.build_passive_reply(message, content, nonce)
+        if reply_xml:
+            print(f"以被动回复方式回复用户: {message.from_user}", flush=True)
+            return Response(content=reply_xml, media_type="application/xml")
+    
+    outbox.enqueue(message.from_user, content, coalesce=coalesce)
+    print(f"回复已加入发送队列: {message.from_user}", flush=True)
+    return PlainTextResponse("success")
+
+def process_message_job(message):
+    """后台处理一条文本消息，回复通过发送队列主动发送"""
+    print(f"开始处理消息: {message.from_user} '{message.content}'", flush=True)
+    reply = handle_text_message(message.content, message.from_user, message.chat_id)
+    if reply:
+        content, coalesce = reply
+        outbox.enqueue(message.from_user, content, coalesce=coalesce)
+
 @app.post("/wechat/callback")
 async def wechat_callback_post(
     request: Request,
@@ -97,81 +320,56 @@ async def wechat_callback_post(
     nonce: str = Query("")
 ):
     """处理企业微信消息接收"""
+    started_at = time.monotonic()
+    outcome, response = await process_callback(request, msg_signature, timestamp, nonce, started_at)
+    CALLBACK_SECONDS.observe(time.monotonic() - started_at, outcome)
+    return response
+
+async def process_callback(request, msg_signature, timestamp, nonce, started_at):
+    """验签、去重并处理回调，返回(处理结果, 响应)"""
     print("\n\n=== 开始处理微信消息回调 ===", flush=True)
-    print(f"请求参数: msg_signature={msg_signature}, timestamp={timestamp}, nonce={nonce}", flush=True)
+    print(f"请求参数: msg_signature={msg_signature}, timestamp={timestamp}, nonce={nonce}, trace_id={current_trace_id()}", flush=True)
+    # 企业微信重试的回调请求体和签名不变，解密之前即可识别重复投递
+    delivery_key = idempotency.delivery_key(msg_signature)
+    message_key = None
+    if not idempotency.claim(delivery_key):
+        print("重复投递的回调，直接返回", flush=True)
+        return 'duplicate', PlainTextResponse("success")
     try:
-        # 获取消息内容
-        xml_content = await request.body()
-        print("收到原始XML消息:", flush=True)
-        print(xml_content, flush=True)
-        xml_content_str = xml_content.decode('utf-8')
-        print("解码后的XML:", flush=True)
-        print(xml_content_str, flush=True)
+        # 获取消息内容，验签、解密和解析一次完成
+        body = await request.body()
+        message = wechat_api.decode_callback(body, msg_signature, timestamp, nonce)
+        if message is None:
+            print("回调消息解码失败，忽略该消息", flush=True)
+            idempotency.release(delivery_key)
+            return 'invalid', PlainTextResponse("success")
+        print(f"解析后的消息: {message}", flush=True)
         
-        # 解析出原始XML
-        import xml.etree.ElementTree as ET
-        root = ET.fromstring(xml_content_str)
+        # 同一条消息（MsgId相同）只处理一次，避免重复写库和重复回复
+        message_key = idempotency.message_key(message)
+        if not idempotency.claim(message_key):
+            print(f"重复的消息 {message_key}，直接返回", flush=True)
+            return 'duplicate', PlainTextResponse("success")
         
-        # 如果配置了加密，需要解密消息
-        decrypted_xml = None
-        if msg_signature:
-            print(f"检测到签名消息，msg_signature={msg_signature}", flush=True)
-            print(f"timestamp={timestamp}, nonce={nonce}", flush=True)
-            
-            # 从XML中提取加密的消息内容
-            encrypt_elem = root.find(".//Encrypt")
-            if encrypt_elem is not None and encrypt_elem.text:
-                encrypted_msg = encrypt_elem.text
-                print(f"提取的加密消息: {encrypted_msg[:30]}...", flush=True)
-                
-                # 验证签名
-                from config import TOKEN, CORP_ID
-                print(f"TOKEN={TOKEN}, CORP_ID={CORP_ID}", flush=True)
-                
-                import hashlib
-                array = [TOKEN, timestamp, nonce, encrypted_msg]
-                array.sort()
-                str_to_sign = ''.join(array)
-                signature = hashlib.sha1(str_to_sign.encode('utf-8')).hexdigest()
-                
-                print(f"计算的签名: {signature}", flush=True)
-                print(f"接收的签名: {msg_signature}", flush=True)
-                
-                if signature == msg_signature:
-                    print("签名验证成功，开始解密", flush=True)
-                    
-                    # 检查加密模块
-                    if wechat_api.crypto:
-                        print("加密模块已初始化，开始解密", flush=True)
-                        # 解密消息
-                        decrypted_content = wechat_api.crypto.decrypt(encrypted_msg)
-                        if decrypted_content:
-                            print("解密成功！", flush=True)
-                            decrypted_xml = decrypted_content.decode('utf-8')
-                            print("解密后的XML:", flush=True)
-                            print(decrypted_xml, flush=True)
-                            
-                            # 使用解密后的内容更新xml_content
-                            xml_content_str = decrypted_xml
-                        else:
-                            print("解密失败！", flush=True)
-                    else:
-                        print("错误：加密模块未初始化", flush=True)
-                else:
-                    print("签名验证失败", flush=True)
+        # 快速确认模式：入队后立即返回，由后台线程按发送者顺序处理
+        if INBOUND_QUEUED and message.msg_type == 'text':
+            ordering_key = message.chat_id or message.from_user
+            if inbound_queue.submit(ordering_key, process_message_job, message):
+                return 'queued', PlainTextResponse("success")
+            # 队列已满：不确认该消息，企业微信会稍后重试
+            idempotency.release(delivery_key)
+            idempotency.release(message_key)
+            return 'busy', PlainTextResponse("busy", status_code=503)
         
-        # 解析消息
-        message = wechat_api.parse_message(xml_content_str)
-        print("解析后的消息:", flush=True)
-        print(message, flush=True)
         # 仅处理文本消息
-        if message.get('MsgType') == 'text':
-            content = message.get('Content', '')
+        reply = None
+        if message.msg_type == 'text':
+            content = message.content
             print(f"接收到文本消息: '{content}'", flush=True)
             
             # 调试: 简单回显收到的消息内容
-            from_user_name = message.get('FromUserName', '')
-            to_user_name = message.get('ToUserName', '')
+            from_user_name = message.from_user
+            to_user_name = message.to_user
             print(f"发送者: {from_user_name}, 接收者: {to_user_name}", flush=True)
             
             # 测试简单回复
@@ -190,189 +388,25 @@ async def wechat_callback_post(
             #     else:
             #         print("回复消息发送失败", flush=True)
             
-            # 尝试解析消息内容
-            record = message_parser.parse_message(content)
-            
-            if record:
-                print(f"成功解析消息为记录: {record.record_type}", flush=True)
-                print(f"记录详情: 时间={record.record_time}, 类型={record.record_type}, 是否删除指令={record.is_delete_command}, 是否日报查询={record.is_daily_report_command}", flush=True)
-                
-                # 检查是否是日报查询指令
-                if record.is_daily_report_command and record.report_date:
-                    print(f"检测到日报查询指令，查询日期: {record.report_date}", flush=True)
-                    # 获取指定日期的记录
-                    grouped_records = db.get_daily_records(record.report_date)
-                    
-                    if grouped_records:
-                        # 构建日报回复
-                        date_obj = datetime.strptime(record.report_date, '%Y-%m-%d')
-                        date_str = date_obj.strftime('%Y年%m月%d日')
-                        
-                        reply = f"📅 {date_str}日报 📅\n"
-                        reply += f"{'='*30}\n\n"
-                        
-                        # 按类型输出记录
-                        for record_type, records in grouped_records.items():
-                            # 添加记录类型标题
-                            type_emoji = get_record_type_emoji(record_type)
-                            reply += f"{type_emoji} {record_type}记录 ({len(records)}条):\n"
-                            
-                            # 添加记录详情
-                            for idx, rec in enumerate(records, 1):
-                                time_str = rec['record_time'].strftime('%H:%M')
-                                amount_str = ""
-                                if rec['amount']:
-                                    if rec['amount_unit']:
-                                        amount_str = f" {rec['amount']}{rec['amount_unit']}"
-                                    else:
-                                        amount_str = f" {rec['amount']}"
-                                reply += f"  {idx}. {time_str}{amount_str}\n"
-                            
-                            reply += "\n"
-                        
-                        # 添加汇总信息
-                        total_records = sum(len(records) for records in grouped_records.values())
-                        reply += f"{'='*30}\n"
-                        reply += f"共记录 {total_records} 条信息"
-                        
-                        # 发送回复
-                        user_id = from_user_name
-                        print(f"发送日报给用户ID: {user_id}", flush=True)
-                        if wechat_api.send_message(user_id, reply):
-                            print("成功发送日报", flush=True)
-                        else:
-                            print("发送日报失败", flush=True)
-                    else:
-                        # 没有找到记录
-                        date_obj = datetime.strptime(record.report_date, '%Y-%m-%d')
-                        date_str = date_obj.strftime('%Y年%m月%d日')
-                        reply = f"未找到 {date_str} 的记录！"
-                        wechat_api.send_message(from_user_name, reply)
-                        print(f"未找到日期 {record.report_date} 的记录", flush=True)
-                
-                # 检查是否是请求日报链接
-                elif content in ["日报链接", "获取日报链接", "日报url", "日报URL"]:
-                    print(f"检测到日报链接请求", flush=True)
-                    
-                    # 生成今天的日期和token
-                    today = datetime.now().date().strftime('%Y-%m-%d')
-                    token = hashlib.md5(f"baby_report_{today}".encode()).hexdigest()[:10]
-                    
-                    # 构建链接
-                    base_url = f"http://{APP_HOST}:{APP_PORT}"
-                    view_link = f"{base_url}/daily-report?date={today}&token={token}"
-                    send_link = f"{base_url}/daily-report?date={today}&token={token}&user_id={from_user_name}"
-                    
-                    # 构建回复
-                    reply = f"📱 今日日报链接 📱\n\n"
-                    reply += f"1. 查看日报:\n{view_link}\n\n"
-                    reply += f"2. 发送日报到企业微信:\n{send_link}\n\n"
-                    reply += f"3. 获取更多链接选项:\n{base_url}/report-link\n\n"
-                    reply += "提示: 链接当天有效，每天更新"
-                    
-                    # 发送回复
-                    user_id = from_user_name
-                    print(f"发送日报链接给用户ID: {user_id}", flush=True)
-                    if wechat_api.send_message(user_id, reply):
-                        print("成功发送日报链接", flush=True)
-                    else:
-                        print("发送日报链接失败", flush=True)
-                
-                # 检查是否是删除指令
-                elif record.is_delete_command:
-                    print(f"检测到删除指令，准备删除记录: {record.record_time}, {record.record_type}", flush=True)
-                    # 删除记录
-                    result = db.delete_record(
-                        record_time=record.record_time,
-                        record_type=record.record_type
-                    )
-                    
-                    if result:
-                        record_id = result['id']
-                        print(f"记录已标记为删除，ID: {record_id}", flush=True)
-                        
-                        # 构建回复消息
-                        reply = f"记录删除成功！\n时间：{record.record_time.strftime('%Y-%m-%d %H:%M')}\n类型：{record.record_type}"
-                        
-                        # 添加数量信息
-                        if result.get('amount'):
-                            amount_str = result.get('amount')
-                            if result.get('amount_unit'):
-                                amount_str += result.get('amount_unit')
-                            reply += f"\n数量：{amount_str}"
-                        
-                        # 发送回复
-                        user_id = from_user_name
-                        print(f"发送删除确认给用户ID: {user_id}", flush=True)
-                        if wechat_api.send_message(user_id, reply):
-                            print("成功回复删除确认", flush=True)
-                        else:
-                            print("发送删除确认失败", flush=True)
-                    else:
-                        # 未找到要删除的记录
-                        reply = f"未找到要删除的记录！\n时间：{record.record_time.strftime('%Y-%m-%d %H:%M')}\n类型：{record.record_type}"
-                        user_id = from_user_name
-                        wechat_api.send_message(user_id, reply)
-                        print("未找到要删除的记录", flush=True)
-                else:
-                    print(f"不是删除指令，准备插入/更新记录", flush=True)
-                    # 存入数据库
-                    result = db.insert_record(
-                        record_time=record.record_time,
-                        record_type=record.record_type,
-                        amount=record.amount,
-                        amount_unit=record.amount_unit,
-                        description=record.description
-                    )
-                    
-                    if result:
-                        record_id = result['id']
-                        is_update = result.get('is_update', False)
-                        
-                        print(f"记录已{'更新' if is_update else '插入'}数据库，ID: {record_id}", flush=True)
-                        # 构建回复消息
-                        reply = f"记录{'更新' if is_update else '添加'}成功！\n时间：{record.record_time.strftime('%Y-%m-%d %H:%M')}\n类型：{record.record_type}"
-                        
-                        # 添加数量信息
-                        formatted_amount = record.get_formatted_amount()
-                        if formatted_amount:
-                            reply += f"\n数量：{formatted_amount}"
-                        
-                        # 如果是更新记录，添加被覆盖的信息
-                        if is_update:
-                            old_amount = result.get('old_amount')
-                            old_amount_unit = result.get('old_amount_unit')
-                            old_description = result.get('old_description')
-                            
-                            reply += "\n\n覆盖了之前的记录："
-                            if old_amount:
-                                old_formatted_amount = f"{old_amount}{old_amount_unit}" if old_amount_unit else old_amount
-                                reply += f"\n原数量：{old_formatted_amount}"
-                            if old_description and old_description != record.description:
-                                reply += f"\n原描述：{old_description}"
-                        
-                        # 发送回复
-                        user_id = from_user_name  # 使用FromUserName作为用户ID
-                        print(f"发送记录确认给用户ID: {user_id}", flush=True)
-                        if wechat_api.send_message(user_id, reply):
-                            print("成功回复记录确认", flush=True)
-                        else:
-                            print("发送记录确认失败", flush=True)
-                    else:
-                        print("记录插入数据库失败", flush=True)
-            else:
-                print(f"无法解析消息为记录: {content}", flush=True)
+            # 写库和查询是阻塞操作，放到线程池中执行，避免阻塞事件循环
+            reply = await run_in_threadpool(handle_text_message, content, from_user_name, message.chat_id)
         
         # 记录处理完成
         print("=== 消息处理完成 ===\n", flush=True)
         
+        if reply:
+            return 'replied', deliver_reply(message, reply, nonce, started_at)
+        
         # 返回成功响应
-        return PlainTextResponse("success")
+        return 'processed', PlainTextResponse("success")
     except Exception as e:
         print(f"处理消息异常: {e}", flush=True)
         import traceback
         traceback.print_exc()
-        return PlainTextResponse("success")  # 企业微信要求始终返回success
+        # 处理失败，允许企业微信的重试再次处理
+        idempotency.release(delivery_key)
+        idempotency.release(message_key)
+        return 'error', PlainTextResponse("success")  # 企业微信要求始终返回success
 
 class RecordQueryParams:
     def __init__(
@@ -387,14 +421,40 @@ class RecordQueryParams:
         self.record_type = type
         self.limit = limit
 
+def build_records_response(tenant_id, params, accept_encoding, etag):
+    """查询记录并生成JSON响应，客户端支持时压缩，查询失败时返回None"""
+    records = db.get_records(
+        tenant_id,
+        start_date=params.start_date,
+        end_date=params.end_date,
+        record_type=params.record_type,
+        limit=params.limit
+    )
+    if records is None:
+        return None
+    response = json_response({
+        'code': 0,
+        'message': 'success',
+        'data': records
+    }, accept_encoding)
+    response.headers['ETag'] = etag
+    # 客户端每次使用缓存前都需要验证
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.get("/api/records")
 async def get_records(
+    request: Request,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     type: Optional[str] = None,
-    limit: int = 100
+    limit: int = 100,
+    tenant: str = DEFAULT_TENANT,
+    token: Optional[str] = None
 ):
     """获取记录API"""
+    if not tenant_authorized(request, tenant, token):
+        return forbidden_response()
     try:
         params = RecordQueryParams(
             start_date=start_date,
@@ -403,25 +463,27 @@ async def get_records(
             limit=limit
         )
         
-        records = db.get_records(
-            start_date=params.start_date,
-            end_date=params.end_date,
-            record_type=params.record_type,
-            limit=params.limit
-        )
-        
-        # 格式化日期时间
-        for record in records:
-            if 'record_time' in record:
-                record['record_time'] = record['record_time'].strftime('%Y-%m-%d %H:%M:%S')
-            if 'created_at' in record:
-                record['created_at'] = record['created_at'].strftime('%Y-%m-%d %H:%M:%S')
+        # ETag由查询参数和租户的数据版本号决定，版本号未变化时直接返回304，不查询数据库；
+        # 版本号在查询前读取，查询期间发生的写入会使下一次请求重新查询
+        etag = data_version.etag(tenant, start_date, end_date, type, limit)
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match and etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
         
-        return {
-            'code': 0,
-            'message': 'success',
-            'data': records
-        }
+        # 查询、序列化和压缩都在线程池中完成，不阻塞事件循环
+        response = await run_in_threadpool(
+            build_records_response, tenant, params, request.headers.get('accept-encoding'), etag
+        )
+        if response is None:
+            return JSONResponse(
+                status_code=500,
+                content={
+                    'code': 500,
+                    'message': '查询记录失败',
+                    'data': []
+                }
+            )
+        return response
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -432,6 +494,60 @@ async def get_records(
             }
         )
 
+@app.get("/api/records/stream")
+async def stream_records(
+    request: Request,
+    last_event_id: Optional[str] = None,
+    tenant: str = DEFAULT_TENANT,
+    token: Optional[str] = None
+):
+    """记录实时推送（Server-Sent Events），推送本进程写库后的插入、更新和删除"""
+    if not tenant_authorized(request, tenant, token):
+        return forbidden_response()
+    # 浏览器自动重连时在请求头中带上最后收到的事件ID，首次连接可以通过查询参数指定
+    last_event_id = request.headers.get('last-event-id') or last_event_id
+    subscription = record_hub.subscribe(tenant, last_event_id)
+    if subscription is None:
+        return JSONResponse(
+            status_code=503,
+            content={
+                'code': 503,
+                'message': '实时连接数已达上限',
+                'data': None
+            }
+        )
+    return StreamingResponse(
+        sse_stream(record_hub, *subscription),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.websocket("/api/records/ws")
+async def records_websocket(
+    websocket: WebSocket,
+    last_event_id: Optional[str] = None,
+    tenant: str = DEFAULT_TENANT,
+    token: Optional[str] = None
+):
+    """记录实时推送（WebSocket），消息内容与SSE相同"""
+    if not tenant_authorized(websocket, tenant, token):
+        # 1008：违反策略
+        await websocket.close(code=1008)
+        return
+    subscription = record_hub.subscribe(tenant, last_event_id)
+    if subscription is None:
+        # 1013：稍后重试
+        await websocket.close(code=1013)
+        return
+    await websocket.accept()
+    try:
+        await websocket_session(record_hub, websocket, *subscription)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        # 发送过程中客户端断开
+        print(f"实时推送连接异常: {e}", flush=True)
+
 class MessageRequest:
     def __init__(self, message: str):
         self.message = message
@@ -483,24 +599,133 @@ async def startup_event():
         print("数据库初始化失败", flush=True)
     else:
         print("应用初始化成功", flush=True)
+        # 一次读取近期记录，重建记录间隔统计
+        interval_analytics.rebuild()
+    
+    # 启动写前日志，重放上次未写入数据库的记录；数据库初始化失败时记录也先保存在本地
+    try:
+        write_log.start()
+    except Exception as e:
+        print(f"写前日志启动失败: {e}，记录直接写入数据库", flush=True)
     
     # 检查加密模块
     from config import ENCODING_AES_KEY, CORP_ID
     print(f"企业ID: {CORP_ID}", flush=True)
     print(f"加密密钥长度: {len(ENCODING_AES_KEY) if ENCODING_AES_KEY else 0}", flush=True)
     print(f"加密模块状态: {'已初始化' if wechat_api.crypto else '未初始化'}", flush=True)
+    
+    # 预先获取访问令牌，并在过期前主动续期
+    wechat_api.start_token_refresher()
+    
+    # 启动消息发送队列
+    outbox.start()
+    
+    # 启动消息处理队列
+    if INBOUND_QUEUED:
+        inbound_queue.start()
+    
+    # 启动日报定时推送
+    if REPORT_PUSH_ENABLED:
+        report_scheduler.start(get_daily_report_text)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时执行"""
+    # 先处理完已接收的消息（处理过程中会产生回复），再停止发送线程
+    report_scheduler.stop()
+    inbound_queue.drain()
+    
+    # 停止写库线程，未写入数据库的记录保留在本地日志中，下次启动时重放
+    write_log.stop()
+    
+    # 停止发送线程，未发送的消息保留在本地队列中
+    outbox.stop()
+    wechat_api.stop_token_refresher()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus指标"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/slow-requests")
+async def get_slow_requests(
+    request: Request,
+    limit: int = Query(20, ge=1, le=1000),
+    name: Optional[str] = None,
+    trace_id: Optional[str] = None,
+    format: str = 'json',
+    token: Optional[str] = None
+):
+    """最近最慢的请求及各阶段耗时明细，format=zipkin时导出Zipkin v2格式"""
+    if ADMIN_TOKEN and not hmac.compare_digest(token or request.headers.get('x-admin-token', ''), ADMIN_TOKEN):
+        return JSONResponse(
+            status_code=403,
+            content={
+                'code': 403,
+                'message': '无效的访问令牌',
+                'data': None
+            }
+        )
+    # 指定trace_id时返回该请求及其后台处理的追踪
+    traces = trace_log.find(trace_id.lower()) if trace_id else trace_log.slowest(limit, name)
+    if format == 'zipkin':
+        return JSONResponse([span for trace in traces for span in trace.to_zipkin()])
+    return {
+        'code': 0,
+        'message': 'success',
+        'data': [trace.to_dict() for trace in traces]
+    }
+
+@app.get("/api/inbound/stats")
+async def get_inbound_stats():
+    """获取消息处理队列状态API"""
+    return {
+        'code': 0,
+        'message': 'success',
+        'data': inbound_queue.stats()
+    }
+
+@app.get("/api/outbox/stats")
+async def get_outbox_stats():
+    """获取消息发送队列状态API"""
+    try:
+        return {
+            'code': 0,
+            'message': 'success',
+            'data': outbox.stats()
+        }
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={
+                'code': 500,
+                'message': str(e),
+                'data': None
+            }
+        )
+
+@app.get("/api/wal/stats")
+async def get_wal_stats():
+    """获取写前日志状态API"""
+    return {
+        'code': 0,
+        'message': 'success',
+        'data': write_log.stats()
+    }
 
 @app.get("/daily-report", response_class=HTMLResponse)
 async def get_daily_report(
+    request: Request,
     date: Optional[str] = None,
     user_id: Optional[str] = None,
-    token: Optional[str] = None
+    token: Optional[str] = None,
+    tenant: str = DEFAULT_TENANT
 ):
     """获取日报的API端点"""
     try:
         # 验证token (简单实现，实际应用中应使用更安全的方式)
         today = datetime.now().date().strftime('%Y-%m-%d')
-        expected_token = hashlib.md5(f"baby_report_{today}".encode()).hexdigest()[:10]
+        expected_token = report_link_token(tenant, today)
         
         if token != expected_token:
             return HTMLResponse(content="<h1>无效的访问令牌</h1>", status_code=403)
@@ -509,66 +734,332 @@ async def get_daily_report(
         if not date:
             date = today
         
-        # 生成日报内容
-        report_content = generate_daily_report(date)
+        # 页面中的日报按日期缓存
+        entry = await run_in_threadpool(get_daily_report_entry, tenant, date, 'html')
+        if entry is None:
+            return HTMLResponse(content="<h1>生成日报时出错</h1><p>查询记录失败，请稍后重试</p>", status_code=500)
         
         # 如果指定了用户ID，发送消息到企业微信
         if user_id:
-            wechat_api.send_message(user_id, report_content)
-            return HTMLResponse(content=f"""
-            <html>
-                <head>
-                    <title>日报已发送</title>
-                    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                    <style>
-                        body {{ font-family: Arial, sans-serif; margin: 20px; line-height: 1.6; }}
-                        .container {{ max-width: 600px; margin: 0 auto; }}
-                        .success {{ color: green; }}
-                        pre {{ white-space: pre-wrap; background: #f5f5f5; padding: 15px; border-radius: 5px; }}
-                    </style>
-                </head>
-                <body>
-                    <div class="container">
-                        <h1 class="success">日报已发送！</h1>
-                        <p>日报内容已发送到企业微信。</p>
-                        <h2>日报内容预览：</h2>
-                        <pre>{report_content}</pre>
-                    </div>
-                </body>
-            </html>
-            """)
+            report_content = await run_in_threadpool(generate_daily_report, tenant, date)
+            outbox.enqueue(user_id, report_content)
+            body = f"<p>日报内容已发送到企业微信。</p><h2>日报内容预览：</h2>{entry.content}"
+            return HTMLResponse(content=report_renderer.render_page("日报已发送", body, heading="日报已发送！"))
         
-        # 否则直接显示日报内容
-        return HTMLResponse(content=f"""
-        <html>
-            <head>
-                <title>老三日报 - {date}</title>
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <style>
-                    body {{ font-family: Arial, sans-serif; margin: 20px; line-height: 1.6; }}
-                    .container {{ max-width: 600px; margin: 0 auto; }}
-                    h1 {{ color: #2c3e50; }}
-                    pre {{ white-space: pre-wrap; background: #f5f5f5; padding: 15px; border-radius: 5px; }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <h1>老三日报</h1>
-                    <pre>{report_content}</pre>
-                </div>
-            </body>
-        </html>
-        """)
+        # 否则直接显示日报内容，客户端缓存未失效时返回304
+        headers = {
+            'ETag': entry.etag,
+            'Last-Modified': entry.last_modified_http,
+            'Cache-Control': 'private, no-cache'
+        }
+        if is_not_modified(request, entry):
+            return Response(status_code=304, headers=headers)
+        return HTMLResponse(content=report_renderer.render_page(f"老三日报 - {date}", entry.content, heading="老三日报"),
+                            headers=headers)
     except Exception as e:
         return HTMLResponse(content=f"<h1>生成日报时出错</h1><p>{str(e)}</p>", status_code=500)
 
+@app.get("/api/reports")
+async def get_range_report(
+    request: Request,
+    date: Optional[str] = None,
+    period: str = 'week',
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    format: str = 'text',
+    tenant: str = DEFAULT_TENANT,
+    token: Optional[str] = None
+):
+    """多日报表API，按日期所在的周或月，或指定的起止日期生成报表，以流式响应逐日输出"""
+    if not tenant_authorized(request, tenant, token):
+        return forbidden_response()
+    try:
+        if format not in TEMPLATES:
+            raise ValueError(f"不支持的报表格式: {format}")
+        if start_date or end_date:
+            start_date = start_date or end_date
+            end_date = end_date or start_date
+        else:
+            start_date, end_date = period_range(date or datetime.now().date().strftime('%Y-%m-%d'), period)
+        span = (datetime.strptime(end_date, '%Y-%m-%d') - datetime.strptime(start_date, '%Y-%m-%d')).days
+        if span < 0 or span > REPORT_MAX_RANGE_DAYS:
+            raise ValueError(f"日期范围无效，最多 {REPORT_MAX_RANGE_DAYS + 1} 天")
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={
+                'code': 400,
+                'message': str(e),
+                'data': None
+            }
+        )
+    
+    chunks = report_renderer.iter_range(format, start_date, end_date, db.iter_records_between(tenant, start_date, end_date))
+    if format == 'html':
+        chunks = report_renderer.iter_page(f"老三报表 - {start_date}至{end_date}", chunks, heading="老三报表")
+    try:
+        # 先取第一段，数据库查询失败时仍可返回错误响应
+        first = await run_in_threadpool(next, chunks)
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={
+                'code': 500,
+                'message': str(e),
+                'data': None
+            }
+        )
+    return StreamingResponse(itertools.chain([first], chunks), media_type=MEDIA_TYPES[format])
+
+@app.get("/api/stats")
+async def get_stats(
+    request: Request,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    type: Optional[str] = None,
+    bucket: str = 'day',
+    tenant: str = DEFAULT_TENANT,
+    token: Optional[str] = None
+):
+    """范围统计API，按小时、天或周汇总喂奶量、睡眠时长、尿布次数、体温和喂奶间隔"""
+    if not tenant_authorized(request, tenant, token):
+        return forbidden_response()
+    try:
+        end = end or datetime.now().date().strftime('%Y-%m-%d')
+        start = start or (datetime.strptime(end, '%Y-%m-%d') - timedelta(days=6)).strftime('%Y-%m-%d')
+        data = await run_in_threadpool(compute_stats, tenant, start, end, type, bucket)
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={
+                'code': 400,
+                'message': str(e),
+                'data': None
+            }
+        )
+    if data is None:
+        return JSONResponse(
+            status_code=500,
+            content={
+                'code': 500,
+                'message': '查询统计数据失败',
+                'data': None
+            }
+        )
+    return {
+        'code': 0,
+        'message': 'success',
+        'data': data
+    }
+
+@app.get("/api/search")
+async def search(
+    request: Request,
+    q: str = '',
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    type: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 20,
+    sort: str = 'relevance',
+    tenant: str = DEFAULT_TENANT,
+    token: Optional[str] = None
+):
+    """全文搜索记录描述（原始消息），多个关键词用空格分隔，按相关度或时间排序、分页"""
+    if not tenant_authorized(request, tenant, token):
+        return forbidden_response()
+    # 与记录列表相同，数据版本未变化时返回304
+    etag = data_version.etag(tenant, 'search', q, start, end, type, page, page_size, sort)
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+    try:
+        data = await run_in_threadpool(search_records, tenant, q, start, end, type, page, page_size, sort)
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={
+                'code': 400,
+                'message': str(e),
+                'data': None
+            }
+        )
+    if data is None:
+        return JSONResponse(
+            status_code=500,
+            content={
+                'code': 500,
+                'message': '搜索记录失败',
+                'data': None
+            }
+        )
+    response = json_response({
+        'code': 0,
+        'message': 'success',
+        'data': data
+    }, request.headers.get('accept-encoding'))
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.get("/api/export")
+async def export(
+    request: Request,
+    format: str = 'parquet',
+    since: Optional[str] = None,
+    tenant: str = DEFAULT_TENANT,
+    token: Optional[str] = None
+):
+    """列式导出API，以Parquet或Arrow IPC文件流式返回租户的记录，每个行组从数据库读取一批
+    
+    响应头X-Export-Watermark为本次导出截止的修改时间，下次作为since传入时只导出之后新增、修改和删除的记录
+    """
+    if not tenant_authorized(request, tenant, token):
+        return forbidden_response()
+    if not HAS_PYARROW:
+        return JSONResponse(
+            status_code=503,
+            content={
+                'code': 503,
+                'message': '导出需要安装pyarrow',
+                'data': None
+            }
+        )
+    try:
+        if format not in EXPORT_MEDIA_TYPES:
+            raise ValueError(f"不支持的导出格式: {format}")
+        since_time = datetime.strptime(since, '%Y-%m-%d %H:%M:%S') if since else None
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={
+                'code': 400,
+                'message': str(e),
+                'data': None
+            }
+        )
+    
+    shard = db.shard(tenant)
+    until = await run_in_threadpool(export_until, shard)
+    if until is None:
+        return JSONResponse(
+            status_code=500,
+            content={
+                'code': 500,
+                'message': '导出记录失败',
+                'data': None
+            }
+        )
+    chunks = iter_export(shard, tenant, format, since_time, until)
+    try:
+        # 先取第一段，数据库查询失败时仍可返回错误响应
+        first = await run_in_threadpool(next, chunks)
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={
+                'code': 500,
+                'message': str(e),
+                'data': None
+            }
+        )
+    watermark = until.strftime('%Y-%m-%d %H:%M:%S')
+    filename = f"records-{tenant}-{until:%Y%m%d%H%M%S}.{format}"
+    return StreamingResponse(
+        itertools.chain([first], chunks),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={
+            'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}",
+            'X-Export-Watermark': watermark
+        }
+    )
+
+@app.get("/api/analytics")
+async def get_analytics(
+    request: Request,
+    type: Optional[str] = None,
+    tenant: str = DEFAULT_TENANT,
+    token: Optional[str] = None
+):
+    """记录间隔统计API，返回各类记录距上次的时间、近期平均间隔和预计下次时间"""
+    if not tenant_authorized(request, tenant, token):
+        return forbidden_response()
+    now = datetime.now()
+    if type:
+        summary = interval_analytics.summary(tenant, type, now)
+        types = {type: summary} if summary else {}
+    else:
+        types = interval_analytics.summaries(tenant, now)
+    return {
+        'code': 0,
+        'message': 'success',
+        'data': {
+            'tenant_id': tenant,
+            'now': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'window_size': interval_analytics.window_size,
+            'window_hours': interval_analytics.window_hours,
+            'types': types
+        }
+    }
+
+@app.get("/charts/{metric}")
+async def get_chart(
+    request: Request,
+    metric: str,
+    date: Optional[str] = None,
+    period: str = 'week',
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    tenant: str = DEFAULT_TENANT,
+    token: Optional[str] = None
+):
+    """趋势图API，返回服务端绘制的SVG，metric为feeding、feeds、sleep、diapers或temperature"""
+    if not tenant_authorized(request, tenant, token):
+        return forbidden_response()
+    try:
+        if start or end:
+            start = start or end
+            end = end or start
+        else:
+            start, end = period_range(date or datetime.now().date().strftime('%Y-%m-%d'), period)
+        span = (datetime.strptime(end, '%Y-%m-%d') - datetime.strptime(start, '%Y-%m-%d')).days
+        if span < 0 or span > REPORT_MAX_RANGE_DAYS:
+            raise ValueError(f"日期范围无效，最多 {REPORT_MAX_RANGE_DAYS + 1} 天")
+        entry = await run_in_threadpool(chart_cache.get, tenant, metric, start, end)
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={
+                'code': 400,
+                'message': str(e),
+                'data': None
+            }
+        )
+    if entry is None:
+        return JSONResponse(
+            status_code=500,
+            content={
+                'code': 500,
+                'message': '查询统计数据失败',
+                'data': None
+            }
+        )
+    headers = {
+        'ETag': entry.etag,
+        'Last-Modified': entry.last_modified_http,
+        'Cache-Control': 'private, max-age=60'
+    }
+    if is_not_modified(request, entry):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.content, media_type="image/svg+xml", headers=headers)
+
 @app.get("/report-link", response_class=HTMLResponse)
 async def get_report_link():
-    """获取今日日报链接的API端点"""
+    """获取今日日报链接的API端点（默认租户，其他租户通过发送“日报链接”获取）"""
     try:
         # 生成今天的日期和token
         today = datetime.now().date().strftime('%Y-%m-%d')
-        token = hashlib.md5(f"baby_report_{today}".encode()).hexdigest()[:10]
+        token = report_link_token(DEFAULT_TENANT, today)
         
         # 构建链接
         base_url = f"http://{APP_HOST}:{APP_PORT}"
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""回调解码微基准：对比原先的多次解析流程与decode_callback单次流程
+
+用法: python bench_callback_decode.py [循环次数]
+"""
+
+import os
+import io
+import sys
+import time
+import base64
+import hashlib
+import contextlib
+
+# 使用临时密钥，需在导入wechat之前设置
+os.environ.setdefault('TOKEN', 'benchtoken')
+os.environ.setdefault('CORP_ID', 'wwbench0000000000')
+os.environ.setdefault('ENCODING_AES_KEY', base64.b64encode(os.urandom(32)).decode()[:43])
+
+from wechat import wechat_api
+from config import TOKEN
+from loadtest import CallbackGenerator
+
+def legacy_decode(body, msg_signature, timestamp, nonce):
+    """原先回调处理中的解码流程：字符串解码、两次XML解析、逐步解密"""
+    import xml.etree.ElementTree as ET
+    xml_content_str = body.decode('utf-8')
+    root = ET.fromstring(xml_content_str)
+    encrypted_msg = root.find(".//Encrypt").text
+    array = [TOKEN, timestamp, nonce, encrypted_msg]
+    array.sort()
+    signature = hashlib.sha1(''.join(array).encode('utf-8')).hexdigest()
+    if signature == msg_signature:
+        xml_content_str = wechat_api.crypto.decrypt(encrypted_msg).decode('utf-8')
+    return wechat_api.parse_message(xml_content_str)
+
+def bench(name, func, args, loops):
+    """运行loops次并输出每次耗时"""
+    # 原流程中包含大量调试输出，计时时丢弃，只比较解码本身的开销
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(*args)
+        start = time.perf_counter()
+        for _ in range(loops):
+            func(*args)
+        elapsed = time.perf_counter() - start
+    print(f"{name:<16} {elapsed / loops * 1e6:8.1f} us/次  ({loops / elapsed:,.0f} 次/秒)")
+    return elapsed
+
+def main():
+    loops = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    body, params = CallbackGenerator().build("下午2点30吃奶粉120毫升")
+    args = (body, params['msg_signature'], params['timestamp'], params['nonce'])
+
+    message = wechat_api.decode_callback(*args)
+    assert message is not None and message.content == "下午2点30吃奶粉120毫升"
+
+    print(f"回调解码基准，循环 {loops} 次")
+    legacy = bench("原流程", legacy_decode, args, loops)
+    single = bench("decode_callback", wechat_api.decode_callback, args, loops)
+    print(f"加速比: {legacy / single:.2f}x")
+
+if __name__ == "__main__":
+    main()
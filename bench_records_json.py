@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""记录API序列化基准：对比原先的逐行strftime+FastAPI默认JSON编码与新的响应路径，
+并比较不同压缩方式下的传输字节数
+
+用法: python bench_records_json.py [行数] [循环次数]
+"""
+
+import sys
+import json
+import time
+import random
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import responses
+from responses import dumps, compress, HAS_ORJSON, HAS_BROTLI
+
+SAMPLES = [
+    ('吃', '120', '毫升', '吃奶粉120毫升'),
+    ('大便', None, None, '拉了一坨黄色的便便'),
+    ('小便', None, None, '尿尿一次'),
+    ('睡', '2', '小时', '午睡2小时'),
+    ('体温', '36.5', '℃', '正常体温36.5度'),
+]
+
+
+def make_rows(count):
+    """生成与数据库查询结果结构相同的记录，时间为datetime对象"""
+    random.seed(1)
+    start = datetime(2024, 1, 1)
+    rows = []
+    for i in range(count):
+        record_type, amount, unit, description = random.choice(SAMPLES)
+        record_time = start + timedelta(minutes=37 * i)
+        rows.append({
+            'id': i + 1,
+            'record_time': record_time,
+            'record_type': record_type,
+            'amount': amount,
+            'amount_unit': unit,
+            'description': description,
+            'is_deleted': 0,
+            'created_at': record_time + timedelta(seconds=5),
+        })
+    return rows
+
+
+def legacy(rows):
+    """原流程：逐行strftime，再由FastAPI的jsonable_encoder和json.dumps编码"""
+    records = [dict(row) for row in rows]
+    for record in records:
+        record['record_time'] = record['record_time'].strftime('%Y-%m-%d %H:%M:%S')
+        record['created_at'] = record['created_at'].strftime('%Y-%m-%d %H:%M:%S')
+    return JSONResponse(jsonable_encoder({'code': 0, 'message': 'success', 'data': records})).body
+
+
+def preformatted(rows):
+    """新流程：时间已由数据库DATE_FORMAT格式化，直接序列化"""
+    return dumps({'code': 0, 'message': 'success', 'data': rows})
+
+
+def bench(name, func, rows, loops):
+    """运行loops次并输出每次耗时"""
+    body = func(rows)
+    start = time.perf_counter()
+    for _ in range(loops):
+        func(rows)
+    elapsed = (time.perf_counter() - start) / loops
+    print(f"{name:<28} {elapsed * 1000:8.2f} ms/次  {len(body):>10,} 字节")
+    return body
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    loops = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rows = make_rows(count)
+    formatted = [dict(row, record_time=row['record_time'].strftime('%Y-%m-%d %H:%M:%S'),
+                      created_at=row['created_at'].strftime('%Y-%m-%d %H:%M:%S')) for row in rows]
+
+    print(f"记录API序列化基准，{count} 行，循环 {loops} 次，orjson: {'是' if HAS_ORJSON else '否'}，brotli: {'是' if HAS_BROTLI else '否'}")
+    body = bench("原流程(strftime+默认编码)", legacy, rows, loops)
+    new_body = bench("新流程(SQL格式化+dumps)", preformatted, formatted, loops)
+    bench("新流程(datetime交给dumps)", preformatted, rows, loops)
+    # 两种流程输出的数据必须一致
+    assert json.loads(body) == json.loads(new_body)
+
+    print("\n传输字节数与压缩耗时")
+    print(f"{'不压缩':<28} {'':>8}             {len(new_body):>10,} 字节")
+    for encoding in ('gzip', 'br'):
+        if encoding == 'br' and not HAS_BROTLI:
+            print(f"{'br':<28} 未安装brotli，跳过")
+            continue
+        start = time.perf_counter()
+        for _ in range(loops):
+            compressed, used = compress(new_body, encoding)
+        elapsed = (time.perf_counter() - start) / loops
+        print(f"{used:<28} {elapsed * 1000:8.2f} ms/次  {len(compressed):>10,} 字节 "
+              f"({len(compressed) / len(new_body):.1%})")
+
+    if HAS_ORJSON:
+        # 对比未安装orjson时的后备实现
+        responses.HAS_ORJSON = False
+        bench("新流程(json后备实现)", preformatted, formatted, loops)
+        responses.HAS_ORJSON = True
+
+
+if __name__ == '__main__':
+    main()
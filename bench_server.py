@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""服务进程模式基准：对比单进程uvicorn与gunicorn多工作进程（预加载/不预加载）的
+每秒请求数、延迟和每个工作进程的内存占用
+
+依次启动每种模式的服务，预热后以指定并发持续发送请求，再从 /proc/<pid>/smaps_rollup
+读取主进程和各工作进程的RSS、PSS（按共享进程数分摊后的内存）和USS（进程独占的内存）。
+默认请求 POST /api/test_parser，只做结巴分词和消息解析，不访问数据库。
+
+用法: python bench_server.py [--workers 1 2 4] [--duration 10] [--concurrency 32]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+from loadtest import DEFAULT_CORPUS, percentile
+
+
+def free_port():
+    """获取一个空闲端口"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def children(pid):
+    """进程的直接子进程"""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def memory(pid):
+    """读取进程的RSS、PSS和USS（MB）"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1])
+    uss = values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    return {'rss': values.get('Rss', 0) / 1024, 'pss': values.get('Pss', 0) / 1024, 'uss': uss / 1024}
+
+
+def build_requests(path):
+    """按消息语料生成HTTP/1.1 keep-alive请求"""
+    if path != '/api/test_parser':
+        return [f"GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n".encode()]
+    requests = []
+    for message in DEFAULT_CORPUS:
+        body = json.dumps({'message': message}).encode()
+        requests.append(
+            f"POST {path} HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+    return requests
+
+
+async def client(port, requests, deadline, latencies, errors):
+    """单个连接循环发送请求直到deadline"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    i = 0
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            writer.write(requests[i % len(requests)])
+            i += 1
+            head = await reader.readuntil(b'\r\n\r\n')
+            length = 0
+            for line in head.split(b'\r\n'):
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':', 1)[1])
+            await reader.readexactly(length)
+            if not head.startswith(b'HTTP/1.1 200'):
+                errors.append(head.split(b'\r\n', 1)[0])
+            latencies.append(time.perf_counter() - started)
+    finally:
+        writer.close()
+
+
+async def drive(port, requests, duration, concurrency):
+    """以concurrency个连接持续发送duration秒，返回(延迟列表, 错误列表, 实际耗时)"""
+    latencies, errors = [], []
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(client(port, requests, deadline, latencies, errors) for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def start_server(mode, workers, port, data_dir):
+    """启动服务，返回子进程"""
+    env = dict(os.environ, APP_HOST='127.0.0.1', APP_PORT=str(port), WEB_WORKERS=str(workers),
+               OUTBOX_DB_PATH=os.path.join(data_dir, 'outbox.db'),
+               TOKEN_CACHE_PATH=os.path.join(data_dir, 'access_token.json'),
+               REPORT_PUSH_STATE_PATH=os.path.join(data_dir, 'report_push.json'),
+               DATA_VERSION_PATH=os.path.join(data_dir, 'data_version'),
+               REPORT_PUSH_ENABLED='false', TRACE_ENABLED='true')
+    if mode == 'uvicorn':
+        # 原先Dockerfile中的启动方式，使用asyncio事件循环和h11解析器
+        command = [sys.executable, '-m', 'uvicorn', 'app:app', '--host', '127.0.0.1', '--port', str(port),
+                   '--loop', 'asyncio', '--http', 'h11', '--no-access-log']
+    else:
+        env['WEB_PRELOAD'] = 'true' if mode == 'gunicorn' else 'false'
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--access-logfile', '/dev/null', 'app:app']
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(port, process, workers, timeout=60):
+    """等待服务可以处理请求、所有工作进程启动完成"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"服务启动失败，退出码 {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                if len(children(process.pid)) >= workers or workers == 0:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("等待服务启动超时")
+
+
+def run(mode, workers, args, data_dir):
+    """运行一种模式，返回结果"""
+    port = free_port()
+    process = start_server(mode, workers, port, data_dir)
+    try:
+        wait_ready(port, process, 0 if mode == 'uvicorn' else workers)
+        time.sleep(1)
+        requests = build_requests(args.path)
+        # 预热，使各工作进程完成首次请求的初始化
+        asyncio.run(drive(port, requests, min(2, args.duration), args.concurrency))
+        latencies, errors, elapsed = asyncio.run(drive(port, requests, args.duration, args.concurrency))
+        latencies.sort()
+
+        if mode == 'uvicorn':
+            master, worker_pids = None, [process.pid]
+        else:
+            master, worker_pids = memory(process.pid), children(process.pid)
+        worker_memory = [memory(pid) for pid in worker_pids]
+        return {
+            'mode': mode,
+            'workers': len(worker_pids),
+            'rps': len(latencies) / elapsed,
+            'p50': percentile(latencies, 0.5) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'errors': len(errors),
+            'worker_rss': sum(m['rss'] for m in worker_memory) / len(worker_memory),
+            'worker_pss': sum(m['pss'] for m in worker_memory) / len(worker_memory),
+            'worker_uss': sum(m['uss'] for m in worker_memory) / len(worker_memory),
+            'total_pss': sum(m['pss'] for m in worker_memory) + (master['pss'] if master else 0),
+        }
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="服务进程模式基准")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="gunicorn工作进程数")
+    parser.add_argument('--duration', type=float, default=10, help="每种模式的压测时间（秒）")
+    parser.add_argument('--concurrency', type=int, default=32, help="并发连接数")
+    parser.add_argument('--path', default='/api/test_parser', help="请求路径，除/api/test_parser外使用GET")
+    parser.add_argument('--no-preload-compare', action='store_true', help="不运行不预加载的对照组")
+    args = parser.parse_args()
+
+    cases = [('uvicorn', 1)]
+    for workers in args.workers:
+        cases.append(('gunicorn', workers))
+        if not args.no_preload_compare:
+            cases.append(('gunicorn-no-preload', workers))
+
+    print(f"服务进程模式基准，CPU核数 {len(os.sched_getaffinity(0))}，请求 {args.path}，"
+          f"并发 {args.concurrency}，每种模式 {args.duration:g} 秒")
+    print(f"{'模式':<20}{'进程':>4}{'请求/秒':>10}{'p50(ms)':>10}{'p99(ms)':>10}{'错误':>6}"
+          f"{'每进程RSS':>11}{'每进程PSS':>11}{'每进程USS':>11}{'总PSS':>9}")
+    with tempfile.TemporaryDirectory() as data_dir:
+        for mode, workers in cases:
+            r = run(mode, workers, args, data_dir)
+            print(f"{r['mode']:<20}{r['workers']:>4}{r['rps']:>10,.0f}{r['p50']:>10.2f}{r['p99']:>10.2f}{r['errors']:>6}"
+                  f"{r['worker_rss']:>10.1f}M{r['worker_pss']:>10.1f}M{r['worker_uss']:>10.1f}M{r['total_pss']:>8.1f}M")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+import html
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from config import CHART_CACHE_MAX_ENTRIES
+from db import db
+from data_version import data_version
+from report_cache import CachedReport
+from stats import compute_stats
+
+# 图表尺寸和边距
+WIDTH = 600
+HEIGHT = 240
+MARGIN_LEFT = 44
+MARGIN_RIGHT = 12
+MARGIN_TOP = 32
+MARGIN_BOTTOM = 28
+
+# 可用的图表：标题、单位、图表类型和数据系列(名称, 颜色, 取值函数)
+CHARTS = {
+    'feeding': {
+        'title': '喂奶量',
+        'unit': '毫升',
+        'kind': 'bar',
+        'series': [('喂奶量', '#3498db', lambda item: item['ml_fed'])],
+    },
+    'feeds': {
+        'title': '喂奶次数',
+        'unit': '次',
+        'kind': 'bar',
+        'series': [('喂奶次数', '#5dade2', lambda item: item['feed_count'])],
+    },
+    'sleep': {
+        'title': '睡眠时长',
+        'unit': '小时',
+        'kind': 'bar',
+        'series': [('睡眠', '#8e44ad', lambda item: round(item['sleep_minutes'] / 60, 1))],
+    },
+    'diapers': {
+        'title': '尿布次数',
+        'unit': '次',
+        'kind': 'bar',
+        'series': [
+            ('大便', '#a0522d', lambda item: item['poop_count']),
+            ('小便', '#f1c40f', lambda item: item['pee_count']),
+        ],
+    },
+    'temperature': {
+        'title': '体温',
+        'unit': '℃',
+        'kind': 'line',
+        'series': [
+            ('最高', '#e74c3c', lambda item: item['temperature_max']),
+            ('最低', '#e67e22', lambda item: item['temperature_min']),
+        ],
+    },
+}
+
+
+def nice_ceiling(value):
+    """把坐标轴最大值向上取整到1、2、5乘以10的幂"""
+    if value <= 0:
+        return 1
+    magnitude = 10 ** (len(str(int(value))) - 1)
+    for step in (1, 2, 5, 10):
+        if value <= step * magnitude:
+            return step * magnitude
+    return 10 * magnitude
+
+
+def date_labels(start_date, end_date):
+    """起止日期之间（含）的每一天"""
+    day = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end = datetime.strptime(end_date, '%Y-%m-%d').date()
+    labels = []
+    while day <= end:
+        labels.append(day.strftime('%Y-%m-%d'))
+        day += timedelta(days=1)
+    return labels
+
+
+def render_svg(chart, start_date, end_date, buckets):
+    """把按天汇总的统计结果绘制为SVG"""
+    labels = date_labels(start_date, end_date)
+    by_day = {item['bucket']: item for item in buckets}
+    series = [
+        (name, color, [getter(by_day[label]) if label in by_day else None for label in labels])
+        for name, color, getter in chart['series']
+    ]
+
+    plot_width = WIDTH - MARGIN_LEFT - MARGIN_RIGHT
+    plot_height = HEIGHT - MARGIN_TOP - MARGIN_BOTTOM
+    slot = plot_width / max(1, len(labels))
+    if chart['kind'] == 'bar':
+        peaks = [sum(values[i] or 0 for _, _, values in series) for i in range(len(labels))]
+        low, high = 0, nice_ceiling(max(peaks, default=0))
+    else:
+        points = [v for _, _, values in series for v in values if v is not None]
+        low = int(min(points, default=36)) - 1
+        high = int(max(points, default=37)) + 1
+
+    def y(value):
+        return MARGIN_TOP + plot_height - (value - low) / (high - low) * plot_height
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{WIDTH}" height="{HEIGHT}" viewBox="0 0 {WIDTH} {HEIGHT}" '
+        f'font-family="sans-serif" font-size="11">',
+        f'<rect width="{WIDTH}" height="{HEIGHT}" fill="#ffffff"/>',
+        f'<text x="{MARGIN_LEFT}" y="18" font-size="14" fill="#2c3e50">'
+        f'{html.escape(chart["title"])}（{html.escape(chart["unit"])}） {start_date} 至 {end_date}</text>',
+    ]
+
+    # 纵轴刻度和网格线
+    for i in range(5):
+        value = low + (high - low) * i / 4
+        y_pos = y(value)
+        parts.append(f'<line x1="{MARGIN_LEFT}" y1="{y_pos:.1f}" x2="{WIDTH - MARGIN_RIGHT}" y2="{y_pos:.1f}" stroke="#ecf0f1"/>')
+        parts.append(f'<text x="{MARGIN_LEFT - 4}" y="{y_pos + 4:.1f}" text-anchor="end" fill="#7f8c8d">{value:g}</text>')
+
+    # 横轴日期，天数较多时间隔显示
+    step = max(1, len(labels) // 8)
+    for i, label in enumerate(labels):
+        if i % step == 0:
+            x_pos = MARGIN_LEFT + slot * (i + 0.5)
+            parts.append(f'<text x="{x_pos:.1f}" y="{HEIGHT - 10}" text-anchor="middle" fill="#7f8c8d">{label[5:]}</text>')
+
+    if chart['kind'] == 'bar':
+        bar_width = max(1.0, slot * 0.7)
+        for i in range(len(labels)):
+            base = 0
+            for name, color, values in series:
+                value = values[i] or 0
+                if value:
+                    top = y(base + value)
+                    parts.append(
+                        f'<rect x="{MARGIN_LEFT + slot * i + (slot - bar_width) / 2:.1f}" y="{top:.1f}" '
+                        f'width="{bar_width:.1f}" height="{y(base) - top:.1f}" fill="{color}">'
+                        f'<title>{labels[i]} {html.escape(name)} {value:g}</title></rect>'
+                    )
+                base += value
+    else:
+        for name, color, values in series:
+            coords = [f"{MARGIN_LEFT + slot * (i + 0.5):.1f},{y(v):.1f}" for i, v in enumerate(values) if v is not None]
+            if coords:
+                parts.append(f'<polyline points="{" ".join(coords)}" fill="none" stroke="{color}" stroke-width="2"/>')
+                for coord in coords:
+                    cx, cy = coord.split(',')
+                    parts.append(f'<circle cx="{cx}" cy="{cy}" r="2.5" fill="{color}"/>')
+
+    # 图例
+    legend_x = WIDTH - MARGIN_RIGHT
+    for name, color, _ in reversed(series):
+        legend_x -= 12 + len(name) * 12
+        parts.append(f'<rect x="{legend_x}" y="8" width="10" height="10" fill="{color}"/>')
+        parts.append(f'<text x="{legend_x + 13}" y="17" fill="#2c3e50">{html.escape(name)}</text>')
+
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+class ChartCache:
+    """趋势图缓存
+
+    按(租户, 图表, 起始日期, 结束日期)缓存生成好的SVG。记录写入或删除后，
+    只有该租户日期范围覆盖该记录的图表失效；生成期间发生写入时丢弃生成结果。
+    与日报缓存相同，条目记录生成前的租户数据版本号，其他工作进程写入后重新生成。
+    """
+
+    def __init__(self, max_entries=CHART_CACHE_MAX_ENTRIES, versions=data_version):
+        self.max_entries = max_entries
+        self.versions = versions
+        self._entries = OrderedDict()
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id, metric, start_date, end_date):
+        """获取趋势图，未缓存时查询统计数据并绘制，查询失败时返回None"""
+        if metric not in CHARTS:
+            raise ValueError(f"不支持的图表: {metric}")
+        key = (tenant_id, metric, start_date, end_date)
+        version = self.versions.get(tenant_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version:
+                self._entries.move_to_end(key)
+                return entry
+            writes = self._writes
+
+        data = compute_stats(tenant_id, start_date, end_date, bucket='day')
+        if data is None:
+            return None
+        entry = CachedReport(render_svg(CHARTS[metric], start_date, end_date, data['buckets']), time.time(), version)
+
+        with self._lock:
+            if self._writes == writes:
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, tenant_id, date_str, version=None):
+        """使租户日期范围覆盖date_str的图表失效，其他图表版本号为version-1时更新为version"""
+        with self._lock:
+            self._writes += 1
+            for key in [key for key in self._entries if key[0] == tenant_id and key[2] <= date_str <= key[3]]:
+                del self._entries[key]
+            if version is not None:
+                for key, entry in self._entries.items():
+                    if key[0] == tenant_id and entry.version == version - 1:
+                        entry.version = version
+
+    def on_record_change(self, event):
+        """数据变更监听器"""
+        self.invalidate(event['tenant_id'], event['record_time'].strftime('%Y-%m-%d'), event.get('data_version'))
+
+# 创建趋势图缓存实例，写库后使覆盖该日期的图表失效
+chart_cache = ChartCache()
+db.add_change_listener(chart_cache.on_record_change)
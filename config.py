@@ -10,6 +10,11 @@ AGENT_ID = os.getenv('AGENT_ID', '1000002')
 SECRET = os.getenv('SECRET')
 TOKEN = os.getenv('TOKEN')  # 用于验证URL有效性
 ENCODING_AES_KEY = os.getenv('ENCODING_AES_KEY')  # 消息加解密密钥
+WECHAT_API_BASE_URL = os.getenv('WECHAT_API_BASE_URL', 'https://qyapi.weixin.qq.com/cgi-bin')  # 企业微信API地址，压测时可指向本地模拟服务
+WECHAT_HTTP_TIMEOUT = float(os.getenv('WECHAT_HTTP_TIMEOUT', 10))  # 调用企业微信API的超时时间（秒）
+TOKEN_CACHE_PATH = os.getenv('TOKEN_CACHE_PATH', 'data/access_token.json')  # 多个工作进程共享的访问令牌缓存
+TOKEN_REFRESH_AHEAD = int(os.getenv('TOKEN_REFRESH_AHEAD', 600))  # 令牌过期前多少秒主动续期
+TOKEN_EXPIRY_MARGIN = int(os.getenv('TOKEN_EXPIRY_MARGIN', 60))  # 剩余有效期低于该值的令牌不再使用
 
 # 数据库配置
 DB_CONFIG = {
@@ -23,4 +28,97 @@ DB_CONFIG = {
 
 # 应用配置
 APP_HOST = os.getenv('APP_HOST', '0.0.0.0')
-APP_PORT = int(os.getenv('APP_PORT', 5000)) 
\ No newline at end of file
+APP_PORT = int(os.getenv('APP_PORT', 5000)) 
+
+# 回复方式配置
+REPLY_MODE = os.getenv('REPLY_MODE', 'active')  # active: 通过发送接口主动回复; passive: 短回复直接放在回调响应中
+PASSIVE_REPLY_MAX_BYTES = int(os.getenv('PASSIVE_REPLY_MAX_BYTES', 2048))  # 超过该长度的回复改为主动发送
+PASSIVE_REPLY_DEADLINE = float(os.getenv('PASSIVE_REPLY_DEADLINE', 3))  # 回调处理超过该时间（秒）时改为主动发送
+
+# 消息处理队列配置
+INBOUND_ASYNC = os.getenv('INBOUND_ASYNC', 'true').lower() == 'true'  # 回调入队后立即返回，由后台线程处理
+INBOUND_WORKERS = int(os.getenv('INBOUND_WORKERS', 4))  # 处理线程数，同一发送者的消息总在同一线程中按顺序处理
+INBOUND_QUEUE_SIZE = int(os.getenv('INBOUND_QUEUE_SIZE', 1000))  # 队列总容量，满时回调返回503由企业微信重试
+INBOUND_DRAIN_TIMEOUT = float(os.getenv('INBOUND_DRAIN_TIMEOUT', 10))  # 关闭时等待队列处理完成的时间（秒）
+
+# 消息发送队列配置
+OUTBOX_DB_PATH = os.getenv('OUTBOX_DB_PATH', 'data/outbox.db')  # 本地持久化队列文件
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', 2))  # 发送线程数
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))  # 最大尝试次数，超过后进入死信
+OUTBOX_BASE_DELAY = float(os.getenv('OUTBOX_BASE_DELAY', 1))  # 首次重试等待时间（秒）
+OUTBOX_MAX_DELAY = float(os.getenv('OUTBOX_MAX_DELAY', 300))  # 重试等待时间上限（秒）
+OUTBOX_COALESCE_WINDOW = float(os.getenv('OUTBOX_COALESCE_WINDOW', 3))  # 确认消息合并窗口（秒），0表示不合并
+
+# 发送配额配置（按进程计算，参考企业微信的发送频率限制）
+RATE_LIMIT_APP_PER_MINUTE = int(os.getenv('RATE_LIMIT_APP_PER_MINUTE', 2000))  # 应用每分钟发送上限
+RATE_LIMIT_USER_PER_MINUTE = int(os.getenv('RATE_LIMIT_USER_PER_MINUTE', 30))  # 每个成员每分钟接收上限
+RATE_LIMIT_USER_PER_HOUR = int(os.getenv('RATE_LIMIT_USER_PER_HOUR', 1000))  # 每个成员每小时接收上限
+RATE_LIMIT_CHAT_PER_MINUTE = int(os.getenv('RATE_LIMIT_CHAT_PER_MINUTE', 20))  # 每个群聊每分钟发送上限
+
+# 回调幂等配置
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', 300))  # 已处理消息的记录保留时间（秒）
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', 10000))  # 内存中最多保留的记录数
+IDEMPOTENCY_DB_PATH = os.getenv('IDEMPOTENCY_DB_PATH', '')  # 多进程共享时使用的SQLite文件，留空则只在内存中记录
+
+# 日报缓存配置
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv('REPORT_CACHE_MAX_ENTRIES', 256))  # 缓存的日报数量（按日期和格式计）
+REPORT_MAX_RANGE_DAYS = int(os.getenv('REPORT_MAX_RANGE_DAYS', 366))  # 多日报表最多跨越的天数
+CHART_CACHE_MAX_ENTRIES = int(os.getenv('CHART_CACHE_MAX_ENTRIES', 128))  # 缓存的趋势图数量
+
+# 日报定时推送配置
+REPORT_PUSH_ENABLED = os.getenv('REPORT_PUSH_ENABLED', 'false').lower() == 'true'  # 是否每天自动推送日报
+REPORT_PUSH_TIME = os.getenv('REPORT_PUSH_TIME', '21:00')  # 每天推送的时间（HH:MM）
+REPORT_PUSH_DAY = os.getenv('REPORT_PUSH_DAY', 'today')  # 推送哪一天的日报：today或yesterday
+REPORT_PUSH_RECIPIENTS = os.getenv('REPORT_PUSH_RECIPIENTS', '')  # 接收者，逗号分隔的成员UserID或群聊ChatId
+REPORT_PUSH_JITTER = float(os.getenv('REPORT_PUSH_JITTER', 60))  # 每条推送随机延后的最长时间（秒）
+REPORT_PUSH_CATCHUP_DAYS = int(os.getenv('REPORT_PUSH_CATCHUP_DAYS', 3))  # 重启后最多补推的天数
+REPORT_PUSH_STATE_PATH = os.getenv('REPORT_PUSH_STATE_PATH', 'data/report_push.json')  # 推送状态文件
+
+# 请求追踪配置
+TRACE_ENABLED = os.getenv('TRACE_ENABLED', 'true').lower() == 'true'  # 是否记录每个请求的阶段耗时
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', 1000))  # 保留最近完成的请求追踪数量
+TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'baby-record')  # 导出Zipkin格式时的服务名
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')  # 管理接口的访问令牌，留空则不校验
+
+# 响应压缩配置
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))  # 超过该大小（字节）的JSON响应才压缩
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', 6))  # gzip压缩级别（1-9）
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 5))  # brotli压缩质量（0-11），需要安装brotli
+
+# 生产环境多进程配置（gunicorn.conf.py）
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', 0))  # 工作进程数，0表示按CPU核数
+WEB_PRELOAD = os.getenv('WEB_PRELOAD', 'true').lower() == 'true'  # 主进程是否预加载应用，工作进程共享预加载的内存
+WEB_TIMEOUT = int(os.getenv('WEB_TIMEOUT', 30))  # 工作进程无响应多久后被重启（秒）
+WEB_GRACEFUL_TIMEOUT = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))  # 关闭时等待工作进程处理完消息的时间（秒），应大于INBOUND_DRAIN_TIMEOUT
+WEB_MAX_REQUESTS = int(os.getenv('WEB_MAX_REQUESTS', 0))  # 工作进程处理多少请求后重启，0表示不重启
+
+# 多租户（多个家庭）配置
+DEFAULT_TENANT = os.getenv('DEFAULT_TENANT', 'default')  # 默认租户ID，未配置归属的消息和已有数据属于该租户
+TENANT_AUTO = os.getenv('TENANT_AUTO', 'false').lower() == 'true'  # 未配置的群聊或成员是否自动成为独立租户
+TENANT_CONFIG_PATH = os.getenv('TENANT_CONFIG_PATH', '')  # 租户成员、群聊和数据库分片的配置文件（JSON），留空则只有默认租户
+
+# 记录间隔统计配置
+ANALYTICS_WINDOW_SIZE = int(os.getenv('ANALYTICS_WINDOW_SIZE', 12))  # 每类记录参与平均间隔计算的最近次数
+ANALYTICS_WINDOW_HOURS = int(os.getenv('ANALYTICS_WINDOW_HOURS', 72))  # 只统计距最新一次不超过该时间（小时）的记录，启动时读取该时间内的记录
+
+# 记录实时推送配置（SSE和WebSocket）
+LIVE_REPLAY_SIZE = int(os.getenv('LIVE_REPLAY_SIZE', 200))  # 每个租户保留多少条最近事件，供重连时按Last-Event-ID补发
+LIVE_SUBSCRIBER_BUFFER = int(os.getenv('LIVE_SUBSCRIBER_BUFFER', 100))  # 每个连接最多积压的事件数，超过后断开该连接
+LIVE_MAX_SUBSCRIBERS = int(os.getenv('LIVE_MAX_SUBSCRIBERS', 1000))  # 每个进程的最大实时连接数
+LIVE_HEARTBEAT = float(os.getenv('LIVE_HEARTBEAT', 15))  # 无事件时发送心跳的间隔（秒）
+
+# 数据版本配置（/api/records的ETag）
+DATA_VERSION_PATH = os.getenv('DATA_VERSION_PATH', 'data/data_version')  # 多个工作进程共享的数据版本号文件，留空则只在预加载后fork出的工作进程间共享
+DATA_VERSION_SLOTS = int(os.getenv('DATA_VERSION_SLOTS', 4096))  # 版本号槽位数，租户按哈希分配槽位
+
+# 列式导出配置（Parquet/Arrow IPC）
+EXPORT_DIR = os.getenv('EXPORT_DIR', 'data/export')  # 命令行导出的默认目录
+EXPORT_ROW_GROUP_SIZE = int(os.getenv('EXPORT_ROW_GROUP_SIZE', 10000))  # 每个行组（一次从数据库读取并写入）的记录数
+
+# 写前日志配置（记录先写入本地日志，再由后台线程写入MySQL）
+WAL_ENABLED = os.getenv('WAL_ENABLED', 'true').lower() == 'true'  # 是否启用，关闭后直接写库
+WAL_DIR = os.getenv('WAL_DIR', 'data/wal')  # 日志目录，每个进程使用以进程号命名的子目录，需持久化保存
+WAL_SEGMENT_BYTES = int(os.getenv('WAL_SEGMENT_BYTES', 4 * 1024 * 1024))  # 每个段文件的大小上限（字节），段内日志全部写库后删除
+WAL_APPLY_TIMEOUT = float(os.getenv('WAL_APPLY_TIMEOUT', 2))  # 回调等待写库完成的时间（秒），超时先回复“已记录，数据库同步中”
+WAL_RETRY_MAX_DELAY = float(os.getenv('WAL_RETRY_MAX_DELAY', 30))  # 数据库不可用时重试等待时间上限（秒）
+WAL_MAX_ATTEMPTS = int(os.getenv('WAL_MAX_ATTEMPTS', 5))  # 数据库可连接但写入失败（锁等待超时、死锁等）时最多尝试的次数，之后记入dead.jsonl
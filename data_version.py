@@ -0,0 +1,141 @@
+import os
+import mmap
+import zlib
+import struct
+import weakref
+import hashlib
+import threading
+import multiprocessing
+
+from config import DATA_VERSION_PATH, DATA_VERSION_SLOTS
+from db import db
+
+# 文件锁仅在类Unix系统上可用，用于多个进程同时递增版本号
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+# 文件头为8字节的随机文件标识，之后每个槽位是一个8字节的版本号
+HEADER_SIZE = 8
+SLOT = struct.Struct('<Q')
+
+
+class DataVersion:
+    """按租户单调递增的数据版本号，记录插入、更新、删除后加一
+
+    版本号保存在内存映射文件中，同一台机器上的所有工作进程和命令行工具读写同一份，
+    读取只是一次内存访问。租户按哈希分到固定数量的槽位，不同租户共用槽位时只会让
+    对方的客户端缓存多失效一次。文件标识在创建文件时随机生成，文件被删除重建后
+    之前发出的ETag不会被误认为仍然有效。
+
+    递增时用文件锁在进程间互斥。文件锁属于打开的文件描述，fork出的子进程继承的描述与
+    父进程共用、互相不排斥，所以子进程在fork后重新打开文件；未使用文件时改用fork前
+    创建的进程间锁。
+    """
+
+    def __init__(self, path=DATA_VERSION_PATH, slots=DATA_VERSION_SLOTS):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._fd = None
+        size = HEADER_SIZE + slots * SLOT.size
+        self._map = self._open_file(size) if path else None
+        if self._map is None:
+            # 匿名共享内存，只在预加载后fork出的工作进程之间共享，锁也随之共享
+            self._map = mmap.mmap(-1, size)
+            self._map[:HEADER_SIZE] = os.urandom(HEADER_SIZE)
+            self._lock = multiprocessing.Lock()
+        self.epoch = f"{self._map[:HEADER_SIZE].hex()}.{slots}"
+        if self._fd is not None and hasattr(os, 'register_at_fork'):
+            ref = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: ref() and ref()._after_fork())
+
+    def _open_file(self, size):
+        """打开或创建版本号文件并映射到内存，失败时返回None"""
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except Exception as e:
+            print(f"打开数据版本文件失败: {e}，版本号只在本进程及其子进程内共享", flush=True)
+            return None
+        try:
+            if HAS_FCNTL:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+                if os.pread(fd, HEADER_SIZE, 0) == bytes(HEADER_SIZE):
+                    os.pwrite(fd, os.urandom(HEADER_SIZE), 0)
+            finally:
+                if HAS_FCNTL:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            self._fd = fd
+            return mmap.mmap(fd, size)
+        except Exception as e:
+            os.close(fd)
+            print(f"映射数据版本文件失败: {e}，版本号只在本进程及其子进程内共享", flush=True)
+            return None
+
+    def _after_fork(self):
+        """fork出的子进程重新打开版本号文件，使文件锁在各进程之间互斥"""
+        self._lock = threading.Lock()
+        inherited = self._fd
+        try:
+            fd = os.open(self.path, os.O_RDWR)
+        except OSError as e:
+            print(f"重新打开数据版本文件失败: {e}，递增版本号时可能与其他进程冲突", flush=True)
+            return
+        old, new = os.fstat(inherited), os.fstat(fd)
+        if (old.st_dev, old.st_ino) != (new.st_dev, new.st_ino):
+            # 文件在fork之前被删除或替换，锁住新文件无法保护映射的旧文件
+            os.close(fd)
+            print("数据版本文件已被替换，递增版本号时可能与其他进程冲突", flush=True)
+            return
+        self._fd = fd
+        os.close(inherited)
+
+    def _offset(self, tenant_id):
+        return HEADER_SIZE + zlib.crc32(tenant_id.encode('utf-8')) % self.slots * SLOT.size
+
+    def get(self, tenant_id, snapshot=None):
+        """租户当前的数据版本号，传入snapshot时读取快照中的版本号"""
+        return SLOT.unpack_from(self._map if snapshot is None else snapshot, self._offset(tenant_id))[0]
+
+    def snapshot(self):
+        """所有租户当前版本号的副本，用于先取版本号、再读取多个租户数据的场景"""
+        return bytes(self._map)
+
+    def bump(self, tenant_id):
+        """租户的数据版本号加一，返回新的版本号"""
+        offset = self._offset(tenant_id)
+        with self._lock:
+            if self._fd is not None and HAS_FCNTL:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                version = SLOT.unpack_from(self._map, offset)[0] + 1
+                SLOT.pack_into(self._map, offset, version)
+            finally:
+                if self._fd is not None and HAS_FCNTL:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return version
+
+    def etag(self, tenant_id, *params):
+        """由租户当前版本号和查询参数计算的弱ETag，应在查询数据库之前计算"""
+        key = f"{self.epoch}:{tenant_id}:{self.get(tenant_id)}:{params!r}"
+        return 'W/"' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:20] + '"'
+
+    def on_record_change(self, event):
+        """数据变更监听器：写库提交后递增租户的版本号
+
+        新版本号写入事件的data_version字段。之后的监听器据此判断本次写入之前是否还有
+        其他进程的写入：缓存的版本号正好是data_version减一时，缓存只需按本次变更更新。
+        """
+        event['data_version'] = self.bump(event['tenant_id'])
+
+# 创建数据版本实例，写库后递增版本号
+data_version = DataVersion()
+db.add_change_listener(data_version.on_record_change)
@@ -1,18 +1,70 @@
+import threading
+
 import pymysql
-from config import DB_CONFIG
+from config import DB_CONFIG, DEFAULT_TENANT
+from metrics import stage, timed, DB_CONNECTIONS_OPEN, DB_CONNECTIONS_TOTAL
+from tenancy import shard_router, DEFAULT_SHARD
+
+# 租户字段加入前创建的、不以租户ID开头的索引，迁移时删除
+LEGACY_INDEXES = ['idx_record_time', 'idx_record_type', 'idx_deleted_time', 'idx_deleted_type_time']
 
 class Database:
-    def __init__(self):
-        self.conn = None
-        self.cursor = None
+    """一个数据库实例（分片）的访问，所有查询都限定在一个租户内"""
+    
+    def __init__(self, config=DB_CONFIG, name=DEFAULT_SHARD, listeners=None):
+        self.config = config
+        self.name = name
+        # 连接和游标按线程保存，后台处理线程和请求线程池可以并发访问数据库
+        self._local = threading.local()
+        self._listeners = listeners if listeners is not None else []
+    
+    @property
+    def conn(self):
+        return getattr(self._local, 'conn', None)
+    
+    @conn.setter
+    def conn(self, value):
+        self._local.conn = value
+    
+    @property
+    def cursor(self):
+        return getattr(self._local, 'cursor', None)
+    
+    @cursor.setter
+    def cursor(self, value):
+        self._local.cursor = value
+    
+    def add_change_listener(self, listener):
+        """注册数据变更监听器，写操作提交后以变更事件（字典）调用"""
+        self._listeners.append(listener)
+    
+    def _notify_change(self, tenant_id, action, record_id, record_time, record_type, **fields):
+        """通知监听器数据已变更，action为insert、update或delete"""
+        event = {
+            'tenant_id': tenant_id,
+            'action': action,
+            'id': record_id,
+            'record_time': record_time,
+            'record_type': record_type,
+            **fields
+        }
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"数据变更监听器异常: {e}")
     
     def connect(self):
         """连接到数据库"""
         try:
-            self.conn = pymysql.connect(**DB_CONFIG)
+            with stage('db.connect'):
+                self.conn = pymysql.connect(**self.config)
+            DB_CONNECTIONS_TOTAL.inc('ok')
+            DB_CONNECTIONS_OPEN.inc()
             self.cursor = self.conn.cursor(pymysql.cursors.DictCursor)
             return True
         except Exception as e:
+            DB_CONNECTIONS_TOTAL.inc('error')
             print(f"数据库连接错误: {e}")
             return False
     
@@ -20,9 +72,13 @@ class Database:
         """关闭数据库连接"""
         if self.cursor:
             self.cursor.close()
+            self.cursor = None
         if self.conn:
             self.conn.close()
+            self.conn = None
+            DB_CONNECTIONS_OPEN.dec()
     
+    @timed('db.init_db')
     def init_db(self):
         """初始化数据库表结构"""
         try:
@@ -32,13 +88,15 @@ class Database:
             create_table_sql = """
             CREATE TABLE IF NOT EXISTS baby_records (
                 id INT AUTO_INCREMENT PRIMARY KEY,
+                tenant_id VARCHAR(64) NOT NULL DEFAULT '' COMMENT '租户（家庭）ID',
                 record_time DATETIME NOT NULL,
                 record_type ENUM('吃', '大便', '小便', '睡', '体温', '吃药', '其他') NOT NULL,
                 amount VARCHAR(50),
                 amount_unit VARCHAR(20),
                 description TEXT,
                 is_deleted TINYINT(1) DEFAULT 0 COMMENT '是否删除：0-未删除，1-已删除',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '最后修改时间，用于增量导出'
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
             """
             self.cursor.execute(create_table_sql)
@@ -111,6 +169,61 @@ class Database:
             except Exception as e:
                 print(f"检查或更新字段错误: {e}")
             
+            # 检查是否需要添加tenant_id字段，已有数据归属默认租户
+            try:
+                check_column_sql = """
+                SELECT COUNT(*) as count FROM information_schema.columns 
+                WHERE table_schema = DATABASE() 
+                AND table_name = 'baby_records' 
+                AND column_name = 'tenant_id'
+                """
+                self.cursor.execute(check_column_sql)
+                result = self.cursor.fetchone()
+                if result and result['count'] == 0:
+                    alter_table_sql = """
+                    ALTER TABLE baby_records 
+                    ADD COLUMN tenant_id VARCHAR(64) NOT NULL DEFAULT '' COMMENT '租户（家庭）ID' AFTER id
+                    """
+                    self.cursor.execute(alter_table_sql)
+                    print("已添加tenant_id字段到baby_records表")
+                self.cursor.execute("UPDATE baby_records SET tenant_id = %s WHERE tenant_id = ''", (DEFAULT_TENANT,))
+                if self.cursor.rowcount:
+                    print(f"已将 {self.cursor.rowcount} 条记录归属默认租户 {DEFAULT_TENANT}")
+            except Exception as e:
+                print(f"检查或更新租户字段错误: {e}")
+            
+            # 检查是否需要添加updated_at字段，修改和删除（标记删除）时自动更新
+            try:
+                check_column_sql = """
+                SELECT COUNT(*) as count FROM information_schema.columns 
+                WHERE table_schema = DATABASE() 
+                AND table_name = 'baby_records' 
+                AND column_name = 'updated_at'
+                """
+                self.cursor.execute(check_column_sql)
+                result = self.cursor.fetchone()
+                if result and result['count'] == 0:
+                    alter_table_sql = """
+                    ALTER TABLE baby_records 
+                    ADD COLUMN updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP 
+                    COMMENT '最后修改时间，用于增量导出'
+                    """
+                    self.cursor.execute(alter_table_sql)
+                    print("已添加updated_at字段到baby_records表")
+            except Exception as e:
+                print(f"检查或添加修改时间字段错误: {e}")
+            
+            # 所有索引以租户ID开头，查询只扫描一个租户的数据
+            self._ensure_index('idx_tenant_time', 'tenant_id, is_deleted, record_time, record_type, amount_unit, amount')
+            self._ensure_index('idx_tenant_type_time', 'tenant_id, is_deleted, record_type, record_time')
+            # 增量导出按修改时间读取所有租户的变更
+            self._ensure_index('idx_updated', 'updated_at')
+            for index_name in LEGACY_INDEXES:
+                self._drop_index(index_name)
+            
+            # 原始消息的全文索引，ngram分词器按相邻两个字切分，适用于中文
+            self._ensure_index('ft_description', 'description', kind='FULLTEXT INDEX', options=' WITH PARSER ngram')
+            
             self.conn.commit()
             return True
         except Exception as e:
@@ -119,17 +232,53 @@ class Database:
         finally:
             self.close()
     
-    def insert_record(self, record_time, record_type, amount=None, amount_unit=None, description=None):
+    def _ensure_index(self, index_name, columns, kind='INDEX', options=''):
+        """索引不存在时创建索引，kind可以为FULLTEXT INDEX，options为建索引语句的附加部分"""
+        try:
+            check_index_sql = """
+            SELECT COUNT(*) as count FROM information_schema.statistics 
+            WHERE table_schema = DATABASE() 
+            AND table_name = 'baby_records' 
+            AND index_name = %s
+            """
+            self.cursor.execute(check_index_sql, (index_name,))
+            result = self.cursor.fetchone()
+            if result and result['count'] == 0:
+                self.cursor.execute(f"CREATE {kind} {index_name} ON baby_records ({columns}){options}")
+                print(f"已创建索引 {index_name}")
+        except Exception as e:
+            print(f"检查或创建索引错误: {e}")
+    
+    def _drop_index(self, index_name):
+        """索引存在时删除索引"""
+        try:
+            check_index_sql = """
+            SELECT COUNT(*) as count FROM information_schema.statistics 
+            WHERE table_schema = DATABASE() 
+            AND table_name = 'baby_records' 
+            AND index_name = %s
+            """
+            self.cursor.execute(check_index_sql, (index_name,))
+            result = self.cursor.fetchone()
+            if result and result['count'] > 0:
+                self.cursor.execute(f"DROP INDEX {index_name} ON baby_records")
+                print(f"已删除索引 {index_name}")
+        except Exception as e:
+            print(f"检查或删除索引错误: {e}")
+    
+    @timed('db.insert_record')
+    def insert_record(self, tenant_id, record_time, record_type, amount=None, amount_unit=None, description=None):
         """插入一条婴儿记录"""
+        self._local.last_error = None
         try:
             self.connect()
             
             # 检查是否存在相同时间和类型的记录
             check_sql = """
             SELECT id, amount, amount_unit, description FROM baby_records 
-            WHERE record_time = %s AND record_type = %s AND is_deleted = 0
+            WHERE tenant_id = %s AND is_deleted = 0 AND record_type = %s AND record_time = %s
             """
-            self.cursor.execute(check_sql, (record_time, record_type))
+            self.cursor.execute(check_sql, (tenant_id, record_type, record_time))
             existing_record = self.cursor.fetchone()
             
             if existing_record:
@@ -141,6 +290,8 @@ class Database:
                 """
                 self.cursor.execute(update_sql, (amount, amount_unit, description, existing_record['id']))
                 self.conn.commit()
+                self._notify_change(tenant_id, 'update', existing_record['id'], record_time, record_type,
+                                    amount=amount, amount_unit=amount_unit, description=description)
                 return {
                     'id': existing_record['id'],
                     'is_update': True,
@@ -151,32 +302,90 @@ class Database:
             else:
                 # 不存在相同记录，插入新记录
                 sql = """
-                INSERT INTO baby_records (record_time, record_type, amount, amount_unit, description)
-                VALUES (%s, %s, %s, %s, %s)
+                INSERT INTO baby_records (tenant_id, record_time, record_type, amount, amount_unit, description)
+                VALUES (%s, %s, %s, %s, %s, %s)
                 """
-                self.cursor.execute(sql, (record_time, record_type, amount, amount_unit, description))
+                self.cursor.execute(sql, (tenant_id, record_time, record_type, amount, amount_unit, description))
                 self.conn.commit()
+                record_id = self.cursor.lastrowid
+                self._notify_change(tenant_id, 'insert', record_id, record_time, record_type,
+                                    amount=amount, amount_unit=amount_unit, description=description)
                 return {
-                    'id': self.cursor.lastrowid,
+                    'id': record_id,
                     'is_update': False
                 }
         except Exception as e:
             print(f"插入记录错误: {e}")
+            self._local.last_error = e
             return None
         finally:
             self.close()
             
-    def delete_record(self, record_time, record_type):
+    @timed('db.insert_records')
+    def insert_records(self, tenant_id, rows):
+        """批量插入记录，rows为(record_time, record_type, amount, amount_unit, description)列表
+        
+        与insert_record不同，同一租户已存在相同时间和类型的记录时跳过而不是更新，重复导入不会改动已有记录；
+        批次内相同时间和类型的记录以最后一条为准。多行INSERT在一个事务中提交，返回(插入数, 跳过数)，失败时返回None
+        """
+        if not rows:
+            return 0, 0
+        try:
+            self.connect()
+            
+            # 批次内去重，后面的记录覆盖前面的
+            unique = {}
+            for row in rows:
+                unique[(row[0], row[1])] = row
+            
+            # 一次查询批次时间范围内已有的记录
+            times = [row[0] for row in unique.values()]
+            range_sql = """
+            SELECT id, record_time, record_type FROM baby_records 
+            WHERE tenant_id = %s AND is_deleted = 0 AND record_time >= %s AND record_time <= %s
+            """
+            range_params = (tenant_id, min(times), max(times))
+            self.cursor.execute(range_sql, range_params)
+            existing = {(item['record_time'], item['record_type']) for item in self.cursor.fetchall()}
+            new_rows = [row for key, row in unique.items() if key not in existing]
+            if not new_rows:
+                return 0, len(rows)
+            
+            # pymysql把executemany的INSERT ... VALUES合并为多行INSERT
+            self.cursor.executemany("""
+            INSERT INTO baby_records (tenant_id, record_time, record_type, amount, amount_unit, description)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            """, [(tenant_id,) + tuple(row) for row in new_rows])
+            # 同一事务内再查询一次，取得新记录的ID
+            self.cursor.execute(range_sql, range_params)
+            ids = {(item['record_time'], item['record_type']): item['id'] for item in self.cursor.fetchall()}
+            self.conn.commit()
+            
+            for row in new_rows:
+                self._notify_change(tenant_id, 'insert', ids.get((row[0], row[1])), row[0], row[1],
+                                    amount=row[2], amount_unit=row[3], description=row[4])
+            return len(new_rows), len(rows) - len(new_rows)
+        except Exception as e:
+            print(f"批量插入记录错误: {e}")
+            if self.conn:
+                self.conn.rollback()
+            return None
+        finally:
+            self.close()
+    
+    @timed('db.delete_record')
+    def delete_record(self, tenant_id, record_time, record_type):
         """删除一条婴儿记录（标记为已删除）"""
+        self._local.last_error = None
         try:
             self.connect()
             
             # 查找匹配的记录
             find_sql = """
             SELECT id, amount, amount_unit, description FROM baby_records 
-            WHERE record_time = %s AND record_type = %s AND is_deleted = 0
+            WHERE tenant_id = %s AND is_deleted = 0 AND record_type = %s AND record_time = %s
             """
-            self.cursor.execute(find_sql, (record_time, record_type))
+            self.cursor.execute(find_sql, (tenant_id, record_type, record_time))
             record = self.cursor.fetchone()
             
             if not record:
@@ -189,6 +398,7 @@ class Database:
             """
             self.cursor.execute(delete_sql, (record['id'],))
             self.conn.commit()
+            self._notify_change(tenant_id, 'delete', record['id'], record_time, record_type)
             
             return {
                 'id': record['id'],
@@ -198,16 +408,22 @@ class Database:
             }
         except Exception as e:
             print(f"删除记录错误: {e}")
+            self._local.last_error = e
             return None
         finally:
             self.close()
             
-    def get_records(self, start_date=None, end_date=None, record_type=None, limit=100):
-        """获取婴儿记录"""
+    @timed('db.get_records')
+    def get_records(self, tenant_id, start_date=None, end_date=None, record_type=None, limit=100):
+        """获取婴儿记录，时间字段由数据库格式化为 YYYY-MM-DD HH:MM:SS 字符串，查询失败时返回None"""
         try:
             self.connect()
-            sql = "SELECT * FROM baby_records WHERE is_deleted = 0"
-            params = []
+            sql = """
+            SELECT id, DATE_FORMAT(record_time, '%%Y-%%m-%%d %%H:%%i:%%s') AS record_time, record_type,
+                   amount, amount_unit, description, is_deleted,
+                   DATE_FORMAT(created_at, '%%Y-%%m-%%d %%H:%%i:%%s') AS created_at
+            FROM baby_records WHERE tenant_id = %s AND is_deleted = 0"""
+            params = [tenant_id]
             
             if start_date:
                 sql += " AND record_time >= %s"
@@ -228,11 +444,268 @@ class Database:
             return self.cursor.fetchall()
         except Exception as e:
             print(f"获取记录错误: {e}")
-            return []
+            return None
         finally:
             self.close()
             
-    def get_daily_records(self, date):
+    def iter_records_between(self, tenant_id, start_date, end_date, batch_size=500):
+        """按时间顺序逐批读取日期范围内的记录，使用服务端游标，结果不会一次全部加载到内存
+        
+        返回生成器，迭代期间占用一个独立的数据库连接，查询失败时抛出异常
+        """
+        try:
+            with stage('db.connect'):
+                conn = pymysql.connect(**self.config)
+        except Exception:
+            DB_CONNECTIONS_TOTAL.inc('error')
+            raise
+        DB_CONNECTIONS_TOTAL.inc('ok')
+        DB_CONNECTIONS_OPEN.inc()
+        cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+        try:
+            sql = """
+            SELECT id, record_time, record_type, amount, amount_unit, description FROM baby_records 
+            WHERE tenant_id = %s 
+            AND is_deleted = 0 
+            AND record_time >= %s 
+            AND record_time <= %s 
+            ORDER BY record_time
+            """
+            with stage('db.iter_records_between'):
+                cursor.execute(sql, (tenant_id, f"{start_date} 00:00:00", f"{end_date} 23:59:59"))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+            conn.close()
+            DB_CONNECTIONS_OPEN.dec()
+    
+    def iter_recent_records(self, since, tenant_id=None, batch_size=1000):
+        """逐批读取所有租户（或指定租户）在指定时间之后的记录，用于重建内存中的统计
+        
+        返回生成器，使用服务端游标和独立的数据库连接，查询失败时抛出异常
+        """
+        try:
+            with stage('db.connect'):
+                conn = pymysql.connect(**self.config)
+        except Exception:
+            DB_CONNECTIONS_TOTAL.inc('error')
+            raise
+        DB_CONNECTIONS_TOTAL.inc('ok')
+        DB_CONNECTIONS_OPEN.inc()
+        cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+        try:
+            # 调用方不依赖结果顺序，不排序以免数据库额外排序
+            sql = """
+            SELECT tenant_id, record_time, record_type, amount, amount_unit FROM baby_records 
+            WHERE is_deleted = 0 AND record_time >= %s
+            """
+            params = [since]
+            if tenant_id is not None:
+                sql += " AND tenant_id = %s"
+                params.append(tenant_id)
+            with stage('db.iter_recent_records'):
+                cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+            conn.close()
+            DB_CONNECTIONS_OPEN.dec()
+    
+    def iter_changed_records(self, until, since=None, tenant_id=None, batch_size=1000):
+        """按租户和记录时间顺序逐批读取修改时间在[since, until)内的记录，用于导出
+        
+        since为None时为全量导出，只读取未删除的记录；增量导出包含被标记删除的记录，
+        由is_deleted标明。返回生成器，使用服务端游标和独立的数据库连接，查询失败时抛出异常
+        """
+        try:
+            with stage('db.connect'):
+                conn = pymysql.connect(**self.config)
+        except Exception:
+            DB_CONNECTIONS_TOTAL.inc('error')
+            raise
+        DB_CONNECTIONS_TOTAL.inc('ok')
+        DB_CONNECTIONS_OPEN.inc()
+        cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+        try:
+            conditions = ["updated_at < %s"]
+            params = [until]
+            if since is None:
+                conditions.append("is_deleted = 0")
+            else:
+                conditions.append("updated_at >= %s")
+                params.append(since)
+            if tenant_id is not None:
+                conditions.append("tenant_id = %s")
+                params.append(tenant_id)
+            sql = f"""
+            SELECT id, tenant_id, record_time, record_type, amount, amount_unit, description, is_deleted, updated_at 
+            FROM baby_records 
+            WHERE {' AND '.join(conditions)} 
+            ORDER BY tenant_id, record_time, id
+            """
+            with stage('db.iter_changed_records'):
+                cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+            conn.close()
+            DB_CONNECTIONS_OPEN.dec()
+    
+    def is_available(self):
+        """能否连接数据库，用于区分写入失败是数据库不可用还是数据本身的问题"""
+        try:
+            if not self.connect():
+                return False
+            self.cursor.execute("SELECT 1")
+            return True
+        except Exception as e:
+            print(f"数据库不可用: {e}")
+            return False
+        finally:
+            self.close()
+    
+    def last_error(self):
+        """当前线程上一次insert_record或delete_record的异常，成功或未找到要删除的记录时为None"""
+        return getattr(self._local, 'last_error', None)
+    
+    def get_db_time(self):
+        """数据库当前时间（与updated_at同一时钟和时区），查询失败时返回None"""
+        try:
+            self.connect()
+            self.cursor.execute("SELECT NOW() AS now")
+            return self.cursor.fetchone()['now']
+        except Exception as e:
+            print(f"查询数据库时间错误: {e}")
+            return None
+        finally:
+            self.close()
+    
+    @timed('db.get_bucket_stats')
+    def get_bucket_stats(self, tenant_id, start_time, end_time, bucket_expr, record_type=None):
+        """按时间桶在数据库中汇总记录，返回每个桶一行的统计结果，查询失败时返回None
+        
+        bucket_expr为按record_time计算桶标签的SQL表达式，只能使用内部定义的表达式
+        """
+        try:
+            self.connect()
+            sql = f"""
+            SELECT {bucket_expr} AS bucket,
+                COUNT(*) AS total,
+                SUM(record_type = '吃') AS feed_count,
+                SUM(CASE WHEN record_type = '吃' AND amount_unit = '毫升' THEN CAST(amount AS DECIMAL(10, 2)) END) AS ml_fed,
+                SUM(record_type = '吃' AND amount_unit = '毫升') AS ml_feed_count,
+                SUM(record_type = '睡') AS sleep_count,
+                SUM(CASE WHEN record_type = '睡' THEN
+                    CASE amount_unit
+                        WHEN '小时' THEN CAST(amount AS DECIMAL(10, 2)) * 60
+                        WHEN '分钟' THEN CAST(amount AS DECIMAL(10, 2))
+                        WHEN '秒' THEN CAST(amount AS DECIMAL(10, 2)) / 60
+                    END
+                END) AS sleep_minutes,
+                SUM(record_type = '大便') AS poop_count,
+                SUM(record_type = '小便') AS pee_count,
+                MIN(CASE WHEN record_type = '体温' THEN CAST(amount AS DECIMAL(5, 2)) END) AS temperature_min,
+                MAX(CASE WHEN record_type = '体温' THEN CAST(amount AS DECIMAL(5, 2)) END) AS temperature_max,
+                SUM(record_type = '吃药') AS medicine_count
+            FROM baby_records
+            WHERE tenant_id = %s AND is_deleted = 0 AND record_time >= %s AND record_time < %s
+            """
+            params = [tenant_id, start_time, end_time]
+            if record_type:
+                sql += " AND record_type = %s"
+                params.append(record_type)
+            sql += " GROUP BY bucket ORDER BY bucket"
+            self.cursor.execute(sql, params)
+            return self.cursor.fetchall()
+        except Exception as e:
+            print(f"获取统计数据错误: {e}")
+            return None
+        finally:
+            self.close()
+    
+    @timed('db.get_record_times')
+    def get_record_times(self, tenant_id, start_time, end_time, record_type, bucket_expr):
+        """按时间顺序获取某类记录的(桶标签, 距1970-01-01的秒数)列，查询失败时返回None"""
+        try:
+            self.connect()
+            sql = f"""
+            SELECT {bucket_expr} AS bucket, TIMESTAMPDIFF(SECOND, '1970-01-01', record_time) AS seconds
+            FROM baby_records
+            WHERE tenant_id = %s AND is_deleted = 0 AND record_type = %s AND record_time >= %s AND record_time < %s
+            ORDER BY record_time
+            """
+            # 只需要两列，使用元组游标避免为每行构造字典
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute(sql, (tenant_id, record_type, start_time, end_time))
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+        except Exception as e:
+            print(f"获取记录时间错误: {e}")
+            return None
+        finally:
+            self.close()
+    
+    @timed('db.search_records')
+    def search_records(self, tenant_id, query, start_time=None, end_time=None, record_type=None,
+                       limit=20, offset=0, order_by_time=False):
+        """用全文索引搜索记录描述，query为布尔模式查询
+        
+        返回(匹配总数, 当前页记录)，记录中的score为相关度，查询失败时返回None
+        """
+        try:
+            self.connect()
+            from_sql = """
+            FROM baby_records
+            WHERE MATCH(description) AGAINST (%s IN BOOLEAN MODE) AND tenant_id = %s AND is_deleted = 0"""
+            params = [query, tenant_id]
+            
+            if start_time:
+                from_sql += " AND record_time >= %s"
+                params.append(start_time)
+            
+            if end_time:
+                from_sql += " AND record_time < %s"
+                params.append(end_time)
+            
+            if record_type:
+                from_sql += " AND record_type = %s"
+                params.append(record_type)
+            
+            self.cursor.execute("SELECT COUNT(*) AS total" + from_sql, params)
+            total = self.cursor.fetchone()['total']
+            if total <= offset:
+                return total, []
+            
+            sql = """
+            SELECT id, DATE_FORMAT(record_time, '%%Y-%%m-%%d %%H:%%i:%%s') AS record_time, record_type,
+                   amount, amount_unit, description,
+                   MATCH(description) AGAINST (%s IN BOOLEAN MODE) AS score""" + from_sql
+            sql += " ORDER BY record_time DESC" if order_by_time else " ORDER BY score DESC, record_time DESC"
+            sql += " LIMIT %s OFFSET %s"
+            self.cursor.execute(sql, [query] + params + [limit, offset])
+            return total, self.cursor.fetchall()
+        except Exception as e:
+            print(f"搜索记录错误: {e}")
+            return None
+        finally:
+            self.close()
+    
+    @timed('db.get_daily_records')
+    def get_daily_records(self, tenant_id, date):
         """获取指定日期的所有记录，按记录类型分组"""
         try:
             self.connect()
@@ -244,12 +717,13 @@ class Database:
             # 获取所有记录
             sql = """
             SELECT * FROM baby_records 
-            WHERE is_deleted = 0 
+            WHERE tenant_id = %s 
+            AND is_deleted = 0 
             AND record_time >= %s 
             AND record_time <= %s 
             ORDER BY record_type, record_time
             """
-            self.cursor.execute(sql, (start_date, end_date))
+            self.cursor.execute(sql, (tenant_id, start_date, end_date))
             records = self.cursor.fetchall()
             
             # 按记录类型分组
@@ -263,9 +737,83 @@ class Database:
             return grouped_records
         except Exception as e:
             print(f"获取日期记录错误: {e}")
-            return {}
+            return None
         finally:
             self.close()
 
-# 创建数据库实例
-db = Database() 
\ No newline at end of file
+class ShardedDatabase:
+    """按租户路由到分片的数据库访问入口
+    
+    方法与Database相同，第一个参数为租户ID，由分片路由决定访问哪个数据库实例。
+    所有分片共用一组数据变更监听器。
+    """
+    
+    def __init__(self, router=shard_router):
+        self.router = router
+        self._listeners = []
+        self._shards = {
+            name: Database(config, name, self._listeners)
+            for name, config in router.configs.items()
+        }
+    
+    def shard(self, tenant_id):
+        """租户所在分片的Database"""
+        return self._shards[self.router.shard_for(tenant_id)]
+    
+    @property
+    def shards(self):
+        """分片名 -> Database，用于按分片进行的批量操作（各分片的数据库时钟可能不同）"""
+        return dict(self._shards)
+    
+    def add_change_listener(self, listener):
+        """注册数据变更监听器，事件中包含tenant_id"""
+        self._listeners.append(listener)
+    
+    def init_db(self):
+        """初始化所有分片的表结构，全部成功时返回True"""
+        results = [shard.init_db() for shard in self._shards.values()]
+        return all(results)
+    
+    def insert_record(self, tenant_id, *args, **kwargs):
+        return self.shard(tenant_id).insert_record(tenant_id, *args, **kwargs)
+    
+    def insert_records(self, tenant_id, *args, **kwargs):
+        return self.shard(tenant_id).insert_records(tenant_id, *args, **kwargs)
+    
+    def delete_record(self, tenant_id, *args, **kwargs):
+        return self.shard(tenant_id).delete_record(tenant_id, *args, **kwargs)
+    
+    def is_available(self, tenant_id):
+        return self.shard(tenant_id).is_available()
+    
+    def last_error(self, tenant_id):
+        return self.shard(tenant_id).last_error()
+    
+    def get_records(self, tenant_id, *args, **kwargs):
+        return self.shard(tenant_id).get_records(tenant_id, *args, **kwargs)
+    
+    def iter_records_between(self, tenant_id, *args, **kwargs):
+        return self.shard(tenant_id).iter_records_between(tenant_id, *args, **kwargs)
+    
+    def iter_recent_records(self, since, tenant_id=None, batch_size=1000):
+        """依次读取所有分片在指定时间之后的记录，指定租户时只读取其所在分片"""
+        if tenant_id is not None:
+            yield from self.shard(tenant_id).iter_recent_records(since, tenant_id, batch_size)
+            return
+        for shard in self._shards.values():
+            yield from shard.iter_recent_records(since, batch_size=batch_size)
+    
+    def get_bucket_stats(self, tenant_id, *args, **kwargs):
+        return self.shard(tenant_id).get_bucket_stats(tenant_id, *args, **kwargs)
+    
+    def get_record_times(self, tenant_id, *args, **kwargs):
+        return self.shard(tenant_id).get_record_times(tenant_id, *args, **kwargs)
+    
+    def get_daily_records(self, tenant_id, *args, **kwargs):
+        return self.shard(tenant_id).get_daily_records(tenant_id, *args, **kwargs)
+    
+    def search_records(self, tenant_id, *args, **kwargs):
+        return self.shard(tenant_id).search_records(tenant_id, *args, **kwargs)
+
+# 创建数据库实例，按租户路由到分片
+db = ShardedDatabase() 
\ No newline at end of file
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""记录的列式导出（Parquet或Arrow IPC）
+
+使用服务端游标逐批读取baby_records，每批写成一个行组，内存占用与总记录数无关。
+命令行导出按租户和月份分区写入目录：
+
+    <目录>/tenant=<租户ID>/month=2025-05/part-20250601120000-default.parquet
+
+目录中的 _export_state.json 保存每个数据库分片已导出到的修改时间（水位），
+再次运行只追加修改时间在水位之后的记录（新增、修改和标记删除），写成新的part文件。
+同一记录修改后会出现在多个part文件中，读取时按id保留updated_at最新的一行，并过滤is_deleted。
+
+用法:
+    python export_records.py data/export
+    python export_records.py data/export --format arrow --row-group-size 50000
+"""
+
+import os
+import sys
+import json
+import argparse
+from datetime import datetime, timedelta
+from itertools import islice
+from urllib.parse import quote
+
+from config import EXPORT_DIR, EXPORT_ROW_GROUP_SIZE
+from analytics import to_amount
+from report_render import RECORD_TYPES
+
+# pyarrow为可选依赖，未安装时导出不可用
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# 导出格式 -> 文件扩展名
+EXTENSIONS = {
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+
+# 导出格式 -> 响应类型
+EXPORT_MEDIA_TYPES = {
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file',
+}
+
+# 导出目录中保存水位的文件
+STATE_FILE = '_export_state.json'
+
+# 水位比数据库当前时间早的秒数，留给执行中的写入事务提交，避免漏掉修改时间早于水位但尚未提交的记录
+SETTLE_SECONDS = 5
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+if HAS_PYARROW:
+    # 记录类型使用固定字典编码，所有批次共用同一字典，Arrow IPC文件格式要求字典不变
+    RECORD_TYPE_DICTIONARY = pa.array(RECORD_TYPES, pa.string())
+    RECORD_TYPE_INDEX = {record_type: index for index, record_type in enumerate(RECORD_TYPES)}
+
+    SCHEMA = pa.schema([
+        ('id', pa.int64()),
+        ('tenant_id', pa.string()),
+        ('record_time', pa.timestamp('s')),
+        ('record_type', pa.dictionary(pa.int8(), pa.string())),
+        # amount为数字，无法转换的原始内容（如“一边”）保留在amount_text中
+        ('amount', pa.float64()),
+        ('amount_text', pa.string()),
+        ('amount_unit', pa.string()),
+        ('description', pa.string()),
+        ('is_deleted', pa.bool_()),
+        ('updated_at', pa.timestamp('s')),
+    ])
+
+
+def to_batch(rows):
+    """把数据库行转换为Arrow RecordBatch"""
+    record_types = pa.DictionaryArray.from_arrays(
+        pa.array([RECORD_TYPE_INDEX.get(row['record_type']) for row in rows], pa.int8()),
+        RECORD_TYPE_DICTIONARY
+    )
+    return pa.RecordBatch.from_arrays([
+        pa.array([row['id'] for row in rows], pa.int64()),
+        pa.array([row['tenant_id'] for row in rows], pa.string()),
+        pa.array([row['record_time'] for row in rows], pa.timestamp('s')),
+        record_types,
+        pa.array([to_amount(row['amount']) for row in rows], pa.float64()),
+        pa.array([row['amount'] for row in rows], pa.string()),
+        pa.array([row['amount_unit'] for row in rows], pa.string()),
+        pa.array([row['description'] for row in rows], pa.string()),
+        pa.array([bool(row['is_deleted']) for row in rows], pa.bool_()),
+        pa.array([row['updated_at'] for row in rows], pa.timestamp('s')),
+    ], schema=SCHEMA)
+
+
+class RecordWriter:
+    """把记录按批写入一个Parquet或Arrow IPC文件，每批为一个行组"""
+
+    def __init__(self, sink, fmt):
+        if fmt == 'parquet':
+            self._writer = pq.ParquetWriter(sink, SCHEMA, compression='zstd')
+        else:
+            self._writer = pa.ipc.new_file(sink, SCHEMA)
+        self.rows = 0
+
+    def write(self, rows):
+        self._writer.write_batch(to_batch(rows))
+        self.rows += len(rows)
+
+    def close(self):
+        self._writer.close()
+
+
+class ChunkSink:
+    """收集写入的字节，由流式响应逐段取走"""
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def export_until(database):
+    """本次导出的截止修改时间（数据库时间减去SETTLE_SECONDS），查询失败时返回None"""
+    now = database.get_db_time()
+    if now is None:
+        return None
+    return now.replace(microsecond=0) - timedelta(seconds=SETTLE_SECONDS)
+
+
+def iter_export(database, tenant_id, fmt, since, until, row_group_size=EXPORT_ROW_GROUP_SIZE):
+    """流式导出一个租户修改时间在[since, until)内的记录为一个文件，逐个行组返回字节
+
+    先读取第一批记录再开始输出，查询失败时在第一次迭代抛出异常
+    """
+    rows = iter(database.iter_changed_records(until, since, tenant_id, batch_size=row_group_size))
+    batch = list(islice(rows, row_group_size))
+    sink = ChunkSink()
+    writer = RecordWriter(pa.PythonFile(sink, mode='w'), fmt)
+    while batch:
+        writer.write(batch)
+        yield sink.drain()
+        batch = list(islice(rows, row_group_size))
+    writer.close()
+    yield sink.drain()
+
+
+def partition_path(out_dir, tenant_id, record_time, name):
+    """按租户和月份分区的文件路径，租户ID按URL编码作为目录名"""
+    return os.path.join(out_dir, f"tenant={quote(tenant_id, safe='')}", f"month={record_time:%Y-%m}", name)
+
+
+def export_shard(database, out_dir, fmt, since, until, row_group_size=EXPORT_ROW_GROUP_SIZE):
+    """导出一个分片中修改时间在[since, until)内的记录，按租户和月份分区，返回(记录数, 文件数)
+
+    记录按租户和记录时间顺序读取，同一时间只打开一个分区文件；文件先写为.tmp，写完后改名
+    """
+    name = f"part-{until:%Y%m%d%H%M%S}-{database.name}{EXTENSIONS[fmt]}"
+    total_rows, files = 0, 0
+    writer, path, key, buffer = None, None, None, []
+
+    def finish():
+        if buffer:
+            writer.write(buffer)
+        writer.close()
+        os.replace(path + '.tmp', path)
+
+    try:
+        for row in database.iter_changed_records(until, since, batch_size=row_group_size):
+            row_key = (row['tenant_id'], row['record_time'].year, row['record_time'].month)
+            if row_key != key:
+                if writer is not None:
+                    finish()
+                key, buffer = row_key, []
+                path = partition_path(out_dir, row['tenant_id'], row['record_time'], name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                writer = RecordWriter(path + '.tmp', fmt)
+                files += 1
+            buffer.append(row)
+            total_rows += 1
+            if len(buffer) >= row_group_size:
+                writer.write(buffer)
+                buffer = []
+        if writer is not None:
+            finish()
+            writer = None
+    finally:
+        if writer is not None:
+            writer.close()
+            os.remove(path + '.tmp')
+    return total_rows, files
+
+
+def load_state(out_dir, fmt):
+    """读取导出目录的水位，目录此前以其他格式导出时抛出ValueError"""
+    try:
+        with open(os.path.join(out_dir, STATE_FILE), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return {'format': fmt, 'watermarks': {}}
+    if state.get('format') != fmt:
+        raise ValueError(f"目录 {out_dir} 已按 {state.get('format')} 格式导出，请使用相同格式或新的目录")
+    return state
+
+
+def save_state(out_dir, state):
+    """先写临时文件再替换，中断时不会留下不完整的水位文件"""
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def export_dataset(database, out_dir=EXPORT_DIR, fmt='parquet', row_group_size=EXPORT_ROW_GROUP_SIZE):
+    """把所有分片的记录增量导出到目录，每个分片导出完成后保存水位，返回各分片的(记录数, 文件数)
+
+    首次导出所有未删除的记录；之后只导出修改时间在水位之后的记录。
+    各分片的数据库时钟和时区可能不同，水位按分片分别保存。
+    """
+    if fmt not in EXTENSIONS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    os.makedirs(out_dir, exist_ok=True)
+    state = load_state(out_dir, fmt)
+    results = {}
+    for name, shard in database.shards.items():
+        until = export_until(shard)
+        if until is None:
+            raise RuntimeError(f"无法连接分片 {name} 的数据库")
+        watermark = state['watermarks'].get(name)
+        since = datetime.strptime(watermark, TIME_FORMAT) if watermark else None
+        if since is not None and since >= until:
+            results[name] = (0, 0)
+            continue
+        results[name] = export_shard(shard, out_dir, fmt, since, until, row_group_size)
+        state['watermarks'][name] = until.strftime(TIME_FORMAT)
+        save_state(out_dir, state)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="记录的列式导出（Parquet或Arrow IPC），按租户和月份分区，增量追加")
+    parser.add_argument('out_dir', nargs='?', default=EXPORT_DIR, help="导出目录")
+    parser.add_argument('--format', choices=list(EXTENSIONS), default='parquet', help="导出格式")
+    parser.add_argument('--row-group-size', type=int, default=EXPORT_ROW_GROUP_SIZE, help="每个行组的记录数")
+    args = parser.parse_args()
+
+    if not HAS_PYARROW:
+        print("导出需要安装pyarrow: pip install pyarrow")
+        sys.exit(1)
+    from db import db
+    try:
+        results = export_dataset(db, args.out_dir, args.format, args.row_group_size)
+    except (ValueError, RuntimeError) as e:
+        print(e)
+        sys.exit(1)
+    for name, (rows, files) in results.items():
+        print(f"分片 {name}: 导出 {rows} 条记录，写入 {files} 个文件", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""生产环境的gunicorn配置：gunicorn -c gunicorn.conf.py app:app
+
+主进程预加载应用（结巴分词词典、消息解析器、企业微信API等模块级实例只构建一次），
+再fork出多个uvicorn工作进程，预加载的对象以写时复制方式在工作进程间共享。
+"""
+
+import gc
+import os
+
+# config是gunicorn的配置项名称，应用配置模块以其他名称导入
+import config as app_config
+from config import (
+    APP_HOST, APP_PORT, WEB_WORKERS, WEB_PRELOAD, WEB_TIMEOUT, WEB_GRACEFUL_TIMEOUT, WEB_MAX_REQUESTS
+)
+
+# 多个工作进程且未设置IDEMPOTENCY_DB_PATH时使用的共享去重文件
+SHARED_IDEMPOTENCY_DB_PATH = 'data/idempotency.db'
+
+
+def default_workers():
+    """按当前进程可用的CPU核数确定工作进程数（容器限制了CPU亲和性时按限制计算）"""
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return max(1, os.cpu_count() or 1)
+
+
+bind = f"{APP_HOST}:{APP_PORT}"
+workers = WEB_WORKERS or default_workers()
+# 安装了uvloop和httptools时uvicorn工作进程自动使用
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = WEB_PRELOAD
+timeout = WEB_TIMEOUT
+graceful_timeout = WEB_GRACEFUL_TIMEOUT
+# 定期重启工作进程，0表示不重启；加随机量避免所有进程同时重启
+max_requests = WEB_MAX_REQUESTS
+max_requests_jitter = WEB_MAX_REQUESTS // 10
+accesslog = '-'
+
+# 回调去重记录必须在工作进程间共享，否则企业微信的重试落到另一个进程时会被当作新消息重复写库。
+# 应用模块在本配置文件之后才导入，修改应用配置模块中的值即可生效
+if workers > 1 and not app_config.IDEMPOTENCY_DB_PATH:
+    app_config.IDEMPOTENCY_DB_PATH = os.environ['IDEMPOTENCY_DB_PATH'] = SHARED_IDEMPOTENCY_DB_PATH
+
+
+def when_ready(server):
+    """应用已预加载、工作进程fork之前执行"""
+    # 把预加载的对象移出垃圾回收的跟踪范围，工作进程的垃圾回收不会写这些对象所在的内存页，
+    # 避免写时复制的页面被逐渐复制到每个进程
+    gc.collect()
+    gc.freeze()
+    server.log.info(f"应用已预加载，冻结对象数: {gc.get_freeze_count()}，工作进程数: {workers}")
+    if workers > 1:
+        server.log.info(f"回调去重记录保存在 {app_config.IDEMPOTENCY_DB_PATH}，由各工作进程共享")
+
+
+def post_worker_init(worker):
+    """工作进程初始化完成后记录实际使用的事件循环和HTTP解析器"""
+    import asyncio
+    import importlib.util
+    loop = type(asyncio.get_event_loop_policy()).__module__.split('.')[0]
+    http = 'httptools' if importlib.util.find_spec('httptools') else 'h11'
+    worker.log.info(f"工作进程 {worker.pid} 已启动，事件循环: {loop}，HTTP解析器: {http}")
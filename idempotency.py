@@ -0,0 +1,112 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from config import IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_ENTRIES, IDEMPOTENCY_DB_PATH
+
+
+class IdempotencyStore:
+    """回调幂等存储
+
+    企业微信在5秒内收不到响应时会重试回调，同一条消息可能到达多次。
+    claim() 原子地登记一个键，首次登记返回True，键在TTL内再次出现返回False。
+    默认只在进程内存中记录；配置了db_path时使用本地SQLite文件，多个工作进程共享。
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_entries=IDEMPOTENCY_MAX_ENTRIES, db_path=IDEMPOTENCY_DB_PATH):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._initialized = False
+        self._last_purge = 0
+
+    def _connect(self):
+        """获取当前线程的SQLite连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if not self._initialized:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS idempotency_keys (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+                )
+                self._initialized = True
+            self._local.conn = conn
+        return conn
+
+    def claim(self, key):
+        """登记键，首次出现返回True，TTL内重复出现返回False"""
+        if not key:
+            return True
+        now = time.time()
+        if self.db_path:
+            return self._claim_shared(key, now)
+
+        with self._lock:
+            # 所有键的TTL相同，按插入顺序即按过期顺序，从头部淘汰
+            while self._entries:
+                expires_at = next(iter(self._entries.values()))
+                if expires_at > now and len(self._entries) < self.max_entries:
+                    break
+                self._entries.popitem(last=False)
+
+            expires_at = self._entries.get(key)
+            if expires_at and expires_at > now:
+                return False
+            self._entries[key] = now + self.ttl
+            self._entries.move_to_end(key)
+            return True
+
+    def _claim_shared(self, key, now):
+        """在共享的SQLite存储中登记键"""
+        conn = self._connect()
+        if now - self._last_purge > self.ttl:
+            self._last_purge = now
+            conn.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+        # 过期的旧键直接覆盖，未过期的保留
+        cursor = conn.execute(
+            "INSERT INTO idempotency_keys (key, expires_at) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET expires_at = excluded.expires_at "
+            "WHERE idempotency_keys.expires_at <= ?",
+            (key, now + self.ttl, now)
+        )
+        return cursor.rowcount > 0
+
+    def release(self, key):
+        """撤销登记（处理失败时调用，让企业微信的重试可以再次处理）"""
+        if not key:
+            return
+        if self.db_path:
+            self._connect().execute("DELETE FROM idempotency_keys WHERE key = ?", (key,))
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+
+    @staticmethod
+    def delivery_key(msg_signature):
+        """回调投递的键：重试时请求体和签名不变，可在解密之前判断"""
+        return f"sig:{msg_signature}" if msg_signature else None
+
+    @staticmethod
+    def message_key(message):
+        """消息的键：普通消息使用MsgId，事件使用FromUserName+CreateTime"""
+        msg_id = message.get('MsgId')
+        if msg_id:
+            return f"msg:{msg_id}"
+        from_user = message.get('FromUserName')
+        create_time = message.get('CreateTime')
+        if from_user and create_time:
+            return f"evt:{from_user}:{create_time}:{message.get('Event') or ''}"
+        return None
+
+# 创建回调幂等存储实例
+idempotency = IdempotencyStore()
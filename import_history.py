@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""历史聊天记录批量导入
+
+读取导出的聊天记录（文本、CSV或JSON），以每条消息的发送时间作为解析“今天”“昨天”和
+未写时间的消息的参考时间，多进程并行解析后按批次多行插入数据库。每个批次提交后写入断点文件，
+中断后再次运行同一命令从断点继续；已存在相同时间和类型的记录不会重复插入。
+
+支持的格式：
+- 文本：每条消息以“2025-05-01 08:30[:15] 发送者”开头，消息内容在同一行冒号之后或随后的行中
+- CSV：包含time、sender（可选）、content列（也可为时间、发送者、内容）
+- JSON：消息对象数组或每行一个对象（.jsonl），字段同CSV，time可以是时间字符串或Unix时间戳
+
+用法:
+    python import_history.py chat.txt --tenant zhang
+    python import_history.py chat.csv --workers 4 --batch-size 1000
+    python import_history.py chat.json --dry-run
+"""
+
+import os
+import re
+import csv
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+# 文本格式的消息头：时间 + 发送者，可能在同一行带“发送者: 内容”
+TEXT_HEADER = re.compile(r'^(\d{4}[-/.]\d{1,2}[-/.]\d{1,2}\s+\d{1,2}:\d{2}(?::\d{2})?)\s*(.*)$')
+
+# CSV/JSON中各字段可用的名称
+TIME_FIELDS = ('time', 'timestamp', 'date', '时间')
+SENDER_FIELDS = ('sender', 'from', 'user', '发送者')
+CONTENT_FIELDS = ('content', 'message', 'text', '内容')
+
+# 解析器无法识别记录类型时使用的类型
+UNKNOWN_TYPE = '其他'
+
+# 记录时间晚于发送时间超过该值时，认为消息说的是前一天（如凌晨发送的“晚上11点吃奶”）
+FUTURE_TOLERANCE = timedelta(hours=1)
+
+
+def parse_time(value):
+    """解析消息时间：时间字符串或Unix时间戳"""
+    if isinstance(value, (int, float)) or (isinstance(value, str) and value.strip().isdigit()):
+        return datetime.fromtimestamp(int(value))
+    value = re.sub(r'[/.]', '-', value.strip())
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"无法识别的时间: {value}")
+
+
+def pick(item, names):
+    """按候选字段名取值"""
+    for name in names:
+        if item.get(name) not in (None, ''):
+            return item[name]
+    return None
+
+
+def read_text(f):
+    """读取文本格式，返回(发送时间, 发送者, 内容)"""
+    current = None
+    for line in f:
+        line = line.rstrip('\r\n')
+        match = TEXT_HEADER.match(line)
+        if match:
+            if current and current[2]:
+                yield current[0], current[1], ' '.join(current[2])
+            sent_at = parse_time(match.group(1))
+            rest = match.group(2).strip()
+            sender, sep, content = re.split(r'([:：])', rest, maxsplit=1) if re.search(r'[:：]', rest) else (rest, '', '')
+            current = (sent_at, sender.strip(), [content.strip()] if content.strip() else [])
+        elif current and line.strip():
+            current[2].append(line.strip())
+    if current and current[2]:
+        yield current[0], current[1], ' '.join(current[2])
+
+
+def read_items(items):
+    """读取CSV行或JSON对象，返回(发送时间, 发送者, 内容)"""
+    for item in items:
+        content = pick(item, CONTENT_FIELDS)
+        sent_at = pick(item, TIME_FIELDS)
+        if not content or sent_at is None:
+            continue
+        yield parse_time(sent_at), pick(item, SENDER_FIELDS) or '', str(content).strip()
+
+
+def read_messages(path, fmt=None):
+    """按格式读取导出文件中的所有消息"""
+    fmt = fmt or {'.csv': 'csv', '.json': 'json', '.jsonl': 'jsonl'}.get(os.path.splitext(path)[1].lower(), 'text')
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        if fmt == 'csv':
+            return list(read_items(csv.DictReader(f)))
+        if fmt == 'json':
+            return list(read_items(json.load(f)))
+        if fmt == 'jsonl':
+            return list(read_items(json.loads(line) for line in f if line.strip()))
+        return list(read_text(f))
+
+
+def init_worker():
+    """解析进程初始化：解析器的调试输出会成为瓶颈，直接丢弃"""
+    sys.stdout = open(os.devnull, 'w')
+
+
+def parse_chunk(chunk):
+    """在解析进程中解析一批消息，返回与输入对应的(状态, 记录)列表
+
+    状态为record（记录）、command（删除或日报指令，不导入）或unparsed（无法识别记录类型的闲聊等，不导入）
+    """
+    from message_parser import message_parser
+    results = []
+    for sent_at, content in chunk:
+        try:
+            record = message_parser.parse_message(content, now=sent_at)
+        except Exception:
+            record = None
+        if record is not None and (record.is_delete_command or record.is_daily_report_command):
+            results.append(('command', None))
+        elif record is None or record.record_type == UNKNOWN_TYPE:
+            results.append(('unparsed', None))
+        else:
+            record_time = record.record_time.replace(microsecond=0)
+            if record_time > sent_at + FUTURE_TOLERANCE:
+                record_time -= timedelta(days=1)
+            results.append(('record', (record_time, record.record_type, record.amount,
+                                       record.amount_unit, record.description)))
+    return results
+
+
+class Checkpoint:
+    """断点文件：记录已提交的消息数，与导入文件的路径、大小和修改时间绑定"""
+
+    def __init__(self, path, source):
+        self.path = path
+        stat = os.stat(source)
+        self.source = {'path': os.path.abspath(source), 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+        self.done = 0
+        self.counters = {}
+
+    def load(self):
+        """读取断点，导入文件已变化时抛出ValueError"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        if state.get('source') != self.source:
+            raise ValueError(f"断点文件 {self.path} 对应的导入文件已变化，请使用 --restart 重新导入")
+        self.done = state['done']
+        self.counters = state.get('counters', {})
+
+    def save(self):
+        """先写临时文件再替换，中断时不会留下不完整的断点"""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'source': self.source, 'done': self.done, 'counters': self.counters}, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+
+
+class Importer:
+    """按消息顺序汇总解析结果，攒够一批后写入数据库并保存断点"""
+
+    def __init__(self, database, checkpoint, batch_size, tenant_id=None, chat_id=None, resolver=None):
+        self.database = database
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.tenant_id = tenant_id
+        self.chat_id = chat_id
+        self.resolver = resolver
+        self.counters = {key: checkpoint.counters.get(key, 0) for key in
+                         ('messages', 'record', 'command', 'unparsed', 'inserted', 'duplicate')}
+        # 租户ID -> 待写入的记录
+        self._pending = {}
+        self._pending_count = 0
+        self._position = checkpoint.done
+        self.write_seconds = 0.0
+
+    def add(self, sender, status, row):
+        """加入一条消息的解析结果"""
+        self._position += 1
+        self.counters['messages'] += 1
+        self.counters[status] += 1
+        if status == 'record':
+            tenant_id = self.tenant_id or self.resolver.resolve(sender, self.chat_id)
+            self._pending.setdefault(tenant_id, []).append(row)
+            self._pending_count += 1
+        if self._pending_count >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """写入待写入的记录，全部成功后保存断点；写入失败时抛出RuntimeError"""
+        started = time.perf_counter()
+        for tenant_id, rows in self._pending.items():
+            if self.database is None:
+                continue
+            result = self.database.insert_records(tenant_id, rows)
+            if result is None:
+                raise RuntimeError(f"写入租户 {tenant_id} 的记录失败，已提交到第 {self.checkpoint.done} 条消息")
+            self.counters['inserted'] += result[0]
+            self.counters['duplicate'] += result[1]
+        self.write_seconds += time.perf_counter() - started
+        self._pending = {}
+        self._pending_count = 0
+        self.checkpoint.done = self._position
+        self.checkpoint.counters = dict(self.counters)
+        if self.database is not None:
+            self.checkpoint.save()
+
+
+def report(counters, processed, elapsed, write_seconds, final=False):
+    """输出吞吐量（本次运行处理的消息数/耗时）和解析失败率（含断点之前的消息）"""
+    messages = counters['messages']
+    rate = processed / elapsed if elapsed else 0
+    unparsed = counters['unparsed'] / messages * 100 if messages else 0
+    prefix = "导入完成" if final else "进度"
+    print(f"{prefix}: 消息 {messages} 条（{rate:,.0f} 条/秒），记录 {counters['record']}，指令 {counters['command']}，"
+          f"无法解析 {counters['unparsed']}（{unparsed:.1f}%），插入 {counters['inserted']}，"
+          f"已存在 {counters['duplicate']}，写库耗时 {write_seconds:.1f} 秒", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="历史聊天记录批量导入")
+    parser.add_argument('path', help="导出的聊天记录文件")
+    parser.add_argument('--format', choices=['text', 'csv', 'json', 'jsonl'], help="文件格式，默认按扩展名判断")
+    parser.add_argument('--tenant', help="导入到的租户ID，默认按发送者和 --chat-id 解析")
+    parser.add_argument('--chat-id', help="聊天记录所在群聊的ChatId，用于确定租户")
+    parser.add_argument('--workers', type=int, default=len(os.sched_getaffinity(0)), help="解析进程数，默认为CPU核数")
+    parser.add_argument('--chunk-size', type=int, default=500, help="每个解析任务的消息数")
+    parser.add_argument('--batch-size', type=int, default=1000, help="每次提交的记录数")
+    parser.add_argument('--checkpoint', help="断点文件，默认为导入文件加 .checkpoint.json")
+    parser.add_argument('--restart', action='store_true', help="忽略已有断点，从头导入")
+    parser.add_argument('--dry-run', action='store_true', help="只解析和统计，不写入数据库")
+    args = parser.parse_args()
+
+    checkpoint = Checkpoint(args.checkpoint or args.path + '.checkpoint.json', args.path)
+    if not args.restart:
+        try:
+            checkpoint.load()
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+
+    messages = read_messages(args.path, args.format)
+    remaining = messages[checkpoint.done:]
+    print(f"读取 {len(messages)} 条消息，从第 {checkpoint.done + 1} 条开始导入，解析进程 {args.workers} 个", flush=True)
+
+    database, resolver = None, None
+    if not args.dry_run:
+        from db import db as database
+        # 导入进程中的写入同样递增数据版本号，运行中服务的记录列表ETag随之失效
+        import data_version
+        if not database.init_db():
+            print("数据库初始化失败")
+            sys.exit(1)
+    if not args.tenant:
+        from tenancy import tenant_resolver as resolver
+    importer = Importer(database, checkpoint, args.batch_size, args.tenant, args.chat_id, resolver)
+
+    chunks = [[(sent_at, content) for sent_at, _, content in remaining[i:i + args.chunk_size]]
+              for i in range(0, len(remaining), args.chunk_size)]
+    started = time.perf_counter()
+    last_report = started
+    position = 0
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as pool:
+            # map按提交顺序返回结果，写入顺序和断点位置与文件中的消息顺序一致
+            for results in pool.map(parse_chunk, chunks):
+                for status, row in results:
+                    importer.add(remaining[position][1], status, row)
+                    position += 1
+                if time.perf_counter() - last_report >= 5:
+                    report(importer.counters, position, time.perf_counter() - started, importer.write_seconds)
+                    last_report = time.perf_counter()
+        importer.flush()
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+    report(importer.counters, position, time.perf_counter() - started, importer.write_seconds, final=True)
+
+
+if __name__ == '__main__':
+    main()
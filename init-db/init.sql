@@ -1,6 +1,7 @@
 -- 创建婴儿记录表
 CREATE TABLE IF NOT EXISTS baby_records (
     id INT AUTO_INCREMENT PRIMARY KEY,
+    tenant_id VARCHAR(64) NOT NULL DEFAULT 'default' COMMENT '租户（家庭）ID',
     record_time DATETIME NOT NULL,
     record_type ENUM('吃', '大便', '小便', '睡', '体温', '吃药', '其他') NOT NULL,
     amount VARCHAR(50),
@@ -8,9 +9,7 @@ CREATE TABLE IF NOT EXISTS baby_records (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
--- 创建索引
-CREATE INDEX idx_record_time ON baby_records(record_time);
-CREATE INDEX idx_record_type ON baby_records(record_type);
+-- 索引（均以租户ID开头）和其余字段由应用启动时的init_db创建
 
 -- 插入一些测试数据
 INSERT INTO baby_records (record_time, record_type, amount, description)
@@ -0,0 +1,123 @@
+import time
+import zlib
+import queue
+import threading
+
+from config import INBOUND_WORKERS, INBOUND_QUEUE_SIZE, INBOUND_DRAIN_TIMEOUT
+from metrics import registry
+from tracing import start_trace, current_trace_id
+
+# 工作线程退出标记
+_STOP = object()
+
+
+class InboundQueue:
+    """回调消息处理队列
+
+    回调处理只做验签和入队，写库、生成报表和发送回复由后台线程完成。
+    每个工作线程有自己的有界队列，同一个排序键（发送者或群聊）总是进入同一个队列，
+    保证同一用户的消息按到达顺序处理；队列满时拒绝新任务，由调用方做降级处理。
+    """
+
+    def __init__(self, workers=INBOUND_WORKERS, max_size=INBOUND_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        self.shard_size = max(1, max_size // self.workers)
+        self._queues = []
+        self._threads = []
+        self._accepting = False
+        self._lock = threading.Lock()
+        self._counters = {'accepted': 0, 'processed': 0, 'failed': 0, 'shed': 0}
+        self._wait_total = 0.0
+
+    def start(self):
+        """启动工作线程"""
+        if self._threads:
+            return
+        self._queues = [queue.Queue(maxsize=self.shard_size) for _ in range(self.workers)]
+        for i, shard in enumerate(self._queues):
+            thread = threading.Thread(target=self._worker, args=(shard,), name=f"inbound-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._accepting = True
+        print(f"消息处理队列已启动，工作线程数: {self.workers}，每个队列容量: {self.shard_size}", flush=True)
+
+    def submit(self, key, func, *args):
+        """提交任务，同一key的任务按提交顺序执行；队列已满或未启动时返回False"""
+        if not self._accepting:
+            return False
+        shard = self._queues[zlib.crc32((key or '').encode('utf-8')) % self.workers]
+        try:
+            shard.put_nowait((func, args, time.monotonic(), current_trace_id()))
+        except queue.Full:
+            with self._lock:
+                self._counters['shed'] += 1
+            print(f"消息处理队列已满，拒绝任务: {key}", flush=True)
+            return False
+        with self._lock:
+            self._counters['accepted'] += 1
+        return True
+
+    def _worker(self, shard):
+        """工作线程主循环"""
+        while True:
+            item = shard.get()
+            if item is _STOP:
+                return
+            func, args, enqueued_at, trace_id = item
+            with self._lock:
+                self._wait_total += time.monotonic() - enqueued_at
+            try:
+                # 后台处理沿用提交任务的回调请求的追踪ID
+                with start_trace(f"inbound.{func.__name__}", trace_id):
+                    func(*args)
+                with self._lock:
+                    self._counters['processed'] += 1
+            except Exception as e:
+                with self._lock:
+                    self._counters['failed'] += 1
+                print(f"消息处理任务异常: {e}", flush=True)
+                import traceback
+                traceback.print_exc()
+
+    def drain(self, timeout=INBOUND_DRAIN_TIMEOUT):
+        """停止接收新任务，等待已接收的任务处理完成后停止工作线程"""
+        if not self._threads:
+            return
+        self._accepting = False
+        deadline = time.monotonic() + timeout
+        for shard in self._queues:
+            # 退出标记排在已有任务之后，队列满时等待腾出位置
+            try:
+                shard.put(_STOP, timeout=max(0.01, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+        for thread in self._threads:
+            thread.join(timeout=max(0, deadline - time.monotonic()))
+        remaining = sum(shard.qsize() for shard in self._queues)
+        if remaining:
+            print(f"消息处理队列停止超时，仍有约 {remaining} 个任务未处理", flush=True)
+        else:
+            print("消息处理队列已处理完所有任务", flush=True)
+        self._threads = []
+
+    def stats(self):
+        """获取队列深度和处理计数"""
+        with self._lock:
+            counters = dict(self._counters)
+            wait_total = self._wait_total
+        started = counters['processed'] + counters['failed']
+        depths = [shard.qsize() for shard in self._queues]
+        return {
+            'accepting': self._accepting,
+            'workers': self.workers,
+            'capacity': self.shard_size * self.workers,
+            'depth': sum(depths),
+            'max_shard_depth': max(depths) if depths else 0,
+            'avg_wait_seconds': round(wait_total / started, 4) if started else None,
+            'counters': counters
+        }
+
+# 创建消息处理队列实例
+inbound_queue = InboundQueue()
+registry.gauge('baby_inbound_queue_depth', '消息处理队列中等待处理的任务数',
+               func=lambda: sum(shard.qsize() for shard in inbound_queue._queues))
@@ -0,0 +1,303 @@
+import os
+import asyncio
+import threading
+from collections import deque
+
+from config import LIVE_REPLAY_SIZE, LIVE_SUBSCRIBER_BUFFER, LIVE_MAX_SUBSCRIBERS, LIVE_HEARTBEAT
+from db import db
+# 先于本模块注册监听器，变更事件中带有递增后的数据版本号
+from data_version import data_version
+from metrics import registry
+from responses import dumps
+
+
+# 需要客户端重新查询记录、连接因消费过慢被关闭时发送的事件
+RESET_FRAME = b'event: reset\ndata: {"reason":"missed"}\n\n'
+EVICTED_FRAME = b'event: evicted\ndata: {"reason":"slow consumer"}\n\n'
+RESET_MESSAGE = '{"event":"reset","data":{"reason":"missed"}}'
+EVICTED_MESSAGE = '{"event":"evicted","data":{"reason":"slow consumer"}}'
+PING_MESSAGE = '{"event":"ping"}'
+
+
+class LiveEvent:
+    """一次记录变更，推送内容在发布时编码一次，所有订阅者共用"""
+
+    __slots__ = ('id', 'seq', 'name', 'frame', 'message')
+
+    def __init__(self, event_id, seq, name, data):
+        self.id = event_id
+        self.seq = seq
+        self.name = name
+        body = dumps(data).decode('utf-8')
+        # SSE格式和WebSocket消息
+        self.frame = f"id: {event_id}\nevent: {name}\ndata: {body}\n\n".encode('utf-8')
+        self.message = f'{{"id":"{event_id}","event":"{name}","data":{body}}}'
+
+
+class Subscriber:
+    """一个实时推送连接，待发送的事件放在有上限的缓冲区中"""
+
+    __slots__ = ('tenant_id', 'loop', 'version', 'buffer', 'evicted', 'closed', '_waiter')
+
+    def __init__(self, tenant_id, loop, version=0):
+        self.tenant_id = tenant_id
+        self.loop = loop
+        # 连接已收到的变更对应的租户数据版本号
+        self.version = version
+        self.buffer = deque()
+        # 缓冲区满时被移除，连接随后关闭
+        self.evicted = False
+        # 客户端已断开
+        self.closed = False
+        self._waiter = None
+
+    def _wake(self):
+        """在事件循环线程中唤醒等待中的连接"""
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def close(self):
+        """在事件循环线程中标记客户端已断开"""
+        self.closed = True
+        self._wake()
+
+    async def wait(self, timeout):
+        """等待新事件、被移除或客户端断开，超时后返回以便发送心跳"""
+        if self.buffer or self.evicted or self.closed:
+            return
+        # 用定时器唤醒代替wait_for，避免每次等待创建任务
+        self._waiter = self.loop.create_future()
+        timer = self.loop.call_later(timeout, self._wake)
+        try:
+            await self._waiter
+        finally:
+            timer.cancel()
+            self._waiter = None
+
+
+def wake_all(subscribers):
+    """在事件循环线程中唤醒一组连接"""
+    for subscriber in subscribers:
+        subscriber._wake()
+
+
+class TenantLog:
+    """一个租户最近的事件，用于按Last-Event-ID补发"""
+
+    __slots__ = ('events', 'dropped_seq')
+
+    def __init__(self, size):
+        self.events = deque(maxlen=size)
+        # 已从补发缓冲区中淘汰的最大序号
+        self.dropped_seq = 0
+
+
+class RecordHub:
+    """进程内的记录变更广播：写库后的变更事件推送给同一租户的所有实时连接
+
+    每个连接有独立的有上限缓冲区，消费过慢（缓冲区满）的连接被移除，不影响发布和其他连接。
+    事件ID为“进程标识-序号”，客户端重连时带上Last-Event-ID，补发缓冲区中之后的事件；
+    事件已被淘汰或ID来自其他进程时发送reset事件，客户端应重新查询 /api/records。
+
+    写入只在写库的进程内推送。每个连接记录已推送到的租户数据版本号，空闲发送心跳时
+    版本号落后说明其他进程写入过该租户，改为发送reset事件。
+    """
+
+    def __init__(self, replay_size=LIVE_REPLAY_SIZE, buffer_size=LIVE_SUBSCRIBER_BUFFER,
+                 max_subscribers=LIVE_MAX_SUBSCRIBERS, versions=data_version):
+        self.replay_size = replay_size
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self.versions = versions
+        self._lock = threading.Lock()
+        self._pid = None
+        self.epoch = None
+        self._seq = 0
+        # 租户ID -> TenantLog
+        self._logs = {}
+        # 租户ID -> 订阅者集合
+        self._subscribers = {}
+        self._count = 0
+        self.published = 0
+        self.evictions = 0
+
+    def _check_process(self):
+        """每个进程使用独立的进程标识和序号（gunicorn预加载时实例在fork前创建）"""
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid = pid
+            self.epoch = os.urandom(4).hex()
+            self._seq = 0
+            self._logs = {}
+            self._subscribers = {}
+            self._count = 0
+
+    def publish(self, tenant_id, name, data, version=None):
+        """发布一个事件，可在任意线程调用；version为本次写入后的租户数据版本号"""
+        with self._lock:
+            self._check_process()
+            self._seq += 1
+            event = LiveEvent(f"{self.epoch}-{self._seq}", self._seq, name, data)
+            log = self._logs.get(tenant_id)
+            if log is None:
+                log = self._logs[tenant_id] = TenantLog(self.replay_size)
+            if len(log.events) == log.events.maxlen:
+                log.dropped_seq = log.events[0].seq
+            log.events.append(event)
+            self.published += 1
+            subscribers = list(self._subscribers.get(tenant_id, ()))
+            for subscriber in subscribers:
+                if version is not None and subscriber.version == version - 1:
+                    # 本次写入之前没有其他进程的写入
+                    subscriber.version = version
+                if subscriber.evicted:
+                    continue
+                if len(subscriber.buffer) >= self.buffer_size:
+                    # 不再缓存，连接重连后按Last-Event-ID补发
+                    subscriber.evicted = True
+                    subscriber.buffer.clear()
+                    self.evictions += 1
+                else:
+                    subscriber.buffer.append(event)
+        # 同一事件循环中的连接一次唤醒，每个事件循环只跨线程通知一次
+        by_loop = {}
+        for subscriber in subscribers:
+            by_loop.setdefault(subscriber.loop, []).append(subscriber)
+        for loop, waiting in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(wake_all, waiting)
+            except RuntimeError:
+                # 连接所在的事件循环已关闭
+                for subscriber in waiting:
+                    subscriber.evicted = True
+        return event
+
+    def on_record_change(self, event):
+        """数据变更监听器：插入、更新和删除推送给该租户的实时连接"""
+        record_time = event['record_time']
+        data = {
+            'id': event['id'],
+            'record_time': record_time.strftime('%Y-%m-%d %H:%M:%S'),
+            'record_type': event['record_type'],
+        }
+        if event['action'] != 'delete':
+            data['amount'] = event.get('amount')
+            data['amount_unit'] = event.get('amount_unit')
+            data['description'] = event.get('description')
+        self.publish(event['tenant_id'], event['action'], data, event.get('data_version'))
+
+    def subscribe(self, tenant_id, last_event_id=None, loop=None):
+        """在连接所在的事件循环中注册实时连接
+        
+        返回(订阅者, 需补发的事件, 是否需要客户端重新查询)，连接数已满时返回None
+        """
+        loop = loop or asyncio.get_running_loop()
+        with self._lock:
+            self._check_process()
+            if self._count >= self.max_subscribers:
+                return None
+            subscriber = Subscriber(tenant_id, loop, self.versions.get(tenant_id))
+            self._subscribers.setdefault(tenant_id, set()).add(subscriber)
+            self._count += 1
+            replay, reset = [], False
+            if last_event_id:
+                epoch, _, seq = last_event_id.partition('-')
+                log = self._logs.get(tenant_id)
+                if epoch != self.epoch or not seq.isdigit():
+                    reset = True
+                elif log is not None:
+                    seq = int(seq)
+                    reset = seq < log.dropped_seq
+                    replay = [event for event in log.events if event.seq > seq]
+            return subscriber, replay, reset
+
+    def unsubscribe(self, subscriber):
+        """移除实时连接"""
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.tenant_id)
+            if subscribers and subscriber in subscribers:
+                subscribers.discard(subscriber)
+                self._count -= 1
+                if not subscribers:
+                    del self._subscribers[subscriber.tenant_id]
+
+    def resync(self, subscriber):
+        """连接推送到的版本号之后其他进程写入过该租户时返回True，并更新到当前版本号"""
+        version = self.versions.get(subscriber.tenant_id)
+        with self._lock:
+            if subscriber.version == version:
+                return False
+            subscriber.version = version
+            return True
+
+    def drain(self, subscriber):
+        """取出连接缓冲区中的所有事件"""
+        with self._lock:
+            events = list(subscriber.buffer)
+            subscriber.buffer.clear()
+            return events
+
+    def subscriber_count(self):
+        return self._count if self._pid == os.getpid() else 0
+
+
+async def sse_stream(hub, subscriber, replay, reset, heartbeat=LIVE_HEARTBEAT):
+    """SSE响应体：先补发，之后推送新事件，空闲时发送心跳注释，连接断开或被移除时退出"""
+    try:
+        yield b"retry: 3000\n\n"
+        if reset:
+            yield RESET_FRAME
+        for event in replay:
+            yield event.frame
+        while True:
+            await subscriber.wait(heartbeat)
+            if subscriber.evicted:
+                yield EVICTED_FRAME
+                break
+            events = hub.drain(subscriber)
+            if events:
+                yield b"".join(event.frame for event in events)
+            elif hub.resync(subscriber):
+                yield RESET_FRAME
+            else:
+                yield b": ping\n\n"
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+async def websocket_session(hub, websocket, subscriber, replay, reset, heartbeat=LIVE_HEARTBEAT):
+    """WebSocket连接：每个事件一条JSON文本消息，格式为{"id", "event", "data"}"""
+    async def watch_disconnect():
+        # 客户端发来的消息忽略，收到断开时立即结束，不必等到下次发送失败
+        while (await websocket.receive())['type'] != 'websocket.disconnect':
+            pass
+        subscriber.close()
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        if reset:
+            await websocket.send_text(RESET_MESSAGE)
+        for event in replay:
+            await websocket.send_text(event.message)
+        while True:
+            await subscriber.wait(heartbeat)
+            if subscriber.closed:
+                break
+            if subscriber.evicted:
+                await websocket.send_text(EVICTED_MESSAGE)
+                await websocket.close(code=1008)
+                break
+            events = hub.drain(subscriber)
+            for event in events:
+                await websocket.send_text(event.message)
+            if not events:
+                await websocket.send_text(RESET_MESSAGE if hub.resync(subscriber) else PING_MESSAGE)
+    finally:
+        watcher.cancel()
+        hub.unsubscribe(subscriber)
+
+# 创建实时推送实例，写库后推送给订阅的连接
+record_hub = RecordHub()
+db.add_change_listener(record_hub.on_record_change)
+registry.gauge('baby_live_subscribers', '当前的实时推送连接数', func=record_hub.subscriber_count)
+registry.counter('baby_live_evictions_total', '因消费过慢被移除的实时推送连接数', func=lambda: record_hub.evictions)
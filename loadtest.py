@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""企业微信回调端到端压测
+
+按消息语料生成签名并加密的回调请求，以指定并发发送到 /wechat/callback，
+统计每秒回调数、p50/p99延迟和各阶段耗时（服务端返回Server-Timing时一并统计）。
+
+用法:
+    python mock_wechat.py --port 8081 &
+    WECHAT_API_BASE_URL=http://127.0.0.1:8081/cgi-bin uvicorn app:app --port 5000 &
+    python loadtest.py --url http://127.0.0.1:5000/wechat/callback --concurrency 32 --requests 5000
+"""
+
+import time
+import random
+import argparse
+import itertools
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from config import TOKEN, ENCODING_AES_KEY, CORP_ID, AGENT_ID
+from wechat import WXBizMsgCrypt, WeChatAPI, to_cdata
+
+# 默认消息语料
+DEFAULT_CORPUS = [
+    "今日9点30分拉屎一坨",
+    "下午2点30吃妈奶一边",
+    "早上8点体温37.5度",
+    "晚上10点吃奶粉120毫升",
+    "今天下午3点吃药2次",
+    "宝宝今天9点睡觉睡了2小时",
+    "中午12点吃辅食半碗",
+    "今天早上7点尿尿一次",
+    "下午4点宝宝拉了大便",
+    "晚上8点小便了",
+    "查看今天的日报",
+]
+
+
+class CallbackGenerator:
+    """生成与企业微信格式一致、签名正确的加密回调"""
+
+    def __init__(self, token=TOKEN, encoding_aes_key=ENCODING_AES_KEY, corp_id=CORP_ID, agent_id=AGENT_ID):
+        self.token = token
+        self.corp_id = corp_id
+        self.agent_id = agent_id
+        self.crypto = WXBizMsgCrypt(encoding_aes_key)
+        self._msg_ids = itertools.count(int(time.time() * 1000) * 1000)
+
+    def build(self, content, from_user="ShenChaoSong"):
+        """生成一个文本消息回调，返回(请求体, URL查询参数)"""
+        create_time = int(time.time())
+        inner = (
+            f"<xml><ToUserName><![CDATA[{self.corp_id}]]></ToUserName>"
+            f"<FromUserName>{to_cdata(from_user)}</FromUserName>"
+            f"<CreateTime>{create_time}</CreateTime>"
+            f"<MsgType><![CDATA[text]]></MsgType>"
+            f"<Content>{to_cdata(content)}</Content>"
+            f"<MsgId>{next(self._msg_ids)}</MsgId><AgentID>{self.agent_id}</AgentID></xml>"
+        )
+        encrypted = self.crypto.encrypt(inner, self.corp_id).decode()
+        timestamp, nonce = str(create_time), str(random.randint(10 ** 8, 10 ** 9))
+        params = {
+            'msg_signature': WeChatAPI.calc_signature(timestamp, nonce, encrypted, self.token),
+            'timestamp': timestamp,
+            'nonce': nonce
+        }
+        body = (
+            f"<xml><ToUserName><![CDATA[{self.corp_id}]]></ToUserName>"
+            f"<Encrypt><![CDATA[{encrypted}]]></Encrypt>"
+            f"<AgentID><![CDATA[{self.agent_id}]]></AgentID></xml>"
+        ).encode('utf-8')
+        return body, params
+
+
+def parse_server_timing(header):
+    """解析Server-Timing响应头，返回{阶段: 毫秒}"""
+    stages = {}
+    for item in (header or '').split(','):
+        parts = [p.strip() for p in item.split(';')]
+        if not parts[0]:
+            continue
+        for part in parts[1:]:
+            if part.startswith('dur='):
+                try:
+                    stages[parts[0]] = stages.get(parts[0], 0.0) + float(part[4:])
+                except ValueError:
+                    pass
+    return stages
+
+
+def percentile(values, p):
+    """计算分位数（values需已排序）"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class LoadDriver:
+    """以固定并发发送回调并汇总结果"""
+
+    def __init__(self, url, generator, corpus, concurrency, users):
+        self.url = url
+        self.generator = generator
+        self.corpus = corpus
+        self.concurrency = concurrency
+        self.users = users
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.stage_ms = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def _session(self):
+        """每个线程复用一个HTTP连接"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+
+    def _one(self, i):
+        """生成并发送一个回调"""
+        start = time.perf_counter()
+        body, params = self.generator.build(self.corpus[i % len(self.corpus)], self.users[i % len(self.users)])
+        built = time.perf_counter()
+        try:
+            response = self._session().post(self.url, params=params, data=body, timeout=30,
+                                            headers={'Content-Type': 'text/xml', 'X-Debug-Timing': '1'})
+            done = time.perf_counter()
+            if response.status_code != 200 or (response.text != 'success' and not response.text.startswith('<xml>')):
+                with self._lock:
+                    self.errors[f"HTTP {response.status_code}"] += 1
+            server_stages = parse_server_timing(response.headers.get('Server-Timing'))
+        except Exception as e:
+            done = time.perf_counter()
+            server_stages = {}
+            with self._lock:
+                self.errors[type(e).__name__] += 1
+        with self._lock:
+            self.latencies.append((done - built) * 1000)
+            self.stage_ms['client.generate'].append((built - start) * 1000)
+            self.stage_ms['client.http'].append((done - built) * 1000)
+            for stage, ms in server_stages.items():
+                self.stage_ms[f"server.{stage}"].append(ms)
+
+    def run(self, total):
+        """发送total个回调，返回耗时（秒）"""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(self._one, range(total)))
+        return time.perf_counter() - start
+
+    def report(self, elapsed):
+        """输出压测结果"""
+        latencies = sorted(self.latencies)
+        total = len(latencies)
+        print(f"\n回调数: {total}  并发: {self.concurrency}  耗时: {elapsed:.2f}秒")
+        print(f"吞吐量: {total / elapsed:.1f} 回调/秒")
+        print(f"延迟(ms): p50={percentile(latencies, 0.5):.1f}  p90={percentile(latencies, 0.9):.1f}  "
+              f"p99={percentile(latencies, 0.99):.1f}  max={latencies[-1] if latencies else 0:.1f}")
+        if self.errors:
+            print(f"错误: {dict(self.errors)}")
+        print("\n各阶段耗时(ms):")
+        print(f"  {'阶段':<28}{'次数':>8}{'平均':>10}{'p50':>10}{'p99':>10}")
+        for stage in sorted(self.stage_ms):
+            values = sorted(self.stage_ms[stage])
+            print(f"  {stage:<30}{len(values):>8}{sum(values) / len(values):>10.2f}"
+                  f"{percentile(values, 0.5):>10.2f}{percentile(values, 0.99):>10.2f}")
+
+
+def load_corpus(path):
+    """读取消息语料，每行一条消息"""
+    if not path:
+        return DEFAULT_CORPUS
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="企业微信回调端到端压测")
+    parser.add_argument('--url', default='http://127.0.0.1:5000/wechat/callback')
+    parser.add_argument('--concurrency', type=int, default=16, help="并发请求数")
+    parser.add_argument('--requests', type=int, default=1000, help="回调总数")
+    parser.add_argument('--corpus', help="消息语料文件，每行一条消息")
+    parser.add_argument('--users', type=int, default=20, help="模拟的发送者数量")
+    parser.add_argument('--warmup', type=int, default=20, help="正式统计前的预热回调数")
+    args = parser.parse_args()
+
+    if not TOKEN or not ENCODING_AES_KEY or not CORP_ID:
+        parser.error("需要配置TOKEN、ENCODING_AES_KEY和CORP_ID，且与被测服务一致")
+
+    generator = CallbackGenerator()
+    corpus = load_corpus(args.corpus)
+    users = [f"loadtest_user_{i}" for i in range(args.users)]
+
+    if args.warmup:
+        LoadDriver(args.url, generator, corpus, args.concurrency, users).run(args.warmup)
+
+    driver = LoadDriver(args.url, generator, corpus, args.concurrency, users)
+    elapsed = driver.run(args.requests)
+    driver.report(elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ import jieba
 from pydantic import BaseModel
 from typing import Optional, Tuple
 
+from metrics import timed
+
 class BabyRecord(BaseModel):
     """婴儿记录数据模型"""
     record_time: datetime
@@ -104,8 +106,13 @@ class MessageParser:
                         jieba.add_word(f'{h}点{m}{d}分')
 
         
-    def parse_message(self, message: str) -> Optional[BabyRecord]:
-        """解析消息内容，提取婴儿记录信息"""
+    @timed('parse.parse_message')
+    def parse_message(self, message: str, now: Optional[datetime] = None) -> Optional[BabyRecord]:
+        """解析消息内容，提取婴儿记录信息
+        
+        now为解析相对时间（今天、昨天、未写时间）的参考时间，默认为当前时间；
+        导入历史消息时传入消息的发送时间
+        """
         if not message or len(message) < 3:
             return None
             
@@ -136,11 +143,11 @@ class MessageParser:
             
             # 提取日期
             date_str = daily_report_match.group(2)
-            report_date = self._extract_date(date_str)
+            report_date = self._extract_date(date_str, now)
             print(f"提取的日期: {report_date}", flush=True)
             
         # 提取时间信息
-        record_time = self._extract_time(message)
+        record_time = self._extract_time(message, now)
         
         # 提取记录类型
         record_type = self._extract_record_type(message)
@@ -165,9 +172,10 @@ class MessageParser:
             report_date=report_date
         )
     
-    def _extract_time(self, message: str) -> datetime:
-        """从消息中提取时间信息"""
-        now = datetime.now()
+    @timed('parse.extract_time')
+    def _extract_time(self, message: str, now: Optional[datetime] = None) -> datetime:
+        """从消息中提取时间信息，相对于now（默认为当前时间）"""
+        now = now or datetime.now()
         today = now.replace(hour=0, minute=0, second=0, microsecond=0)
         
         # 打印调试信息
@@ -267,6 +275,7 @@ class MessageParser:
         print(f"未匹配到任何时间模式，使用当前时间: {now}", flush=True)
         return now
     
+    @timed('parse.extract_record_type')
     def _extract_record_type(self, message: str) -> str:
         """从消息中提取记录类型"""
         # 分词处理
@@ -305,6 +314,7 @@ class MessageParser:
         print("未匹配到记录类型", flush=True)
         return None
     
+    @timed('parse.extract_amount')
     def _extract_amount(self, message: str, record_type: str) -> Tuple[Optional[str], Optional[str]]:
         """从消息中提取数量信息"""
         # 打印调试信息
@@ -441,9 +451,10 @@ class MessageParser:
         # 默认返回None
         return None, None
 
-    def _extract_date(self, date_str: str) -> str:
-        """从日期字符串提取标准日期格式 (YYYY-MM-DD)"""
-        today = datetime.now().date()
+    @timed('parse.extract_date')
+    def _extract_date(self, date_str: str, now: Optional[datetime] = None) -> str:
+        """从日期字符串提取标准日期格式 (YYYY-MM-DD)，相对日期以now（默认为当前时间）为准"""
+        today = (now or datetime.now()).date()
         
         # 处理相对日期
         if date_str == '今天':
@@ -0,0 +1,208 @@
+import time
+import threading
+from bisect import bisect_left
+from functools import wraps
+
+from tracing import current_trace
+
+# 耗时直方图的默认分桶（秒），覆盖从几十微秒的解析步骤到数秒的外部调用
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def escape_label(value):
+    """按Prometheus文本格式转义标签值"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=None):
+    """生成 {a="1",b="2"} 形式的标签字符串"""
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    """输出数值，整数不带小数点"""
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+class Counter:
+    """只增不减的计数器；也可以给定函数，在采集时读取已有的计数"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.func = func
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        """增加计数，标签值按labelnames的顺序传入"""
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def collect(self):
+        if self.func is not None:
+            try:
+                values = self.func()
+            except Exception as e:
+                print(f"采集指标 {self.name} 失败: {e}", flush=True)
+                return []
+            # 函数返回数值，或{标签值元组: 数值}
+            items = sorted(values.items()) if isinstance(values, dict) else [((), values)]
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return [f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    """可增可减的当前值；也可以给定函数，在采集时计算"""
+
+    kind = 'gauge'
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, value, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = value
+
+
+class Histogram:
+    """分桶直方图，每个标签组合记录各桶计数、总和与次数"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        """记录一次观测值"""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labelvalues)
+            if series is None:
+                # [各桶计数..., +Inf桶计数, 总和]
+                series = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def collect(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._values.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            labels = format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {repr(series[-1])}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表，按Prometheus文本格式（0.0.4）输出所有指标"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), func=None):
+        return self.register(Counter(name, documentation, labelnames, func))
+
+    def gauge(self, name, documentation, labelnames=(), func=None):
+        return self.register(Gauge(name, documentation, labelnames, func))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """生成 /metrics 的响应内容"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+# 创建指标注册表实例
+registry = MetricsRegistry()
+
+# 进程启动时间
+START_TIME = time.time()
+registry.gauge('baby_process_start_time_seconds', '进程启动时间（Unix时间戳）', func=lambda: START_TIME)
+
+# 各处理阶段的耗时
+STAGE_SECONDS = registry.histogram(
+    'baby_stage_duration_seconds', '各处理阶段耗时：验签、解密、XML解析、消息解析、数据库和企业微信API调用', ['stage']
+)
+CALLBACK_SECONDS = registry.histogram(
+    'baby_callback_duration_seconds', '企业微信消息回调的总处理时间', ['outcome']
+)
+PARSE_TOTAL = registry.counter(
+    'baby_parse_total', '消息解析结果，outcome为insert/update/delete/report/link/pending/failed/unparsed', ['outcome', 'record_type']
+)
+DB_CONNECTIONS_OPEN = registry.gauge('baby_db_connections_open', '当前打开的数据库连接数')
+DB_CONNECTIONS_TOTAL = registry.counter('baby_db_connections_total', '建立数据库连接的次数', ['result'])
+WECHAT_SEND_TOTAL = registry.counter(
+    'baby_wechat_send_total', '调用企业微信发送接口的结果，errcode为none表示网络异常', ['errcode']
+)
+
+
+def observe_stage(name, started, ended):
+    """记录一个阶段的耗时，同时写入当前请求的追踪"""
+    STAGE_SECONDS.observe(ended - started, name)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_span(name, started, ended)
+
+
+class stage:
+    """统计代码块耗时的上下文管理器：with stage('wechat.decrypt'): ..."""
+
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe_stage(self.name, self.started, time.perf_counter())
+        return False
+
+
+def timed(name):
+    """统计函数耗时的装饰器"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe_stage(name, started, time.perf_counter())
+        return wrapper
+    return decorator
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""本地模拟的企业微信API，用于压测和联调，不访问真实的qyapi.weixin.qq.com
+
+支持 gettoken、message/send 和 appchat/send 三个接口，可配置响应延迟和错误注入。
+
+用法:
+    python mock_wechat.py --port 8081 --latency-ms 80 --jitter-ms 40 --error-rate 0.05
+    # 应用侧配置 WECHAT_API_BASE_URL=http://127.0.0.1:8081/cgi-bin
+"""
+
+import asyncio
+import argparse
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# 错误注入时返回的错误码：系统繁忙、接口调用超过限制、令牌过期
+INJECTED_ERRORS = [
+    {"errcode": -1, "errmsg": "system busy"},
+    {"errcode": 45009, "errmsg": "api freq out of limit"},
+    {"errcode": 42001, "errmsg": "access_token expired"},
+]
+
+
+class MockState:
+    """模拟服务的配置和统计"""
+
+    def __init__(self):
+        self.latency_ms = 0.0
+        self.jitter_ms = 0.0
+        self.error_rate = 0.0
+        self.token_ttl = 7200
+        self.tokens = {}
+        self.counters = {'gettoken': 0, 'message_send': 0, 'appchat_send': 0, 'injected_errors': 0, 'invalid_token': 0}
+        self.messages = []
+
+    def snapshot(self):
+        """当前配置和计数"""
+        return {
+            'latency_ms': self.latency_ms,
+            'jitter_ms': self.jitter_ms,
+            'error_rate': self.error_rate,
+            'token_ttl': self.token_ttl,
+            'counters': dict(self.counters),
+            'recent_messages': self.messages[-20:]
+        }
+
+
+state = MockState()
+app = FastAPI(title="企业微信API模拟服务")
+
+
+async def simulate_latency():
+    """按配置模拟网络和接口处理延迟"""
+    delay = state.latency_ms + random.uniform(-state.jitter_ms, state.jitter_ms)
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+
+
+def check_token(request):
+    """校验访问令牌，返回错误响应或None"""
+    token = request.query_params.get('access_token')
+    expires_at = state.tokens.get(token)
+    if not expires_at:
+        state.counters['invalid_token'] += 1
+        return {"errcode": 40014, "errmsg": "invalid access_token"}
+    if expires_at < time.time():
+        state.counters['invalid_token'] += 1
+        return {"errcode": 42001, "errmsg": "access_token expired"}
+    if random.random() < state.error_rate:
+        state.counters['injected_errors'] += 1
+        return random.choice(INJECTED_ERRORS)
+    return None
+
+
+@app.get("/cgi-bin/gettoken")
+async def gettoken(corpid: str = "", corpsecret: str = ""):
+    """获取访问令牌"""
+    await simulate_latency()
+    state.counters['gettoken'] += 1
+    if not corpid or not corpsecret:
+        return {"errcode": 40013, "errmsg": "invalid corpid"}
+    token = uuid.uuid4().hex
+    state.tokens[token] = time.time() + state.token_ttl
+    return {"errcode": 0, "errmsg": "ok", "access_token": token, "expires_in": state.token_ttl}
+
+
+@app.post("/cgi-bin/message/send")
+async def message_send(request: Request):
+    """发送应用消息"""
+    await simulate_latency()
+    state.counters['message_send'] += 1
+    error = check_token(request)
+    if error:
+        return error
+    data = await request.json()
+    state.messages.append({'touser': data.get('touser'), 'content': data.get('text', {}).get('content')})
+    del state.messages[:-100]
+    return {"errcode": 0, "errmsg": "ok", "invaliduser": "", "msgid": uuid.uuid4().hex}
+
+
+@app.post("/cgi-bin/appchat/send")
+async def appchat_send(request: Request):
+    """发送群聊消息"""
+    await simulate_latency()
+    state.counters['appchat_send'] += 1
+    error = check_token(request)
+    if error:
+        return error
+    data = await request.json()
+    state.messages.append({'chatid': data.get('chatid'), 'content': data.get('text', {}).get('content')})
+    del state.messages[:-100]
+    return {"errcode": 0, "errmsg": "ok"}
+
+
+@app.get("/mock/stats")
+async def mock_stats():
+    """查看模拟服务的配置和调用统计"""
+    return state.snapshot()
+
+
+@app.post("/mock/config")
+async def mock_config(request: Request):
+    """运行时修改延迟、错误率和令牌有效期"""
+    data = await request.json()
+    for key in ('latency_ms', 'jitter_ms', 'error_rate', 'token_ttl'):
+        if key in data:
+            setattr(state, key, type(getattr(state, key))(data[key]))
+    if data.get('expire_tokens'):
+        # 让所有已发放的令牌立即过期，用于测试令牌刷新
+        for token in state.tokens:
+            state.tokens[token] = 0
+    return JSONResponse(state.snapshot())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="企业微信API模拟服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=50, help="平均响应延迟（毫秒）")
+    parser.add_argument('--jitter-ms', type=float, default=20, help="延迟随机抖动范围（毫秒）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="发送接口返回错误的比例")
+    parser.add_argument('--token-ttl', type=int, default=7200, help="访问令牌有效期（秒）")
+    args = parser.parse_args()
+
+    state.latency_ms = args.latency_ms
+    state.jitter_ms = args.jitter_ms
+    state.error_rate = args.error_rate
+    state.token_ttl = args.token_ttl
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
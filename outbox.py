@@ -0,0 +1,331 @@
+import os
+import time
+import random
+import sqlite3
+import threading
+from collections import deque
+
+from config import (
+    OUTBOX_DB_PATH, OUTBOX_WORKERS, OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_BASE_DELAY, OUTBOX_MAX_DELAY, OUTBOX_COALESCE_WINDOW
+)
+from wechat import wechat_api, TOKEN_ERRCODES
+from ratelimit import rate_limiter
+from metrics import registry
+
+# 不可重试的错误码：参数或接收者错误，重试也不会成功，直接进入死信
+PERMANENT_ERRCODES = {40003, 40008, 40056, 44004, 45002, 60011, 81013, 86003}
+
+# 文本消息内容的最大字节数，合并后超过该长度的消息不再合并
+MAX_TEXT_BYTES = 2048
+
+# 合并多条消息时使用的分隔
+COALESCE_SEPARATOR = "\n\n"
+
+# 发送中的消息超过该时间未完成，视为发送线程已退出，重新放回队列
+SENDING_LEASE_SECONDS = 120
+
+
+class OutboundQueue:
+    """本地持久化的消息发送队列
+
+    消息先写入SQLite再由后台线程发送，失败时按指数退避重试，
+    超过最大尝试次数或遇到不可重试的错误码时标记为死信。
+    """
+
+    def __init__(self, db_path=OUTBOX_DB_PATH, workers=OUTBOX_WORKERS, send_func=None,
+                 limiter=rate_limiter, coalesce_window=OUTBOX_COALESCE_WINDOW):
+        self.db_path = db_path
+        self.workers = workers
+        # 默认通过企业微信API发送，测试时可替换
+        self.send_func = send_func or wechat_api.send_message_result
+        self.limiter = limiter
+        self.coalesce_window = coalesce_window
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+        # 最近的投递耗时（入队到发送成功），用于统计
+        self._latencies = deque(maxlen=1000)
+        self._counters = {'sent': 0, 'retried': 0, 'dead': 0, 'token_refreshed': 0, 'throttled': 0, 'coalesced': 0}
+        self._stats_lock = threading.Lock()
+
+    def _connect(self):
+        """获取当前线程的SQLite连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def init_db(self):
+        """初始化队列表结构"""
+        with self._init_lock:
+            if self._initialized:
+                return
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = self._connect()
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipient TEXT NOT NULL,
+                content TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                claimed_at REAL,
+                last_error TEXT,
+                coalescible INTEGER NOT NULL DEFAULT 0
+            )
+            """)
+            # 兼容旧版本创建的队列文件
+            columns = [row['name'] for row in conn.execute("PRAGMA table_info(outbox)")]
+            if 'coalescible' not in columns:
+                conn.execute("ALTER TABLE outbox ADD COLUMN coalescible INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_recipient ON outbox(recipient, status)")
+            self._initialized = True
+
+    def enqueue(self, recipient, content, coalesce=False, delay=0):
+        """将消息加入发送队列，返回队列中的消息ID
+        
+        coalesce为True时，消息会等待合并窗口后再发送；窗口内发给同一接收者的
+        其他可合并消息会追加到同一条消息中，减少API调用和配额消耗。
+        delay为不合并的消息延后发送的秒数，用于错开批量推送。
+        """
+        self.init_db()
+        now = time.time()
+        conn = self._connect()
+        if not coalesce or self.coalesce_window <= 0:
+            cursor = conn.execute(
+                "INSERT INTO outbox (recipient, content, next_attempt_at, created_at) VALUES (?, ?, ?, ?)",
+                (recipient, content, now + delay, now)
+            )
+            self._wakeup.set()
+            return cursor.lastrowid
+        
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 仍在合并窗口内、尚未尝试发送的同一接收者消息
+            row = conn.execute(
+                "SELECT id, content FROM outbox WHERE recipient = ? AND status = 'pending' "
+                "AND coalescible = 1 AND attempts = 0 AND next_attempt_at > ? "
+                "ORDER BY id DESC LIMIT 1",
+                (recipient, now)
+            ).fetchone()
+            if row:
+                merged = row['content'] + COALESCE_SEPARATOR + content
+                if len(merged.encode('utf-8')) <= MAX_TEXT_BYTES:
+                    conn.execute("UPDATE outbox SET content = ? WHERE id = ?", (merged, row['id']))
+                    conn.execute("COMMIT")
+                    with self._stats_lock:
+                        self._counters['coalesced'] += 1
+                    return row['id']
+            cursor = conn.execute(
+                "INSERT INTO outbox (recipient, content, next_attempt_at, created_at, coalescible) "
+                "VALUES (?, ?, ?, ?, 1)",
+                (recipient, content, now + self.coalesce_window, now)
+            )
+            conn.execute("COMMIT")
+            return cursor.lastrowid
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _claim(self):
+        """取出一条到期的待发送消息并标记为发送中"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE outbox SET status = 'sending', claimed_at = ? WHERE id = ?",
+                    (now, row['id'])
+                )
+            conn.execute("COMMIT")
+            return row
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _recover_stale(self):
+        """将租约过期的发送中消息放回队列（进程崩溃后恢复）"""
+        self._connect().execute(
+            "UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND claimed_at < ?",
+            (time.time() - SENDING_LEASE_SECONDS,)
+        )
+
+    def _backoff(self, attempts):
+        """计算第attempts次失败后的等待时间（指数退避加随机抖动）"""
+        delay = min(OUTBOX_MAX_DELAY, OUTBOX_BASE_DELAY * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _deliver(self, row):
+        """发送一条消息并根据结果更新队列状态"""
+        conn = self._connect()
+        
+        # 超出发送配额时放回队列，等配额恢复后再发送，不计入尝试次数
+        wait = self.limiter.reserve(row['recipient']) if self.limiter else 0
+        if wait > 0:
+            conn.execute(
+                "UPDATE outbox SET status = 'pending', next_attempt_at = ? WHERE id = ?",
+                (time.time() + wait, row['id'])
+            )
+            with self._stats_lock:
+                self._counters['throttled'] += 1
+            return
+        
+        attempts = row['attempts'] + 1
+        result = self.send_func(row['recipient'], row['content'])
+        errcode = result.get('errcode')
+
+        if errcode == 0:
+            conn.execute("DELETE FROM outbox WHERE id = ?", (row['id'],))
+            with self._stats_lock:
+                self._counters['sent'] += 1
+                self._latencies.append(time.time() - row['created_at'])
+            return
+
+        error = f"{errcode}: {result.get('errmsg')}"
+        if errcode in TOKEN_ERRCODES:
+            # 令牌过期（send_message_result已作废该令牌），刷新后立即重试
+            print(f"发送队列: 访问令牌失效({errcode})，刷新后重试", flush=True)
+            delay = 0
+            with self._stats_lock:
+                self._counters['token_refreshed'] += 1
+        else:
+            delay = self._backoff(attempts)
+
+        if errcode in PERMANENT_ERRCODES or attempts >= OUTBOX_MAX_ATTEMPTS:
+            print(f"发送队列: 消息{row['id']}进入死信，原因: {error}", flush=True)
+            conn.execute(
+                "UPDATE outbox SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?",
+                (attempts, error, row['id'])
+            )
+            with self._stats_lock:
+                self._counters['dead'] += 1
+            return
+
+        print(f"发送队列: 消息{row['id']}第{attempts}次发送失败，{delay:.1f}秒后重试，原因: {error}", flush=True)
+        conn.execute(
+            "UPDATE outbox SET status = 'pending', attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (attempts, time.time() + delay, error, row['id'])
+        )
+        with self._stats_lock:
+            self._counters['retried'] += 1
+
+    def _worker(self):
+        """发送线程主循环"""
+        while not self._stopping.is_set():
+            try:
+                row = self._claim()
+            except Exception as e:
+                print(f"发送队列: 读取队列失败: {e}", flush=True)
+                row = None
+
+            if row is None:
+                self._wakeup.wait(timeout=1)
+                self._wakeup.clear()
+                continue
+
+            try:
+                self._deliver(row)
+            except Exception as e:
+                print(f"发送队列: 处理消息{row['id']}异常: {e}", flush=True)
+                import traceback
+                traceback.print_exc()
+
+    def start(self):
+        """初始化队列并启动发送线程"""
+        if self._threads:
+            return
+        self.init_db()
+        self._recover_stale()
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"outbox-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"发送队列已启动，发送线程数: {self.workers}", flush=True)
+
+    def stop(self, timeout=5):
+        """停止发送线程，未发送的消息保留在队列中等待下次启动"""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def depth(self):
+        """各状态的消息数"""
+        self.init_db()
+        depth = {'pending': 0, 'sending': 0, 'dead': 0}
+        for row in self._connect().execute("SELECT status, COUNT(*) AS count FROM outbox GROUP BY status"):
+            depth[row['status']] = row['count']
+        return depth
+
+    def counters(self):
+        """本进程的发送计数"""
+        with self._stats_lock:
+            return dict(self._counters)
+
+    def stats(self):
+        """获取队列深度和投递耗时统计"""
+        self.init_db()
+        conn = self._connect()
+        depth = self.depth()
+
+        oldest = conn.execute(
+            "SELECT MIN(created_at) AS oldest FROM outbox WHERE status IN ('pending', 'sending')"
+        ).fetchone()['oldest']
+        dead_letters = [
+            dict(row) for row in conn.execute(
+                "SELECT id, recipient, attempts, created_at, last_error FROM outbox "
+                "WHERE status = 'dead' ORDER BY id DESC LIMIT 20"
+            )
+        ]
+
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            counters = dict(self._counters)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3)
+
+        return {
+            'depth': depth,
+            'oldest_pending_age': round(time.time() - oldest, 3) if oldest else None,
+            'counters': counters,
+            'latency_seconds': {
+                'samples': len(latencies),
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'p99': percentile(0.99),
+                'max': round(latencies[-1], 3) if latencies else None
+            },
+            'dead_letters': dead_letters
+        }
+
+# 创建消息发送队列实例
+outbox = OutboundQueue()
+registry.gauge('baby_outbox_depth', '消息发送队列中各状态的消息数', ['status'],
+               func=lambda: {(status,): count for status, count in outbox.depth().items()})
+registry.counter('baby_outbox_messages_total', '消息发送队列的处理计数：sent/retried/dead/token_refreshed/throttled/coalesced',
+                 ['event'], func=lambda: {(event,): count for event, count in outbox.counters().items()})
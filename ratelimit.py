@@ -0,0 +1,84 @@
+import time
+import threading
+from collections import OrderedDict
+
+from config import (
+    RATE_LIMIT_APP_PER_MINUTE, RATE_LIMIT_USER_PER_MINUTE,
+    RATE_LIMIT_USER_PER_HOUR, RATE_LIMIT_CHAT_PER_MINUTE
+)
+
+# 最多跟踪的接收者数量，超出后淘汰最久未发送的接收者
+MAX_TRACKED_RECIPIENTS = 10000
+
+
+class TokenBucket:
+    """令牌桶：每秒补充rate个令牌，最多累积capacity个"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, per_period, period):
+        self.rate = per_period / period
+        self.capacity = per_period
+        self.tokens = float(per_period)
+        self.updated = time.monotonic()
+
+    def wait_time(self, now):
+        """补充令牌，返回还需等待多少秒才有一个可用令牌"""
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        """取走一个令牌"""
+        self.tokens -= 1
+
+
+class RateLimiter:
+    """企业微信发送配额限流
+
+    整个应用一个令牌桶，每个接收者按分钟和小时各一个令牌桶，
+    只有所有相关令牌桶都有令牌时才允许发送。配额按进程计算，
+    多工作进程部署时应按进程数缩小配置。
+    """
+
+    def __init__(self, app_per_minute=RATE_LIMIT_APP_PER_MINUTE, user_per_minute=RATE_LIMIT_USER_PER_MINUTE,
+                 user_per_hour=RATE_LIMIT_USER_PER_HOUR, chat_per_minute=RATE_LIMIT_CHAT_PER_MINUTE):
+        self.app_bucket = TokenBucket(app_per_minute, 60)
+        self.user_per_minute = user_per_minute
+        self.user_per_hour = user_per_hour
+        self.chat_per_minute = chat_per_minute
+        self._recipient_buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _buckets_for(self, recipient):
+        """获取接收者的令牌桶，群聊和用户使用不同的配额"""
+        buckets = self._recipient_buckets.get(recipient)
+        if buckets is None:
+            if recipient.startswith('chat'):
+                buckets = (TokenBucket(self.chat_per_minute, 60),)
+            else:
+                buckets = (TokenBucket(self.user_per_minute, 60), TokenBucket(self.user_per_hour, 3600))
+            self._recipient_buckets[recipient] = buckets
+            if len(self._recipient_buckets) > MAX_TRACKED_RECIPIENTS:
+                self._recipient_buckets.popitem(last=False)
+        else:
+            self._recipient_buckets.move_to_end(recipient)
+        return buckets
+
+    def reserve(self, recipient):
+        """尝试占用一次发送配额，成功返回0，否则返回需要等待的秒数（不占用配额）"""
+        with self._lock:
+            buckets = (self.app_bucket,) + self._buckets_for(recipient)
+            now = time.monotonic()
+            wait = max(bucket.wait_time(now) for bucket in buckets)
+            if wait > 0:
+                return wait
+            for bucket in buckets:
+                bucket.consume()
+            return 0
+
+# 创建发送限流器实例
+rate_limiter = RateLimiter()
@@ -0,0 +1,121 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+
+from config import REPORT_CACHE_MAX_ENTRIES
+from db import db
+from data_version import data_version
+
+
+class CachedReport:
+    """一份已生成的日报及其HTTP校验信息，version为生成前读取的租户数据版本号"""
+
+    __slots__ = ('content', 'etag', 'last_modified', 'version')
+
+    def __init__(self, content, last_modified, version=None):
+        self.content = content
+        self.etag = '"' + hashlib.sha1(content.encode('utf-8')).hexdigest()[:20] + '"'
+        self.last_modified = last_modified
+        self.version = version
+
+    @property
+    def last_modified_http(self):
+        """HTTP格式的Last-Modified时间"""
+        return formatdate(self.last_modified, usegmt=True)
+
+
+class ReportCache:
+    """日报缓存
+
+    按(租户, 日期, 格式)缓存生成好的日报，过去的日期只有在记录被修改或删除时才会变化，
+    因此不设过期时间，而是由写库操作精确地使对应租户、日期的缓存失效。
+    每个(租户, 日期)维护一个版本号，生成期间被写入时丢弃生成结果，避免缓存旧数据。
+
+    写库的变更监听器只在写入的进程中调用，因此每个条目还记录生成前的租户数据版本号
+    （多个工作进程共享），读取时与当前版本号比较：本进程的写入通过监听器把未受影响的
+    条目更新到新版本号，其他进程写入后版本号不一致，该租户的条目重新生成。
+    """
+
+    def __init__(self, max_entries=REPORT_CACHE_MAX_ENTRIES, versions=data_version):
+        self.max_entries = max_entries
+        self.versions = versions
+        self._entries = OrderedDict()
+        self._generations = {}
+        # (租户, 日期) -> [修改时间, 记录修改时间时的数据版本号]
+        self._modified_at = {}
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id, date_str, fmt, builder):
+        """获取日报，未缓存时调用builder()生成；builder返回None表示生成失败，结果不缓存"""
+        key = (tenant_id, date_str, fmt)
+        day = (tenant_id, date_str)
+        version = self.versions.get(tenant_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version:
+                self._entries.move_to_end(key)
+                return entry
+            previous = entry
+            generation = self._generations.get(day, 0)
+
+        content = builder()
+        if content is None:
+            return None
+
+        with self._lock:
+            if previous is not None and previous.content == content:
+                # 其他进程的写入没有改变这一天的内容
+                last_modified = previous.last_modified
+            else:
+                last_modified = self._last_modified(day, version)
+            entry = CachedReport(content, last_modified, version)
+            if self._generations.get(day, 0) == generation:
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def _last_modified(self, day, version):
+        """日期的修改时间；记录之后有其他进程写入该租户时无法确定，按当前时间计"""
+        modified = self._modified_at.get(day)
+        if modified is None or modified[1] != version:
+            modified = self._modified_at[day] = [time.time(), version]
+        return modified[0]
+
+    def invalidate(self, tenant_id, date_str, version=None):
+        """使租户指定日期所有格式的缓存失效
+
+        version为本次写入后的数据版本号，该租户其他日期版本号为version-1的条目仍然有效，
+        更新为version；不传时其他日期的条目在下次读取时按版本号判断。
+        """
+        day = (tenant_id, date_str)
+        with self._lock:
+            # 版本号取自全局递增计数，清理后重新写入的版本号不会与清理前相同
+            self._counter += 1
+            self._generations[day] = self._counter
+            self._modified_at[day] = [time.time(), version]
+            for key in [key for key in self._entries if key[:2] == day]:
+                del self._entries[key]
+            if version is not None:
+                for key, entry in self._entries.items():
+                    if key[0] == tenant_id and entry.version == version - 1:
+                        entry.version = version
+                for key, modified in self._modified_at.items():
+                    if key[0] == tenant_id and modified[1] == version - 1:
+                        modified[1] = version
+            # 租户较多时版本号会持续增长，只保留仍有缓存的日期
+            if len(self._generations) > self.max_entries * 4:
+                cached = {key[:2] for key in self._entries}
+                self._generations = {k: v for k, v in self._generations.items() if k in cached or k == day}
+                self._modified_at = {k: v for k, v in self._modified_at.items() if k in cached or k == day}
+
+    def on_record_change(self, event):
+        """数据变更监听器：记录写入或删除后使所在日期的日报失效"""
+        self.invalidate(event['tenant_id'], event['record_time'].strftime('%Y-%m-%d'), event.get('data_version'))
+
+# 创建日报缓存实例，写库后使对应日期的缓存失效
+report_cache = ReportCache()
+db.add_change_listener(report_cache.on_record_change)
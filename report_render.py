@@ -0,0 +1,302 @@
+import html
+import json
+import string
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+# 记录类型的输出顺序，与数据库中枚举的顺序一致
+RECORD_TYPES = ['吃', '大便', '小便', '睡', '体温', '吃药', '其他']
+
+# 记录类型对应的emoji
+RECORD_TYPE_EMOJI = {
+    '吃': '🍼',
+    '大便': '💩',
+    '小便': '💦',
+    '睡': '😴',
+    '体温': '🌡️',
+    '吃药': '💊',
+    '其他': '📝'
+}
+
+# 各格式的模板片段，使用str.format语法；字段值在填入前已按格式转义
+# day_open/day_close: 每天的开头和结尾；group_open/item/group_close: 每种记录类型；
+# empty_day: 单日无记录；range_*: 多日报表的开头、日期之间的分隔和结尾
+TEMPLATES = {
+    'text': {
+        'day_open': "📅 {date_display}日报 📅\n{rule}\n\n",
+        'group_open': "{emoji} {record_type}记录 ({count}条):\n",
+        'item': "  {index}. {time}{amount_suffix}\n",
+        'group_close': "\n",
+        'day_close': "{rule}\n共记录 {total} 条信息",
+        'empty_day': "未找到 {date_display} 的记录！",
+        'range_open': "",
+        'range_separator': "\n\n",
+        'range_close': "",
+        'empty_range': "未找到 {start_display}至{end_display} 的记录！",
+    },
+    # 企业微信markdown消息支持的语法：标题、加粗、引用、字体颜色
+    'markdown': {
+        'day_open': "## 📅 {date_display}日报\n",
+        'group_open': "**{emoji} {record_type}** <font color=\"comment\">{count}条</font>\n",
+        'item': "> {time}{amount_suffix}\n",
+        'group_close': "\n",
+        'day_close': "共记录 **{total}** 条信息",
+        'empty_day': "未找到 {date_display} 的记录！",
+        'range_open': "# 📅 {start_display}至{end_display}报表\n\n",
+        'range_separator': "\n\n",
+        'range_close': "",
+        'empty_range': "未找到 {start_display}至{end_display} 的记录！",
+    },
+    'html': {
+        'day_open': "<section class=\"day\"><h2>📅 {date_display}日报</h2>\n",
+        'group_open': "<h3>{emoji} {record_type}记录 ({count}条)</h3>\n<ol>\n",
+        'item': "<li>{time}{amount_suffix}</li>\n",
+        'group_close': "</ol>\n",
+        'day_close': "<p class=\"total\">共记录 {total} 条信息</p></section>",
+        'empty_day': "<section class=\"day\"><p>未找到 {date_display} 的记录！</p></section>",
+        'range_open': "",
+        'range_separator': "\n",
+        'range_close': "",
+        'empty_range': "<p>未找到 {start_display}至{end_display} 的记录！</p>",
+    },
+    'json': {
+        'day_open': "{{\"date\":{date},\"total\":{total},\"groups\":[",
+        'group_open': "{separator}{{\"record_type\":{record_type},\"count\":{count},\"records\":[",
+        'item': "{separator}{{\"time\":{time},\"amount\":{amount},\"amount_unit\":{amount_unit},\"description\":{description}}}",
+        'group_close': "]}}",
+        'day_close': "]}}",
+        'empty_day': "{{\"date\":{date},\"total\":0,\"groups\":[]}}",
+        'range_open': "{{\"start_date\":{start_date},\"end_date\":{end_date},\"days\":[",
+        'range_separator': ",",
+        'range_close': "]}}",
+        'empty_range': "{{\"start_date\":{start_date},\"end_date\":{end_date},\"days\":[]}}",
+    },
+}
+
+# HTML页面外框
+PAGE_TEMPLATE = """
+        <html>
+            <head>
+                <title>{title}</title>
+                <meta name="viewport" content="width=device-width, initial-scale=1.0">
+                <style>
+                    body {{ font-family: Arial, sans-serif; margin: 20px; line-height: 1.6; }}
+                    .container {{ max-width: 600px; margin: 0 auto; }}
+                    h1 {{ color: #2c3e50; }}
+                    .day {{ background: #f5f5f5; padding: 15px; border-radius: 5px; margin-bottom: 15px; }}
+                    .day h3 {{ margin-bottom: 0; }}
+                    .total {{ font-weight: bold; }}
+                </style>
+            </head>
+            <body>
+                <div class="container">
+                    <h1>{heading}</h1>
+                    {body}
+                </div>
+            </body>
+        </html>
+        """
+
+# 各格式的字段转义方式
+ESCAPES = {
+    'text': str,
+    'markdown': str,
+    'html': lambda value: html.escape(str(value)),
+    'json': lambda value: json.dumps(value, ensure_ascii=False),
+}
+
+# 响应的Content-Type（text类型由框架补充charset）
+MEDIA_TYPES = {
+    'text': 'text/plain',
+    'markdown': 'text/markdown',
+    'html': 'text/html',
+    'json': 'application/json',
+}
+
+
+def get_record_type_emoji(record_type):
+    """获取记录类型对应的emoji"""
+    return RECORD_TYPE_EMOJI.get(record_type, '📝')
+
+
+class TemplateFields(dict):
+    """模板字段，未传入的字段按None填充"""
+
+    def __missing__(self, key):
+        return None
+
+
+def compile_fragment(template):
+    """把str.format模板包装为渲染函数，未传入的字段按None填充，多余的参数忽略
+
+    模板在编译时检查字段名，渲染时用format_map填值；字段值只作为数据填入，其中的
+    花括号和引号不会被当作模板语法。
+    """
+    for _, field, _, _ in string.Formatter().parse(template):
+        if field is not None and not field.isidentifier():
+            raise ValueError(f"模板字段名无效: {field}")
+    format_map = template.format_map
+    return lambda **fields: format_map(TemplateFields(fields))
+
+
+class ReportTemplate:
+    """一种输出格式的已编译模板"""
+
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.escape = ESCAPES[fmt]
+        for name, template in TEMPLATES[fmt].items():
+            setattr(self, name, compile_fragment(template))
+
+
+@lru_cache(maxsize=None)
+def get_template(fmt):
+    """获取格式对应的已编译模板，每种格式只编译一次"""
+    if fmt not in TEMPLATES:
+        raise ValueError(f"不支持的报表格式: {fmt}")
+    return ReportTemplate(fmt)
+
+
+@lru_cache(maxsize=1)
+def get_page_template():
+    """获取已编译的HTML页面外框"""
+    return compile_fragment(PAGE_TEMPLATE)
+
+
+def format_date_display(date_str):
+    """2025-05-01 -> 2025年05月01日"""
+    return datetime.strptime(date_str, '%Y-%m-%d').strftime('%Y年%m月%d日')
+
+
+def group_records_by_day(records):
+    """把按时间排序的记录按日期和类型分组，逐日产出(日期, {类型: 记录列表})"""
+    current_date = None
+    grouped = None
+    for record in records:
+        date_str = record['record_time'].strftime('%Y-%m-%d')
+        if date_str != current_date:
+            if grouped:
+                yield current_date, order_groups(grouped)
+            current_date = date_str
+            grouped = {}
+        grouped.setdefault(record['record_type'], []).append(record)
+    if grouped:
+        yield current_date, order_groups(grouped)
+
+
+def order_groups(grouped):
+    """按记录类型的固定顺序排列分组"""
+    ordered = {record_type: grouped[record_type] for record_type in RECORD_TYPES if record_type in grouped}
+    for record_type, records in grouped.items():
+        ordered.setdefault(record_type, records)
+    return ordered
+
+
+def period_range(date_str, period):
+    """计算日期所在的日、周（周一至周日）或月的起止日期"""
+    day = datetime.strptime(date_str, '%Y-%m-%d').date()
+    if period == 'day':
+        start, end = day, day
+    elif period == 'week':
+        start = day - timedelta(days=day.weekday())
+        end = start + timedelta(days=6)
+    elif period == 'month':
+        start = day.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    else:
+        raise ValueError(f"不支持的报表周期: {period}")
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+
+class ReportRenderer:
+    """报表渲染器
+
+    同一份分组数据（{记录类型: 记录列表}）可以渲染为纯文本、企业微信markdown、HTML和JSON，
+    所有格式共用一条渲染路径，只有模板不同。多日报表以生成器方式逐日输出，
+    内存占用和耗时与记录数成线性关系。
+    """
+
+    def iter_day(self, fmt, date_str, grouped_records):
+        """逐段输出一天的报表"""
+        template = get_template(fmt)
+        escape = template.escape
+        if not grouped_records:
+            yield template.empty_day(date=escape(date_str), date_display=escape(format_date_display(date_str)))
+            return
+
+        total = sum(len(records) for records in grouped_records.values())
+        yield template.day_open(
+            date=escape(date_str),
+            date_display=escape(format_date_display(date_str)),
+            total=total,
+            rule='=' * 30
+        )
+        chunk = []
+        for group_index, (record_type, records) in enumerate(grouped_records.items()):
+            chunk.append(template.group_open(
+                separator=',' if group_index else '',
+                emoji=get_record_type_emoji(record_type),
+                record_type=escape(record_type),
+                count=len(records)
+            ))
+            for index, rec in enumerate(records, 1):
+                amount = rec.get('amount')
+                amount_unit = rec.get('amount_unit')
+                amount_suffix = ''
+                if amount:
+                    amount_suffix = f" {amount}{amount_unit}" if amount_unit else f" {amount}"
+                chunk.append(template.item(
+                    separator=',' if index > 1 else '',
+                    index=index,
+                    time=escape(rec['record_time'].strftime('%H:%M')),
+                    amount_suffix=escape(amount_suffix),
+                    amount=escape(amount),
+                    amount_unit=escape(amount_unit),
+                    description=escape(rec.get('description'))
+                ))
+            chunk.append(template.group_close())
+            yield ''.join(chunk)
+            chunk = []
+        yield template.day_close(total=total, rule='=' * 30)
+
+    def render_day(self, fmt, date_str, grouped_records):
+        """渲染一天的报表"""
+        return ''.join(self.iter_day(fmt, date_str, grouped_records))
+
+    def iter_range(self, fmt, start_date, end_date, records):
+        """逐段输出多日报表，records为按时间排序的记录迭代器，没有记录的日期不输出"""
+        template = get_template(fmt)
+        escape = template.escape
+        names = {
+            'start_date': escape(start_date),
+            'end_date': escape(end_date),
+            'start_display': escape(format_date_display(start_date)),
+            'end_display': escape(format_date_display(end_date)),
+        }
+        empty = True
+        for date_str, grouped_records in group_records_by_day(records):
+            if empty:
+                yield template.range_open(**names)
+                empty = False
+            else:
+                yield template.range_separator()
+            yield from self.iter_day(fmt, date_str, grouped_records)
+        if empty:
+            yield template.empty_range(**names)
+        else:
+            yield template.range_close()
+
+    def render_page(self, title, body, heading=None):
+        """把HTML报表放入页面外框"""
+        return ''.join(self.iter_page(title, [body], heading))
+
+    def iter_page(self, title, chunks, heading=None):
+        """逐段输出HTML页面，chunks为页面主体内容"""
+        page = get_page_template()(title=html.escape(title), heading=html.escape(heading or title), body='\0')
+        head, tail = page.split('\0', 1)
+        yield head
+        yield from chunks
+        yield tail
+
+# 创建报表渲染器实例
+report_renderer = ReportRenderer()
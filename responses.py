@@ -0,0 +1,81 @@
+import gzip
+import json
+from datetime import datetime, date
+
+from fastapi import Response
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+from config import COMPRESS_MIN_BYTES, GZIP_LEVEL, BROTLI_QUALITY
+
+# 时间统一输出为与数据库一致的格式，而不是ISO 8601的 2024-01-01T08:00:00
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def default(value):
+    """序列化JSON原生不支持的类型"""
+    if isinstance(value, datetime):
+        return value.strftime(DATETIME_FORMAT)
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+def dumps(data):
+    """序列化为UTF-8编码的JSON字节串，安装了orjson时使用orjson"""
+    if HAS_ORJSON:
+        return orjson.dumps(data, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(data, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def accepted_encodings(accept_encoding):
+    """解析Accept-Encoding请求头，返回客户端接受的编码集合（忽略q=0）"""
+    encodings = set()
+    for part in (accept_encoding or '').lower().split(','):
+        name, _, params = part.strip().partition(';')
+        if not name:
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        encodings.add(name)
+    return encodings
+
+
+def compress(body, accept_encoding):
+    """按客户端接受的编码压缩响应内容，返回(内容, 编码)，不压缩时编码为None
+
+    优先使用brotli（需要安装brotli），其次gzip；小于COMPRESS_MIN_BYTES的内容不压缩。
+    """
+    if len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    encodings = accepted_encodings(accept_encoding)
+    if HAS_BROTLI and ('br' in encodings or '*' in encodings):
+        return brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    if 'gzip' in encodings or '*' in encodings:
+        # mtime固定为0，相同内容压缩结果相同
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), 'gzip'
+    return body, None
+
+
+def json_response(data, accept_encoding=None, status_code=200):
+    """序列化并按需压缩，返回JSON响应"""
+    body, encoding = compress(dumps(data), accept_encoding)
+    headers = {'Vary': 'Accept-Encoding'}
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(content=body, status_code=status_code, media_type='application/json', headers=headers)
@@ -0,0 +1,185 @@
+import os
+import json
+import random
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+from config import (
+    REPORT_PUSH_TIME, REPORT_PUSH_DAY, REPORT_PUSH_RECIPIENTS,
+    REPORT_PUSH_JITTER, REPORT_PUSH_CATCHUP_DAYS, REPORT_PUSH_STATE_PATH
+)
+from outbox import outbox
+from tenancy import tenant_resolver
+
+# 推送失败（如数据库不可用）后的重试间隔（秒）
+RETRY_SECONDS = 60
+
+
+class ReportScheduler:
+    """日报定时推送
+
+    每天在push_time把当天（或前一天）的日报推送给配置的成员和群聊，每个接收者收到所属租户的日报。
+    每个租户的每个日期只查询、生成一次日报，再为该租户的接收者加入发送队列，发送并发和频率由发送队列的线程数和限流控制；
+    每条消息随机延后0~jitter秒，避免同一时刻集中调用企业微信API。
+    最后一次推送的日期记录在状态文件中，服务重启后补推停机期间错过的日报（最多catchup_days天）；
+    多个工作进程通过文件锁保证同一日期只推送一次。
+    """
+
+    def __init__(self, push_time=REPORT_PUSH_TIME, report_day=REPORT_PUSH_DAY, recipients=REPORT_PUSH_RECIPIENTS,
+                 jitter=REPORT_PUSH_JITTER, catchup_days=REPORT_PUSH_CATCHUP_DAYS, state_path=REPORT_PUSH_STATE_PATH,
+                 queue=outbox, resolver=tenant_resolver):
+        hour, minute = push_time.split(':')
+        self.push_hour = int(hour)
+        self.push_minute = int(minute)
+        self.report_day = report_day
+        self.recipients = [r.strip() for r in recipients.split(',') if r.strip()] if isinstance(recipients, str) else list(recipients)
+        self.jitter = jitter
+        self.catchup_days = catchup_days
+        self.state_path = state_path
+        self.queue = queue
+        self.resolver = resolver
+        self.report_func = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self, report_func):
+        """启动调度线程，report_func(tenant_id, date_str)返回租户该日期的日报文本，查询失败时返回None"""
+        if self._thread or not self.recipients:
+            if not self.recipients:
+                print("未配置日报推送接收者，定时推送未启动", flush=True)
+            return
+        self.report_func = report_func
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._loop, name="report-scheduler", daemon=True)
+        self._thread.start()
+        print(f"日报定时推送已启动，每天 {self.push_hour:02d}:{self.push_minute:02d} 推送给 {len(self.recipients)} 个接收者", flush=True)
+
+    def stop(self, timeout=5):
+        """停止调度线程"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _loop(self):
+        """调度主循环：启动时先补推，之后每天到点推送"""
+        while not self._stopping.is_set():
+            wait = None
+            try:
+                self.run_due()
+            except Exception as e:
+                print(f"日报定时推送异常，{RETRY_SECONDS}秒后重试: {e}", flush=True)
+                wait = RETRY_SECONDS
+            if wait is None:
+                wait = (self.next_run_at(datetime.now()) - datetime.now()).total_seconds()
+            self._stopping.wait(timeout=max(1, wait))
+
+    def next_run_at(self, now):
+        """下一次推送时间"""
+        run_at = now.replace(hour=self.push_hour, minute=self.push_minute, second=0, microsecond=0)
+        if run_at <= now:
+            run_at += timedelta(days=1)
+        return run_at
+
+    def latest_run_date(self, now):
+        """最近一次已到推送时间的日期"""
+        today = now.date()
+        if (now.hour, now.minute) >= (self.push_hour, self.push_minute):
+            return today
+        return today - timedelta(days=1)
+
+    def due_dates(self, now, last_run_date):
+        """从上次推送之后到现在应推送的日期（按推送当天计），最多catchup_days天"""
+        latest = self.latest_run_date(now)
+        first = max(last_run_date + timedelta(days=1), latest - timedelta(days=max(1, self.catchup_days) - 1))
+        dates = []
+        day = first
+        while day <= latest:
+            dates.append(day)
+            day += timedelta(days=1)
+        return dates
+
+    def run_due(self, now=None):
+        """推送所有到期的日报，返回已推送的日报日期列表"""
+        pushed = []
+        with self._state_lock():
+            now = now or datetime.now()
+            state = self._read_state()
+            last_run = state.get('last_run_date')
+            if not last_run:
+                # 首次启动不补推历史日期，从下一次推送时间开始
+                state['last_run_date'] = self.latest_run_date(now).strftime('%Y-%m-%d')
+                self._write_state(state)
+                return pushed
+            last_run_date = datetime.strptime(last_run, '%Y-%m-%d').date()
+            for run_date in self.due_dates(now, last_run_date):
+                report_date = run_date - timedelta(days=1) if self.report_day == 'yesterday' else run_date
+                self.push(report_date.strftime('%Y-%m-%d'))
+                pushed.append(report_date.strftime('%Y-%m-%d'))
+                # 每推送一天就记录一次，推送过程中重启不会重复推送已完成的日期
+                state['last_run_date'] = run_date.strftime('%Y-%m-%d')
+                state['last_pushed_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                self._write_state(state)
+        return pushed
+
+    def push(self, date_str):
+        """为每个租户生成一次日报，加入该租户接收者的发送队列"""
+        by_tenant = {}
+        for recipient in self.recipients:
+            by_tenant.setdefault(self.resolver.resolve_recipient(recipient), []).append(recipient)
+        # 先生成所有租户的日报，任何一个失败时整个日期稍后重试，不会重复推送已入队的租户
+        contents = {}
+        for tenant_id in by_tenant:
+            contents[tenant_id] = self.report_func(tenant_id, date_str)
+            if contents[tenant_id] is None:
+                raise RuntimeError(f"生成租户 {tenant_id} {date_str} 的日报失败")
+        for tenant_id, recipients in by_tenant.items():
+            for recipient in recipients:
+                self.queue.enqueue(recipient, contents[tenant_id], delay=random.uniform(0, self.jitter))
+        print(f"已将 {date_str} 的日报加入发送队列，租户 {len(by_tenant)} 个，接收者 {len(self.recipients)} 个", flush=True)
+
+    @contextmanager
+    def _state_lock(self):
+        """跨进程的推送锁，不支持文件锁的平台上不加锁"""
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not HAS_FCNTL:
+            yield
+            return
+        with open(self.state_path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_state(self):
+        """读取推送状态"""
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"读取日报推送状态失败: {e}", flush=True)
+            return {}
+
+    def _write_state(self, state):
+        """原子地写入推送状态"""
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+# 创建日报定时推送实例
+report_scheduler = ReportScheduler()
@@ -0,0 +1,77 @@
+import re
+from datetime import datetime, timedelta
+
+from db import db
+
+# 每页最多返回的记录数
+MAX_PAGE_SIZE = 100
+
+# 一次搜索最多使用的关键词数
+MAX_TERMS = 8
+
+# 布尔模式中有特殊含义的字符，用户输入中的这些字符按分隔符处理
+BOOLEAN_OPERATORS = re.compile(r'[+\-<>()~*"@]+')
+
+# ngram分词器的词元长度（MySQL默认ngram_token_size=2）
+NGRAM_TOKEN_SIZE = 2
+
+# 排序方式
+SORTS = ('relevance', 'time')
+
+
+def build_boolean_query(text):
+    """把用户输入的关键词转换为全文索引的布尔模式查询，所有关键词都必须出现
+
+    多个关键词用空格分隔；每个关键词作为短语匹配（ngram分词后相邻），
+    短于ngram词元的关键词按前缀匹配。没有有效关键词时返回None。
+    """
+    terms = BOOLEAN_OPERATORS.sub(' ', text or '').split()[:MAX_TERMS]
+    if not terms:
+        return None
+    parts = []
+    for term in terms:
+        if len(term) < NGRAM_TOKEN_SIZE:
+            parts.append(f'+{term}*')
+        else:
+            parts.append(f'+"{term}"')
+    return ' '.join(parts)
+
+
+def search_records(tenant_id, text, start_date=None, end_date=None, record_type=None,
+                   page=1, page_size=20, sort='relevance'):
+    """在租户的记录描述（原始消息）中全文搜索，返回分页结果，查询失败时返回None
+
+    使用description上的ngram全文索引，写入、修改和删除随事务提交更新索引。
+    """
+    query = build_boolean_query(text)
+    if query is None:
+        raise ValueError("请输入搜索关键词")
+    if sort not in SORTS:
+        raise ValueError(f"不支持的排序方式: {sort}")
+    if page < 1 or not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise ValueError(f"page从1开始，page_size为1到{MAX_PAGE_SIZE}")
+    start_time = datetime.strptime(start_date, '%Y-%m-%d') if start_date else None
+    end_time = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1) if end_date else None
+    if start_time and end_time and end_time <= start_time:
+        raise ValueError("结束日期不能早于开始日期")
+
+    result = db.search_records(tenant_id, query, start_time, end_time, record_type,
+                               limit=page_size, offset=(page - 1) * page_size, order_by_time=sort == 'time')
+    if result is None:
+        return None
+    total, rows = result
+    records = []
+    for row in rows:
+        item = dict(row)
+        item['score'] = round(float(item['score']), 4)
+        records.append(item)
+    return {
+        'tenant_id': tenant_id,
+        'q': text,
+        'query': query,
+        'page': page,
+        'page_size': page_size,
+        'total': total,
+        'pages': (total + page_size - 1) // page_size,
+        'records': records
+    }
@@ -1,7 +1,7 @@
 #!/bin/bash
 
-# 创建日志目录
-mkdir -p logs
+# 创建日志和数据目录
+mkdir -p logs data
 
 # 检查.env文件是否存在
 if [ ! -f .env ]; then
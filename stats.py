@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+
+from db import db
+
+# 时间桶对应的SQL表达式（在pymysql中%需要写成%%）
+BUCKET_EXPRESSIONS = {
+    'hour': "DATE_FORMAT(record_time, '%%Y-%%m-%%d %%H:00')",
+    'day': "DATE_FORMAT(record_time, '%%Y-%%m-%%d')",
+    'week': "DATE_FORMAT(DATE_SUB(record_time, INTERVAL WEEKDAY(record_time) DAY), '%%Y-%%m-%%d')",
+}
+
+# 按桶相加的计数和总量字段
+SUM_FIELDS = ['total', 'feed_count', 'ml_fed', 'ml_feed_count', 'sleep_count', 'sleep_minutes',
+              'poop_count', 'pee_count', 'medicine_count']
+
+
+def to_number(value):
+    """把数据库返回的Decimal转换为int或float"""
+    if value is None:
+        return None
+    number = float(value)
+    return int(number) if number.is_integer() else round(number, 2)
+
+
+def feeding_intervals(rows):
+    """根据按时间排序的(桶, 秒数)计算相邻两次喂奶的间隔，间隔计入后一次喂奶所在的桶
+
+    返回{桶: [间隔数, 间隔总分钟, 最短间隔, 最长间隔]}
+    """
+    intervals = {}
+    previous = None
+    for bucket, seconds in rows:
+        if previous is not None:
+            minutes = (seconds - previous) / 60
+            item = intervals.get(bucket)
+            if item is None:
+                intervals[bucket] = [1, minutes, minutes, minutes]
+            else:
+                item[0] += 1
+                item[1] += minutes
+                item[2] = min(item[2], minutes)
+                item[3] = max(item[3], minutes)
+        previous = seconds
+    return intervals
+
+
+def finish_bucket(item):
+    """根据汇总字段计算平均值，输出一个桶的统计结果"""
+    for field in SUM_FIELDS:
+        item[field] = to_number(item.get(field)) or 0
+    item['temperature_min'] = to_number(item.get('temperature_min'))
+    item['temperature_max'] = to_number(item.get('temperature_max'))
+    item['avg_ml_per_feed'] = round(item['ml_fed'] / item['ml_feed_count'], 1) if item['ml_feed_count'] else None
+    item['diaper_count'] = item['poop_count'] + item['pee_count']
+    interval = item.pop('_interval', None)
+    item['feeding_interval_avg_minutes'] = round(interval[1] / interval[0], 1) if interval else None
+    item['feeding_interval_min_minutes'] = round(interval[2], 1) if interval else None
+    item['feeding_interval_max_minutes'] = round(interval[3], 1) if interval else None
+    return item
+
+
+def compute_stats(tenant_id, start_date, end_date, record_type=None, bucket='day'):
+    """统计租户在日期范围（含起止日期）内每个时间桶的计数、总量和平均值，查询失败时返回None
+
+    聚合在数据库中完成，每个桶只返回一行；喂奶间隔只读取喂奶时间一列，单次遍历计算。
+    """
+    if bucket not in BUCKET_EXPRESSIONS:
+        raise ValueError(f"不支持的统计粒度: {bucket}")
+    start_time = datetime.strptime(start_date, '%Y-%m-%d')
+    end_time = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+    if end_time <= start_time:
+        raise ValueError("结束日期不能早于开始日期")
+
+    bucket_expr = BUCKET_EXPRESSIONS[bucket]
+    rows = db.get_bucket_stats(tenant_id, start_time, end_time, bucket_expr, record_type)
+    if rows is None:
+        return None
+
+    intervals = {}
+    if record_type in (None, '吃'):
+        times = db.get_record_times(tenant_id, start_time, end_time, '吃', bucket_expr)
+        if times is None:
+            return None
+        intervals = feeding_intervals(times)
+
+    buckets = []
+    summary = {'_interval': None}
+    for row in rows:
+        item = dict(row)
+        item['_interval'] = intervals.get(item['bucket'])
+        # 汇总整个范围
+        for field in SUM_FIELDS:
+            summary[field] = (summary.get(field) or 0) + (item.get(field) or 0)
+        for field, pick in (('temperature_min', min), ('temperature_max', max)):
+            if item.get(field) is not None:
+                summary[field] = item[field] if summary.get(field) is None else pick(summary[field], item[field])
+        if item['_interval']:
+            count, total, shortest, longest = item['_interval']
+            merged = summary['_interval']
+            summary['_interval'] = [count, total, shortest, longest] if merged is None else [
+                merged[0] + count, merged[1] + total, min(merged[2], shortest), max(merged[3], longest)
+            ]
+        buckets.append(finish_bucket(item))
+
+    return {
+        'tenant_id': tenant_id,
+        'start_date': start_date,
+        'end_date': end_date,
+        'type': record_type,
+        'bucket': bucket,
+        'summary': finish_bucket(summary),
+        'buckets': buckets
+    }
@@ -0,0 +1,116 @@
+import json
+import zlib
+
+from config import DB_CONFIG, DEFAULT_TENANT, TENANT_AUTO, TENANT_CONFIG_PATH
+
+# 租户ID的最大长度，与baby_records.tenant_id列一致
+TENANT_ID_MAX_LENGTH = 64
+
+# 主库分片名，对应.env中的数据库配置
+DEFAULT_SHARD = 'default'
+
+
+def load_tenant_config(path=TENANT_CONFIG_PATH):
+    """读取租户配置文件，未配置或读取失败时返回空配置
+
+    格式：
+    {
+        "shards": {"shard1": {"host": "10.0.0.2", "database": "baby_records"}},
+        "hash_shards": ["default", "shard1"],
+        "tenants": {
+            "zhang": {"members": ["ZhangSan", "LiSi"], "chats": ["wrXXXX"], "shard": "shard1"}
+        }
+    }
+    """
+    if not path:
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print(f"租户配置文件不存在: {path}，所有消息归属默认租户", flush=True)
+        return {}
+    except Exception as e:
+        print(f"读取租户配置文件失败: {e}，所有消息归属默认租户", flush=True)
+        return {}
+
+
+class TenantResolver:
+    """根据回调的FromUserName和ChatId确定消息所属的租户（家庭）
+
+    群聊消息按ChatId归属，单聊消息按发送者归属。群聊和发送者都未在配置中出现时：
+    auto为True则以ChatId（单聊为UserID）作为租户ID，否则归属默认租户。
+    """
+
+    def __init__(self, tenants=None, default_tenant=DEFAULT_TENANT, auto=TENANT_AUTO):
+        self.default_tenant = default_tenant
+        self.auto = auto
+        self._members = {}
+        self._chats = {}
+        for tenant_id, tenant in (tenants or {}).items():
+            for member in tenant.get('members', []):
+                self._members[member] = tenant_id
+            for chat_id in tenant.get('chats', []):
+                self._chats[chat_id] = tenant_id
+
+    def resolve(self, from_user=None, chat_id=None):
+        """消息所属的租户ID：依次按群聊、成员的配置确定，都未配置时按auto处理"""
+        if chat_id and chat_id in self._chats:
+            return self._chats[chat_id]
+        if from_user and from_user in self._members:
+            return self._members[from_user]
+        if self.auto and (chat_id or from_user):
+            return (chat_id or from_user)[:TENANT_ID_MAX_LENGTH]
+        return self.default_tenant
+
+    def resolve_recipient(self, recipient):
+        """推送接收者（UserID或ChatId）所属的租户ID"""
+        if recipient in self._chats:
+            return self._chats[recipient]
+        return self.resolve(from_user=recipient)
+
+
+class ShardRouter:
+    """把租户映射到数据库实例（分片）
+
+    配置中指定了分片的租户固定使用该分片；其余租户按租户ID的哈希分布到hash_shards中，
+    hash_shards默认只有主库。修改hash_shards会改变未固定租户所在的分片，
+    调整前应先在配置中固定已有租户的分片。
+    """
+
+    def __init__(self, shards=None, tenants=None, hash_shards=None, base_config=DB_CONFIG):
+        self.configs = {DEFAULT_SHARD: dict(base_config)}
+        for name, overrides in (shards or {}).items():
+            # 分片配置只需写出与主库不同的项
+            self.configs[name] = {**base_config, **overrides}
+        self._pinned = {
+            tenant_id: tenant['shard']
+            for tenant_id, tenant in (tenants or {}).items()
+            if tenant.get('shard')
+        }
+        for tenant_id, shard in self._pinned.items():
+            if shard not in self.configs:
+                raise ValueError(f"租户 {tenant_id} 配置的分片 {shard} 不存在")
+        self.hash_shards = list(hash_shards or [DEFAULT_SHARD])
+        for shard in self.hash_shards:
+            if shard not in self.configs:
+                raise ValueError(f"hash_shards中的分片 {shard} 不存在")
+
+    def shard_for(self, tenant_id):
+        """租户所在的分片名"""
+        shard = self._pinned.get(tenant_id)
+        if shard:
+            return shard
+        if len(self.hash_shards) == 1:
+            return self.hash_shards[0]
+        return self.hash_shards[zlib.crc32(tenant_id.encode('utf-8')) % len(self.hash_shards)]
+
+    def shard_names(self):
+        """所有分片名"""
+        return list(self.configs)
+
+
+# 创建租户解析和分片路由实例
+_tenant_config = load_tenant_config()
+tenant_resolver = TenantResolver(_tenant_config.get('tenants'))
+shard_router = ShardRouter(_tenant_config.get('shards'), _tenant_config.get('tenants'), _tenant_config.get('hash_shards'))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+
+from analytics import IntervalAnalytics, EventWindow, format_minutes
+
+class FakeVersions:
+    """进程内的数据版本号，模拟多个工作进程共享的DataVersion"""
+    def __init__(self):
+        self.values = {}
+
+    def get(self, tenant_id, snapshot=None):
+        return (self.values if snapshot is None else snapshot).get(tenant_id, 0)
+
+    def snapshot(self):
+        return dict(self.values)
+
+    def bump(self, tenant_id):
+        self.values[tenant_id] = self.get(tenant_id) + 1
+        return self.values[tenant_id]
+
+class FakeDatabase:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def iter_recent_records(self, since, tenant_id=None):
+        self.queries.append(tenant_id)
+        return iter([row for row in self.rows if tenant_id in (None, row['tenant_id'])])
+
+def row(tenant_id, record_type, record_time):
+    return {'tenant_id': tenant_id, 'record_type': record_type, 'record_time': record_time,
+            'amount': None, 'amount_unit': None}
+
+def event(action, tenant_id, record_type, record_time, amount=None, amount_unit=None):
+    return {'action': action, 'tenant_id': tenant_id, 'record_type': record_type, 'record_time': record_time,
+            'amount': amount, 'amount_unit': amount_unit}
+
+def test_event_window():
+    """测试窗口淘汰、平均间隔和数量累计"""
+    window = EventWindow(size=3, span=10 * 3600)
+    for hour, amount in [(2, '90'), (0, '60'), (5, '120'), (8, '150')]:
+        window.add(hour * 3600, amount, '毫升')
+    # 只保留最近3次（加入顺序不影响结果）
+    assert window.times == [2 * 3600, 5 * 3600, 8 * 3600]
+    summary = window.summary(9 * 3600)
+    assert summary['avg_interval_minutes'] == 180
+    assert summary['minutes_since_last'] == 60
+    assert summary['avg_amount'] == {'毫升': 120}
+
+    # 相同时间视为更新，删除后重新计算
+    window.add(8 * 3600, '180', '毫升')
+    assert window.summary(9 * 3600)['avg_amount'] == {'毫升': 130}
+    window.remove(5 * 3600)
+    assert window.summary(9 * 3600)['avg_interval_minutes'] == 360
+
+    # 距最新一次超过时间范围的记录被淘汰
+    window.add(20 * 3600)
+    assert window.times == [20 * 3600]
+    assert window.summary(20 * 3600)['avg_interval_minutes'] is None
+
+def test_interval_analytics():
+    """测试按租户的增量更新、确认信息和重建"""
+    versions = FakeVersions()
+    analytics = IntervalAnalytics(window_size=12, window_hours=72, database=FakeDatabase([]), versions=versions)
+    assert analytics.rebuild() == 0
+    analytics.on_record_change(event('insert', 'family', '吃', datetime(2025, 5, 1, 8, 0), '120', '毫升'))
+    assert analytics.describe('family', '吃', datetime(2025, 5, 1, 8, 0)) is None
+    analytics.on_record_change(event('insert', 'family', '吃', datetime(2025, 5, 1, 11, 0), '150', '毫升'))
+    analytics.on_record_change(event('insert', 'other', '吃', datetime(2025, 5, 1, 11, 30)))
+    text = analytics.describe('family', '吃', datetime(2025, 5, 1, 11, 0))
+    assert text == "距上次吃：3小时\n近2次平均间隔：3小时\n预计下次：05-01 14:00"
+    summary = analytics.summary('family', '吃', datetime(2025, 5, 1, 15, 0))
+    assert summary['overdue_minutes'] == 60
+    assert summary['predicted_next'] == '2025-05-01 14:00:00'
+    assert list(analytics.summaries('family')) == ['吃']
+    analytics.on_record_change(event('delete', 'family', '吃', datetime(2025, 5, 1, 11, 0)))
+    assert analytics.summary('family', '吃')['count'] == 1
+
+    assert analytics.rebuild(FakeDatabase([row('family', '大便', datetime(2025, 5, 1, 9, 0))])) == 1
+    assert list(analytics.summaries('family')) == ['大便']
+    assert analytics.summaries('other') == {}
+
+    assert format_minutes(135) == "2小时15分钟"
+    assert format_minutes(45) == "45分钟"
+
+def test_other_process_writes():
+    """测试本进程的写入增量更新，其他进程写入后从数据库重建该租户"""
+    versions = FakeVersions()
+    database = FakeDatabase([row('family', '吃', datetime(2025, 5, 1, 8, 0))])
+    analytics = IntervalAnalytics(window_size=12, window_hours=72, database=database, versions=versions)
+    assert analytics.rebuild() == 1
+    insert = event('insert', 'family', '吃', datetime(2025, 5, 1, 11, 0))
+    insert['data_version'] = versions.bump('family')
+    analytics.on_record_change(insert)
+    assert analytics.summary('family', '吃')['count'] == 2
+    assert analytics.summaries('other') == {}
+    assert database.queries == [None]
+
+    # 其他进程写入，本进程没有收到变更事件
+    database.rows.append(row('family', '吃', datetime(2025, 5, 1, 14, 0)))
+    versions.bump('family')
+    assert analytics.summary('family', '吃')['last_time'] == '2025-05-01 14:00:00'
+    assert database.queries == [None, 'family']
+    assert analytics.summary('family', '吃')['count'] == 2
+    assert database.queries == [None, 'family']
+
+if __name__ == "__main__":
+    test_event_window()
+    test_interval_analytics()
+    test_other_process_writes()
+    print("记录间隔统计测试通过")
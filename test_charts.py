@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+import charts
+from charts import ChartCache
+
+def fake_stats(tenant_id, start_date, end_date, record_type=None, bucket='day'):
+    """固定的按天统计结果"""
+    fake_stats.calls += 1
+    return {'buckets': [
+        {'bucket': '2025-05-01', 'ml_fed': 480, 'feed_count': 4, 'sleep_minutes': 600, 'poop_count': 1,
+         'pee_count': 5, 'temperature_max': 37.5, 'temperature_min': 36.6},
+        {'bucket': '2025-05-03', 'ml_fed': 560, 'feed_count': 5, 'sleep_minutes': 540, 'poop_count': 2,
+         'pee_count': 4, 'temperature_max': None, 'temperature_min': None},
+    ]}
+
+class FakeVersions:
+    """固定的数据版本号"""
+    def __init__(self, version):
+        self.version = version
+
+    def get(self, tenant_id):
+        return self.version
+
+def test_chart_cache():
+    """测试SVG输出、缓存命中和按日期范围失效"""
+    saved = charts.compute_stats
+    charts.compute_stats = fake_stats
+    fake_stats.calls = 0
+    try:
+        cache = ChartCache(versions=FakeVersions(0))
+        for metric in charts.CHARTS:
+            root = ET.fromstring(cache.get('family', metric, '2025-04-28', '2025-05-04').content)
+            assert root.tag.endswith('svg')
+        diapers = cache.get('family', 'diapers', '2025-04-28', '2025-05-04')
+        # 两天有数据，每天大小便两段
+        assert diapers.content.count('<rect x=') - 2 == 4
+        calls = fake_stats.calls
+
+        # 范围外或其他租户的写入不影响缓存，范围内的写入使图表失效
+        cache.on_record_change({'tenant_id': 'family', 'record_time': datetime(2025, 5, 10, 8, 0)})
+        assert cache.get('family', 'diapers', '2025-04-28', '2025-05-04') is diapers
+        cache.on_record_change({'tenant_id': 'other', 'record_time': datetime(2025, 5, 2, 8, 0)})
+        assert cache.get('family', 'diapers', '2025-04-28', '2025-05-04') is diapers
+        cache.on_record_change({'tenant_id': 'family', 'record_time': datetime(2025, 5, 2, 8, 0)})
+        cache.get('family', 'diapers', '2025-04-28', '2025-05-04')
+        assert fake_stats.calls == calls + 1
+
+        # 其他进程写入后数据版本号变化，图表重新生成
+        cache.versions.version = 1
+        cache.get('family', 'diapers', '2025-04-28', '2025-05-04')
+        assert fake_stats.calls == calls + 2
+        cache.get('family', 'diapers', '2025-04-28', '2025-05-04')
+        assert fake_stats.calls == calls + 2
+    finally:
+        charts.compute_stats = saved
+
+if __name__ == "__main__":
+    test_chart_cache()
+    print("趋势图测试通过")
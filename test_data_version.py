@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+from datetime import datetime
+
+from data_version import DataVersion
+
+def test_data_version():
+    """测试版本号递增、多个实例共享文件和ETag变化"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "version")
+        first = DataVersion(path, slots=64)
+        second = DataVersion(path, slots=64)
+        assert first.epoch == second.epoch
+        assert first.get('family') == 0
+
+        etag = first.etag('family', '2025-05-01', None, '吃', 100)
+        assert etag.startswith('W/"')
+        assert etag == second.etag('family', '2025-05-01', None, '吃', 100)
+        assert etag != first.etag('family', '2025-05-01', None, '睡', 100)
+        assert etag != first.etag('other', '2025-05-01', None, '吃', 100)
+
+        # 另一个实例（进程）的写入对所有实例可见
+        event = {'tenant_id': 'family', 'action': 'insert', 'record_time': datetime(2025, 5, 1)}
+        second.on_record_change(event)
+        assert first.get('family') == 1 and event['data_version'] == 1
+        snapshot = first.snapshot()
+        assert first.bump('family') == 2
+        assert first.get('family', snapshot) == 1
+        assert etag != first.etag('family', '2025-05-01', None, '吃', 100)
+
+        # 文件重建后文件标识改变，之前的ETag失效
+        os.remove(path)
+        assert DataVersion(path, slots=64).epoch != first.epoch
+
+    # 未配置文件时使用匿名共享内存
+    memory = DataVersion('', slots=8)
+    assert memory.bump('family') == 1
+    assert memory.get('family') == 1
+
+def bump_in_children(versions, children=4, bumps=2000):
+    """fork出多个子进程同时递增同一个租户的版本号"""
+    pids = []
+    for _ in range(children):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                for _ in range(bumps):
+                    versions.bump('family')
+                code = 0
+            finally:
+                os._exit(code)
+        pids.append(pid)
+    for pid in pids:
+        assert os.waitpid(pid, 0)[1] == 0
+    return children * bumps
+
+def test_data_version_fork():
+    """测试预加载后fork出的工作进程同时递增时不丢失版本号"""
+    if not hasattr(os, 'fork'):
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        versions = DataVersion(os.path.join(tmp, "version"), slots=64)
+        versions.bump('family')
+        total = bump_in_children(versions)
+        assert versions.get('family') == total + 1
+        assert versions.bump('family') == total + 2
+        del versions
+
+    memory = DataVersion('', slots=8)
+    total = bump_in_children(memory)
+    assert memory.get('family') == total
+
+if __name__ == "__main__":
+    test_data_version()
+    test_data_version_fork()
+    print("数据版本测试通过")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import tempfile
+from datetime import datetime
+
+from export_records import HAS_PYARROW, export_dataset, iter_export
+
+class FakeShard:
+    def __init__(self, name, rows):
+        self.name = name
+        self.rows = rows
+        self.now = datetime(2025, 6, 1, 12, 0, 5)
+
+    def get_db_time(self):
+        return self.now
+
+    def iter_changed_records(self, until, since=None, tenant_id=None, batch_size=1000):
+        rows = [row for row in self.rows if row['updated_at'] < until
+                and (row['updated_at'] >= since if since else not row['is_deleted'])
+                and tenant_id in (None, row['tenant_id'])]
+        return iter(sorted(rows, key=lambda row: (row['tenant_id'], row['record_time'], row['id'])))
+
+class FakeDatabase:
+    def __init__(self, rows):
+        self.shards = {'default': FakeShard('default', rows)}
+
+def make_row(id, tenant_id, record_time, record_type='吃', amount='120', is_deleted=0,
+             updated_at=datetime(2025, 6, 1)):
+    return {'id': id, 'tenant_id': tenant_id, 'record_time': record_time, 'record_type': record_type,
+            'amount': amount, 'amount_unit': '毫升', 'description': '吃奶', 'is_deleted': is_deleted,
+            'updated_at': updated_at}
+
+def test_export_dataset():
+    """测试按租户和月份分区、行组大小、类型化的列和增量导出"""
+    if not HAS_PYARROW:
+        return
+    import pyarrow.parquet as pq
+    rows = [make_row(i, 'family', datetime(2025, 4 + i % 2, 1 + i, 8)) for i in range(1, 6)]
+    rows.append(make_row(6, '张家', datetime(2025, 5, 2, 9), '其他', amount='一边'))
+    rows.append(make_row(7, 'family', datetime(2025, 5, 3), is_deleted=1))
+    database = FakeDatabase(rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        results = export_dataset(database, tmp, 'parquet', row_group_size=2)
+        assert results == {'default': (6, 3)}
+        may = os.path.join(tmp, 'tenant=family', 'month=2025-05', 'part-20250601120000-default.parquet')
+        table = pq.read_table(may)
+        assert pq.ParquetFile(may).metadata.num_row_groups == 2
+        assert table.column('id').to_pylist() == [1, 3, 5]
+        assert str(table.schema.field('record_time').type).startswith('timestamp')
+        assert str(table.schema.field('record_type').type) == 'dictionary<values=string, indices=int8, ordered=0>'
+        assert table.column('amount').to_pylist() == [120.0] * 3
+        other = pq.read_table(os.path.join(tmp, 'tenant=%E5%BC%A0%E5%AE%B6', 'month=2025-05',
+                                           'part-20250601120000-default.parquet'))
+        assert other.column('amount').to_pylist() == [None] and other.column('amount_text').to_pylist() == ['一边']
+
+        # 增量导出只追加水位之后修改和删除的记录
+        shard = database.shards['default']
+        shard.now = datetime(2025, 6, 2, 0, 0, 5)
+        rows[0]['is_deleted'], rows[0]['updated_at'] = 1, datetime(2025, 6, 1, 18)
+        assert export_dataset(database, tmp, 'parquet') == {'default': (1, 1)}
+        assert sorted(os.listdir(os.path.dirname(may))) == ['part-20250601120000-default.parquet', 'part-20250602000000-default.parquet']
+        assert pq.read_table(may.replace('20250601120000', '20250602000000')).column('is_deleted').to_pylist() == [True]
+        assert export_dataset(database, tmp, 'parquet') == {'default': (0, 0)}
+        try:
+            export_dataset(database, tmp, 'arrow')
+            assert False
+        except ValueError:
+            pass
+
+def test_iter_export():
+    """测试流式导出的Arrow IPC文件"""
+    if not HAS_PYARROW:
+        return
+    import pyarrow as pa
+    rows = [make_row(i, 'family', datetime(2025, 5, 1, i)) for i in range(5)]
+    shard = FakeShard('default', rows)
+    data = b''.join(iter_export(shard, 'family', 'arrow', None, datetime(2025, 6, 1, 12), row_group_size=2))
+    reader = pa.ipc.open_file(io.BytesIO(data))
+    assert reader.num_record_batches == 3
+    assert reader.read_all().column('record_type').to_pylist() == ['吃'] * 5
+
+if __name__ == "__main__":
+    test_export_dataset()
+    test_iter_export()
+    print("列式导出测试通过")
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+
+from idempotency import IdempotencyStore
+
+def test_idempotency_store():
+    """测试回调幂等存储（内存和共享SQLite两种后端）"""
+    with tempfile.TemporaryDirectory() as tmp:
+        for store in [IdempotencyStore(ttl=60), IdempotencyStore(ttl=60, db_path=os.path.join(tmp, "keys.db"))]:
+            key = IdempotencyStore.message_key({"MsgId": "1234567890123456"})
+            assert store.claim(key)
+            assert not store.claim(key)
+
+            # 处理失败撤销后，重试可以再次处理
+            store.release(key)
+            assert store.claim(key)
+
+            event_key = IdempotencyStore.message_key({"FromUserName": "ShenChaoSong", "CreateTime": "1700000000", "Event": "enter_agent"})
+            assert event_key == "evt:ShenChaoSong:1700000000:enter_agent"
+            assert store.claim(event_key)
+            assert not store.claim(event_key)
+
+        # 过期的键可以再次登记
+        store = IdempotencyStore(ttl=-1)
+        assert store.claim("sig:abc")
+        assert store.claim("sig:abc")
+
+if __name__ == "__main__":
+    test_idempotency_store()
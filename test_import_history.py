@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import tempfile
+from datetime import datetime
+
+from import_history import read_text, read_items, parse_chunk, Checkpoint, Importer
+
+class FakeDatabase:
+    def __init__(self):
+        self.rows = {}
+
+    def insert_records(self, tenant_id, rows):
+        existing = self.rows.setdefault(tenant_id, {})
+        new = [row for row in rows if (row[0], row[1]) not in existing]
+        for row in new:
+            existing[(row[0], row[1])] = row
+        return len(new), len(rows) - len(new)
+
+def test_read_messages():
+    """测试文本和CSV/JSON格式的消息读取"""
+    text = io.StringIO("2025-05-01 08:30 张三: 早上8点吃奶120ml\n"
+                       "2025-05-01 09:00:15 李四\n宝宝睡着了\n\n"
+                       "2025-05-01 09:05 李四：\n")
+    assert list(read_text(text)) == [
+        (datetime(2025, 5, 1, 8, 30), '张三', '早上8点吃奶120ml'),
+        (datetime(2025, 5, 1, 9, 0, 15), '李四', '宝宝睡着了'),
+    ]
+    items = [{'time': '2025/05/01 08:30', 'content': '吃奶'}, {'时间': '2025-05-01 09:00', '内容': ''}]
+    assert list(read_items(items)) == [(datetime(2025, 5, 1, 8, 30), '', '吃奶')]
+
+def test_parse_chunk():
+    """测试以发送时间为参考时间解析，以及凌晨发送的前一天记录"""
+    results = parse_chunk([
+        (datetime(2025, 5, 1, 8, 30), '早上8点吃奶120ml'),
+        (datetime(2025, 5, 2, 1, 0), '晚上11点小便'),
+        (datetime(2025, 5, 2, 9, 0), '今天天气不错'),
+    ])
+    assert results[0][0] == 'record'
+    assert results[0][1][:4] == (datetime(2025, 5, 1, 8, 0), '吃', '120', '毫升')
+    assert results[1][1][0] == datetime(2025, 5, 1, 23, 0)
+    assert results[2] == ('unparsed', None)
+
+def test_importer_resume():
+    """测试分批写入、断点保存和重复导入跳过已有记录"""
+    rows = [(datetime(2025, 5, 1, hour), '吃', 100.0, 'ml', '吃奶') for hour in range(5)]
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'chat.txt')
+        with open(source, 'w', encoding='utf-8') as f:
+            f.write('chat')
+        database = FakeDatabase()
+        checkpoint = Checkpoint(os.path.join(tmp, 'checkpoint.json'), source)
+        importer = Importer(database, checkpoint, batch_size=2, tenant_id='family')
+        for row in rows[:3]:
+            importer.add('张三', 'record', row)
+        importer.add('张三', 'unparsed', None)
+        # 第三条记录还未提交，断点停在第二条消息
+        resumed = Checkpoint(checkpoint.path, source)
+        resumed.load()
+        assert resumed.done == 2 and resumed.counters['inserted'] == 2
+
+        # 从断点继续时重新提交的记录不会重复插入
+        importer = Importer(database, resumed, batch_size=2, tenant_id='family')
+        for row in rows[1:]:
+            importer.add('张三', 'record', row)
+        importer.flush()
+        assert len(database.rows['family']) == 5
+        assert importer.counters['inserted'] == 5 and importer.counters['duplicate'] == 1
+        assert resumed.done == 6
+
+        # 导入文件变化后断点失效
+        with open(source, 'a', encoding='utf-8') as f:
+            f.write('more')
+        try:
+            Checkpoint(checkpoint.path, source).load()
+            assert False
+        except ValueError:
+            pass
+
+if __name__ == "__main__":
+    test_read_messages()
+    test_parse_chunk()
+    test_importer_resume()
+    print("历史记录导入测试通过")
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+
+from jobs import InboundQueue
+
+def test_inbound_queue_ordering_and_shedding():
+    """测试同一发送者的任务按顺序处理，队列满时拒绝新任务"""
+    processed = {}
+    lock = threading.Lock()
+
+    def job(user, seq):
+        with lock:
+            processed.setdefault(user, []).append(seq)
+
+    jobs = InboundQueue(workers=4, max_size=4000)
+    jobs.start()
+    for seq in range(200):
+        for user in ("ShenChaoSong", "chat123", "user_a", "user_b", "user_c"):
+            assert jobs.submit(user, job, user, seq)
+    jobs.drain(timeout=10)
+    assert all(seqs == list(range(200)) for seqs in processed.values())
+    assert jobs.stats()["counters"]["processed"] == 1000
+
+    # 工作线程阻塞时，队列满后拒绝新任务
+    gate = threading.Event()
+    jobs = InboundQueue(workers=1, max_size=2)
+    jobs.start()
+    results = [jobs.submit("ShenChaoSong", gate.wait) for _ in range(5)]
+    assert results.count(False) >= 2
+    assert jobs.stats()["counters"]["shed"] == results.count(False)
+    gate.set()
+    jobs.drain(timeout=5)
+
+if __name__ == "__main__":
+    test_inbound_queue_ordering_and_shedding()
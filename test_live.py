@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+from datetime import datetime
+
+from data_version import DataVersion
+from live import RecordHub, sse_stream, RESET_FRAME, EVICTED_FRAME
+
+def change(record_id, action='insert', tenant_id='family'):
+    return {'tenant_id': tenant_id, 'action': action, 'id': record_id, 'record_type': '吃',
+            'record_time': datetime(2025, 5, 1, 8, record_id), 'amount': '120', 'amount_unit': '毫升'}
+
+def test_hub_replay_and_eviction():
+    """测试按租户推送、Last-Event-ID补发和慢连接移除"""
+    async def run():
+        hub = RecordHub(replay_size=3, buffer_size=2, max_subscribers=2)
+        subscriber, replay, reset = hub.subscribe('family')
+        assert replay == [] and not reset
+        hub.on_record_change(change(1))
+        hub.on_record_change(change(2, tenant_id='other'))
+        await subscriber.wait(1)
+        events = hub.drain(subscriber)
+        assert [event.seq for event in events] == [1]
+        assert events[0].frame.startswith(f"id: {hub.epoch}-1\nevent: insert\n".encode())
+        assert '"record_time":"2025-05-01 08:01:00"' in events[0].message
+
+        # 缓冲区满的连接被移除，其他连接不受影响
+        other, _, _ = hub.subscribe('family')
+        assert hub.subscribe('family') is None
+        for record_id in (3, 4, 5):
+            hub.on_record_change(change(record_id))
+            hub.drain(other)
+        assert subscriber.evicted and not other.evicted
+        assert hub.evictions == 1
+
+        # 按最后收到的事件ID补发；已淘汰或来自其他进程的ID需要客户端重新查询
+        hub.unsubscribe(subscriber)
+        hub.unsubscribe(other)
+        subscriber, replay, reset = hub.subscribe('family', f"{hub.epoch}-3")
+        assert [event.seq for event in replay] == [4, 5] and not reset
+        hub.unsubscribe(subscriber)
+        subscriber, replay, reset = hub.subscribe('family', f"{hub.epoch}-0")
+        assert reset
+        hub.unsubscribe(subscriber)
+        subscriber, replay, reset = hub.subscribe('family', "00000000-4")
+        assert reset and replay == []
+        hub.unsubscribe(subscriber)
+        assert hub.subscriber_count() == 0
+
+    asyncio.run(run())
+
+def test_sse_stream():
+    """测试SSE响应体的补发、心跳和移除"""
+    async def run():
+        hub = RecordHub(replay_size=10, buffer_size=1, max_subscribers=10)
+        hub.on_record_change(change(1))
+        subscription = hub.subscribe('family', "00000000-1")
+        stream = sse_stream(hub, *subscription, heartbeat=0.01)
+        assert await stream.__anext__() == b"retry: 3000\n\n"
+        assert await stream.__anext__() == RESET_FRAME
+        assert await stream.__anext__() == b": ping\n\n"
+        hub.on_record_change(change(2, action='delete'))
+        assert (await stream.__anext__()).startswith(f"id: {hub.epoch}-2\nevent: delete".encode())
+        hub.on_record_change(change(3))
+        hub.on_record_change(change(4))
+        assert await stream.__anext__() == EVICTED_FRAME
+        try:
+            await stream.__anext__()
+            assert False, "被移除后应结束"
+        except StopAsyncIteration:
+            pass
+        assert hub.subscriber_count() == 0
+
+    asyncio.run(run())
+
+def test_sse_reset_after_foreign_write():
+    """测试其他进程写入该租户后，心跳时发送reset"""
+    async def run():
+        versions = DataVersion('', slots=8)
+        hub = RecordHub(replay_size=10, buffer_size=10, max_subscribers=10, versions=versions)
+        stream = sse_stream(hub, *hub.subscribe('family'), heartbeat=0.01)
+        assert await stream.__anext__() == b"retry: 3000\n\n"
+        assert await stream.__anext__() == b": ping\n\n"
+
+        # 本进程的写入直接推送，不需要reset
+        event = change(1)
+        versions.on_record_change(event)
+        hub.on_record_change(event)
+        assert (await stream.__anext__()).startswith(f"id: {hub.epoch}-1\nevent: insert".encode())
+        assert await stream.__anext__() == b": ping\n\n"
+
+        # 其他进程的写入只递增版本号，其他租户的写入不影响
+        versions.bump('family')
+        versions.bump('other')
+        assert await stream.__anext__() == RESET_FRAME
+        assert await stream.__anext__() == b": ping\n\n"
+
+        # 本进程的写入之前有其他进程的写入时，推送之后仍需reset
+        versions.bump('family')
+        event = change(2)
+        versions.on_record_change(event)
+        hub.on_record_change(event)
+        assert (await stream.__anext__()).startswith(f"id: {hub.epoch}-2\nevent: insert".encode())
+        assert await stream.__anext__() == RESET_FRAME
+        assert await stream.__anext__() == b": ping\n\n"
+        await stream.aclose()
+        assert hub.subscriber_count() == 0
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    test_hub_replay_and_eviction()
+    test_sse_stream()
+    test_sse_reset_after_foreign_write()
+    print("实时推送测试通过")
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from metrics import MetricsRegistry
+
+def test_render_prometheus_text():
+    """测试计数器、直方图和函数型指标的文本输出"""
+    registry = MetricsRegistry()
+    counter = registry.counter('test_total', '测试计数', ['errcode'])
+    histogram = registry.histogram('test_seconds', '测试耗时', ['stage'], buckets=(0.01, 0.1))
+    registry.gauge('test_depth', '测试深度', ['status'], func=lambda: {('pending',): 3})
+
+    counter.inc('0')
+    counter.inc('0')
+    counter.inc('45009')
+    histogram.observe(0.005, 'decrypt')
+    histogram.observe(0.05, 'decrypt')
+    histogram.observe(2, 'decrypt')
+
+    lines = registry.render().splitlines()
+    assert '# TYPE test_total counter' in lines
+    assert 'test_total{errcode="0"} 2' in lines
+    assert 'test_total{errcode="45009"} 1' in lines
+    assert 'test_seconds_bucket{stage="decrypt",le="0.01"} 1' in lines
+    assert 'test_seconds_bucket{stage="decrypt",le="0.1"} 2' in lines
+    assert 'test_seconds_bucket{stage="decrypt",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="decrypt"} 3' in lines
+    assert 'test_depth{status="pending"} 3' in lines
+
+if __name__ == "__main__":
+    test_render_prometheus_text()
+    print("指标测试通过")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+
+from outbox import OutboundQueue
+from ratelimit import RateLimiter
+
+def test_outbox_retry_and_dead_letter():
+    """测试发送队列的重试和死信"""
+    results = [
+        {"errcode": 42001, "errmsg": "access_token expired"},
+        {"errcode": 0, "errmsg": "ok"},
+        {"errcode": 81013, "errmsg": "user & party & tag all invalid"},
+    ]
+    sent = []
+
+    def fake_send(recipient, content):
+        sent.append((recipient, content))
+        return results.pop(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = OutboundQueue(db_path=os.path.join(tmp, "outbox.db"), workers=0, send_func=fake_send)
+        queue.enqueue("ShenChaoSong", "记录添加成功！")
+
+        # 令牌过期：立即重试，无需等待
+        queue._deliver(queue._claim())
+        assert queue.stats()["depth"]["pending"] == 1
+        queue._deliver(queue._claim())
+        stats = queue.stats()
+        assert stats["depth"]["pending"] == 0
+        assert stats["counters"]["sent"] == 1
+        assert stats["counters"]["token_refreshed"] == 1
+
+        # 不可重试的错误码直接进入死信
+        queue.enqueue("nobody", "日报")
+        queue._deliver(queue._claim())
+        stats = queue.stats()
+        assert stats["depth"]["dead"] == 1
+        assert stats["dead_letters"][0]["recipient"] == "nobody"
+        assert queue._claim() is None
+
+def test_outbox_coalesce_and_throttle():
+    """测试合并窗口内的确认消息合并，以及超出配额时延后发送"""
+    sent = []
+
+    def fake_send(recipient, content):
+        sent.append((recipient, content))
+        return {"errcode": 0, "errmsg": "ok"}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        limiter = RateLimiter(app_per_minute=100, user_per_minute=1, user_per_hour=100, chat_per_minute=1)
+        queue = OutboundQueue(db_path=os.path.join(tmp, "outbox.db"), workers=0, send_func=fake_send,
+                              limiter=limiter, coalesce_window=60)
+        first = queue.enqueue("ShenChaoSong", "记录添加成功！\n类型：吃", coalesce=True)
+        second = queue.enqueue("ShenChaoSong", "记录添加成功！\n类型：小便", coalesce=True)
+        other = queue.enqueue("chat123", "记录添加成功！\n类型：睡", coalesce=True)
+        assert first == second and other != first
+        assert queue.stats()["counters"]["coalesced"] == 1
+
+        # 合并窗口未到，不会被取出
+        assert queue._claim() is None
+        queue._connect().execute("UPDATE outbox SET next_attempt_at = 0")
+        queue._deliver(queue._claim())
+        queue._deliver(queue._claim())
+        assert ("ShenChaoSong", "记录添加成功！\n类型：吃\n\n记录添加成功！\n类型：小便") in sent
+
+        # 每分钟只允许1条，第二条被延后且不计入尝试次数
+        queue.enqueue("ShenChaoSong", "日报")
+        queue._deliver(queue._claim())
+        assert len(sent) == 2
+        stats = queue.stats()
+        assert stats["counters"]["throttled"] == 1
+        assert stats["depth"]["pending"] == 1
+
+if __name__ == "__main__":
+    test_outbox_retry_and_dead_letter()
+    test_outbox_coalesce_and_throttle()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+
+from report_cache import ReportCache
+
+class FakeVersions:
+    """进程内的数据版本号，模拟多个工作进程共享的DataVersion"""
+    def __init__(self):
+        self.values = {}
+
+    def get(self, tenant_id):
+        return self.values.get(tenant_id, 0)
+
+    def bump(self, tenant_id):
+        self.values[tenant_id] = self.get(tenant_id) + 1
+        return self.values[tenant_id]
+
+def test_cache_and_invalidate():
+    """测试日报缓存命中和按日期失效"""
+    cache = ReportCache(max_entries=8)
+    builds = []
+
+    def builder(date_str):
+        def build():
+            builds.append(date_str)
+            return f"{date_str} 日报 {len(builds)}"
+        return build
+
+    first = cache.get("family", "2025-05-01", "text", builder("2025-05-01"))
+    assert cache.get("family", "2025-05-01", "text", builder("2025-05-01")) is first
+    cache.get("family", "2025-05-02", "text", builder("2025-05-02"))
+    assert builds == ["2025-05-01", "2025-05-02"]
+
+    # 写入5月1日的记录只影响5月1日
+    cache.on_record_change({'tenant_id': 'family', 'action': 'insert', 'record_time': datetime(2025, 5, 1, 9, 30)})
+    second = cache.get("family", "2025-05-01", "text", builder("2025-05-01"))
+    cache.get("family", "2025-05-02", "text", builder("2025-05-02"))
+    assert builds == ["2025-05-01", "2025-05-02", "2025-05-01"]
+    assert second.etag != first.etag
+    assert second.last_modified >= first.last_modified
+
+def test_failed_and_stale_builds_not_cached():
+    """测试生成失败或生成期间数据变化时不缓存结果"""
+    cache = ReportCache()
+    assert cache.get("family", "2025-05-01", "text", lambda: None) is None
+
+    def racing_build():
+        cache.invalidate("family", "2025-05-01")
+        return "旧数据"
+
+    assert cache.get("family", "2025-05-01", "text", racing_build).content == "旧数据"
+    assert cache.get("family", "2025-05-01", "text", lambda: "新数据").content == "新数据"
+
+def test_other_process_writes():
+    """测试本进程写入后其他日期的缓存仍然有效，其他进程写入后该租户的缓存重新生成"""
+    versions = FakeVersions()
+    cache = ReportCache(versions=versions)
+    contents = {"2025-05-01": "5月1日", "2025-05-02": "5月2日"}
+    builds = []
+
+    def builder(date_str):
+        def build():
+            builds.append(date_str)
+            return contents[date_str]
+        return build
+
+    may1 = cache.get("family", "2025-05-01", "text", builder("2025-05-01"))
+    cache.get("family", "2025-05-02", "text", builder("2025-05-02"))
+    cache.on_record_change({'tenant_id': 'family', 'action': 'insert', 'record_time': datetime(2025, 5, 2, 9, 0),
+                            'data_version': versions.bump('family')})
+    assert cache.get("family", "2025-05-01", "text", builder("2025-05-01")) is may1
+    cache.get("family", "2025-05-02", "text", builder("2025-05-02"))
+    assert builds == ["2025-05-01", "2025-05-02", "2025-05-02"]
+
+    # 其他进程写入5月2日，本进程没有收到变更事件
+    contents["2025-05-02"] = "5月2日（已修改）"
+    versions.bump('family')
+    assert cache.get("family", "2025-05-02", "text", builder("2025-05-02")).content == "5月2日（已修改）"
+    # 内容没有变化的日期重新生成后保留原来的修改时间
+    rebuilt = cache.get("family", "2025-05-01", "text", builder("2025-05-01"))
+    assert rebuilt.last_modified == may1.last_modified
+    assert cache.get("family", "2025-05-01", "text", builder("2025-05-01")) is rebuilt
+    assert builds == ["2025-05-01", "2025-05-02", "2025-05-02", "2025-05-02", "2025-05-01"]
+
+if __name__ == "__main__":
+    test_cache_and_invalidate()
+    test_failed_and_stale_builds_not_cached()
+    test_other_process_writes()
+    print("日报缓存测试通过")
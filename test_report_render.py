@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+from datetime import datetime
+
+from report_render import report_renderer, period_range, compile_fragment
+
+RECORDS = [
+    {'record_time': datetime(2025, 5, 1, 9, 30), 'record_type': '大便', 'amount': '一坨', 'amount_unit': None, 'description': '拉屎'},
+    {'record_time': datetime(2025, 5, 1, 14, 30), 'record_type': '吃', 'amount': '120', 'amount_unit': '毫升', 'description': '吃奶粉"<b>'},
+    {'record_time': datetime(2025, 5, 1, 20, 0), 'record_type': '吃', 'amount': None, 'amount_unit': None, 'description': None},
+    {'record_time': datetime(2025, 5, 3, 8, 0), 'record_type': '体温', 'amount': '37.5', 'amount_unit': '度', 'description': '体温'},
+]
+
+def test_render_day_text():
+    """测试单日纯文本日报，类型按固定顺序输出"""
+    grouped = {'大便': RECORDS[:1], '吃': RECORDS[1:3]}
+    report = report_renderer.render_day('text', '2025-05-01', grouped)
+    assert report == (
+        "📅 2025年05月01日日报 📅\n" + "=" * 30 + "\n\n"
+        "💩 大便记录 (1条):\n  1. 09:30 一坨\n\n"
+        "🍼 吃记录 (2条):\n  1. 14:30 120毫升\n  2. 20:00\n\n"
+        + "=" * 30 + "\n共记录 3 条信息"
+    )
+    assert report_renderer.render_day('text', '2025-05-02', {}) == "未找到 2025年05月02日 的记录！"
+
+def test_render_range_formats():
+    """测试多日报表的JSON、HTML和markdown输出"""
+    data = json.loads(''.join(report_renderer.iter_range('json', '2025-05-01', '2025-05-07', iter(RECORDS))))
+    assert [day['date'] for day in data['days']] == ['2025-05-01', '2025-05-03']
+    first_day = data['days'][0]
+    assert first_day['total'] == 3
+    assert [group['record_type'] for group in first_day['groups']] == ['吃', '大便']
+    assert first_day['groups'][0]['records'][0]['description'] == '吃奶粉"<b>'
+
+    page = report_renderer.render_page("报表", ''.join(report_renderer.iter_range('html', '2025-05-01', '2025-05-07', iter(RECORDS))))
+    assert '<b>' not in page and page.count('<section class="day">') == 2
+
+    markdown = ''.join(report_renderer.iter_range('markdown', '2025-05-01', '2025-05-07', iter(RECORDS)))
+    assert markdown.startswith("# 📅 2025年05月01日至2025年05月07日报表")
+    assert json.loads(''.join(report_renderer.iter_range('json', '2025-05-01', '2025-05-07', iter([]))))['days'] == []
+
+def test_template_field_values():
+    """测试字段值中的花括号和引号原样输出，不被当作模板语法"""
+    fragment = compile_fragment("{{{name}}}: {value}")
+    assert fragment(name='{value}', extra=1) == "{{value}}: None"
+    try:
+        compile_fragment("{name.__class__}")
+        assert False, "字段名无效时应报错"
+    except ValueError:
+        pass
+
+    records = [{'record_time': datetime(2025, 5, 1, 9, 30), 'record_type': '吃', 'amount': '{total}',
+                'amount_unit': '"}}', 'description': "{0}\"'); {__import__}"}]
+    report = report_renderer.render_day('text', '2025-05-01', {'吃': records})
+    assert '09:30 {total}"}}' in report and report.endswith("共记录 1 条信息")
+    data = json.loads(''.join(report_renderer.iter_range('json', '2025-05-01', '2025-05-01', iter(records))))
+    record = data['days'][0]['groups'][0]['records'][0]
+    assert (record['amount'], record['amount_unit'], record['description']) == ('{total}', '"}}', "{0}\"'); {__import__}")
+
+def test_period_range():
+    """测试周和月的起止日期"""
+    assert period_range('2025-05-01', 'week') == ('2025-04-28', '2025-05-04')
+    assert period_range('2024-02-10', 'month') == ('2024-02-01', '2024-02-29')
+
+if __name__ == "__main__":
+    test_render_day_text()
+    test_render_range_formats()
+    test_template_field_values()
+    test_period_range()
+    print("报表渲染测试通过")
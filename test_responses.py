@@ -0,0 +1,36 @@
+import gzip
+import json
+from datetime import datetime
+
+from responses import dumps, compress, accepted_encodings, json_response, HAS_BROTLI
+
+
+def test_dumps_formats_datetime_like_database():
+    """datetime输出为与数据库一致的格式，中文不转义"""
+    body = dumps({'record_time': datetime(2024, 5, 1, 8, 30), 'record_type': '吃'})
+    assert json.loads(body) == {'record_time': '2024-05-01 08:30:00', 'record_type': '吃'}
+    assert '吃'.encode('utf-8') in body
+
+
+def test_compress_negotiation():
+    """按Accept-Encoding协商压缩，小响应和q=0的编码不压缩"""
+    assert accepted_encodings('gzip;q=0, br , deflate;q=0.5') == {'br', 'deflate'}
+    body = b'{"data":[' + b'{"id":1,"record_type":"x"},' * 200 + b'{}]}'
+    assert compress(b'{}', 'gzip') == (b'{}', None)
+    assert compress(body, 'identity') == (body, None)
+    assert compress(body, 'gzip;q=0') == (body, None)
+    compressed, encoding = compress(body, 'gzip, deflate')
+    assert encoding == 'gzip' and gzip.decompress(compressed) == body
+    if HAS_BROTLI:
+        assert compress(body, 'gzip, br')[1] == 'br'
+
+    response = json_response({'data': list(range(1000))}, 'gzip')
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.headers['vary'] == 'Accept-Encoding'
+    assert json.loads(gzip.decompress(response.body)) == {'data': list(range(1000))}
+
+
+if __name__ == "__main__":
+    test_dumps_formats_datetime_like_database()
+    test_compress_negotiation()
+    print("所有测试通过")
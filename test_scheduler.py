@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+from datetime import datetime
+
+from scheduler import ReportScheduler
+from tenancy import TenantResolver
+
+class FakeQueue:
+    """记录加入队列的消息"""
+    def __init__(self):
+        self.messages = []
+
+    def enqueue(self, recipient, content, coalesce=False, delay=0):
+        self.messages.append((recipient, content, delay))
+
+def test_push_and_catchup():
+    """测试到点推送、每个日期只生成一次日报，以及重启后补推"""
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = FakeQueue()
+        generated = []
+
+        def make_scheduler():
+            scheduler = ReportScheduler(push_time='21:00', report_day='yesterday', recipients='user1, chat001',
+                                        jitter=30, catchup_days=3, state_path=os.path.join(tmp, 'push.json'),
+                                        queue=queue, resolver=TenantResolver())
+            scheduler.report_func = lambda tenant_id, date_str: generated.append(date_str) or f"{date_str} 日报"
+            return scheduler
+
+        # 首次启动且未到推送时间，不推送
+        assert make_scheduler().run_due(datetime(2025, 5, 1, 20, 0)) == []
+        # 到点推送前一天的日报，每个接收者一条
+        assert make_scheduler().run_due(datetime(2025, 5, 1, 21, 0)) == ['2025-04-30']
+        assert make_scheduler().run_due(datetime(2025, 5, 1, 23, 0)) == []
+        assert [m[0] for m in queue.messages] == ['user1', 'chat001']
+        assert all(0 <= m[2] <= 30 for m in queue.messages)
+
+        # 停机5天后重启，只补推最近3天
+        assert make_scheduler().run_due(datetime(2025, 5, 6, 22, 0)) == ['2025-05-03', '2025-05-04', '2025-05-05']
+        assert generated == ['2025-04-30', '2025-05-03', '2025-05-04', '2025-05-05']
+        assert len(queue.messages) == 8
+
+if __name__ == "__main__":
+    test_push_and_catchup()
+    print("定时推送测试通过")
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+
+import search
+from search import build_boolean_query, search_records
+
+class FakeDatabase:
+    def search_records(self, tenant_id, query, start_time, end_time, record_type, limit, offset, order_by_time):
+        self.call = (tenant_id, query, start_time, end_time, record_type, limit, offset, order_by_time)
+        return 21, [{'id': 7, 'record_time': '2025-05-01 20:00:00', 'record_type': '吃', 'amount': None,
+                     'amount_unit': None, 'description': '辅食南瓜泥', 'score': 1.81234567}]
+
+def test_build_boolean_query():
+    """测试关键词转换为布尔模式查询"""
+    assert build_boolean_query("退烧药") == '+"退烧药"'
+    assert build_boolean_query("辅食  南瓜") == '+"辅食" +"南瓜"'
+    # 运算符按分隔符处理，单字按前缀匹配
+    assert build_boolean_query('奶 -"睡觉"(午)') == '+奶* +"睡觉" +午*'
+    assert build_boolean_query(" +-* ") is None
+
+def test_search_records():
+    """测试分页、过滤参数和参数校验"""
+    saved = search.db
+    search.db = FakeDatabase()
+    try:
+        data = search_records('family', '辅食 南瓜', '2025-05-01', '2025-05-31', '吃', page=3, page_size=10)
+        assert search.db.call == ('family', '+"辅食" +"南瓜"', datetime(2025, 5, 1), datetime(2025, 6, 1), '吃',
+                                  10, 20, False)
+        assert data['total'] == 21 and data['pages'] == 3
+        assert data['records'][0]['score'] == 1.8123
+
+        search_records('family', '南瓜', sort='time')
+        assert search.db.call[-1] is True
+        for kwargs in ({'sort': 'score'}, {'page': 0}, {'page_size': 1000}, {'start_date': '2025-05-02', 'end_date': '2025-05-01'}):
+            try:
+                search_records('family', '南瓜', **kwargs)
+                assert False, kwargs
+            except ValueError:
+                pass
+    finally:
+        search.db = saved
+
+if __name__ == "__main__":
+    test_build_boolean_query()
+    test_search_records()
+    print("全文搜索测试通过")
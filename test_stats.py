@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from decimal import Decimal
+
+import stats
+
+def test_compute_stats():
+    """测试按桶汇总结果的转换、喂奶间隔和整体汇总"""
+    rows = [
+        {'bucket': '2025-05-01', 'total': 5, 'feed_count': Decimal(3), 'ml_fed': Decimal('360.00'),
+         'ml_feed_count': Decimal(3), 'sleep_count': Decimal(1), 'sleep_minutes': Decimal('120.00'),
+         'poop_count': Decimal(1), 'pee_count': Decimal(0), 'temperature_min': None,
+         'temperature_max': None, 'medicine_count': Decimal(0)},
+        {'bucket': '2025-05-02', 'total': 2, 'feed_count': Decimal(1), 'ml_fed': None,
+         'ml_feed_count': Decimal(0), 'sleep_count': Decimal(0), 'sleep_minutes': None,
+         'poop_count': Decimal(0), 'pee_count': Decimal(0), 'temperature_min': Decimal('36.80'),
+         'temperature_max': Decimal('37.50'), 'medicine_count': Decimal(0)},
+    ]
+    day = 86400 * 20209
+    times = [('2025-05-01', day + 3600 * 8), ('2025-05-01', day + 3600 * 11), ('2025-05-01', day + 3600 * 15),
+             ('2025-05-02', day + 3600 * 26)]
+    saved = stats.db.get_bucket_stats, stats.db.get_record_times
+    stats.db.get_bucket_stats = lambda *args: rows
+    stats.db.get_record_times = lambda *args: times
+    try:
+        data = stats.compute_stats('default', '2025-05-01', '2025-05-02')
+    finally:
+        stats.db.get_bucket_stats, stats.db.get_record_times = saved
+
+    first, second = data['buckets']
+    assert first['ml_fed'] == 360 and first['avg_ml_per_feed'] == 120.0
+    assert first['feeding_interval_avg_minutes'] == 210.0
+    assert first['feeding_interval_min_minutes'] == 180.0
+    assert second['ml_fed'] == 0 and second['avg_ml_per_feed'] is None
+    assert second['feeding_interval_avg_minutes'] == 660.0
+    assert second['temperature_max'] == 37.5
+    summary = data['summary']
+    assert summary['feed_count'] == 4 and summary['diaper_count'] == 1
+    assert summary['feeding_interval_max_minutes'] == 660.0
+    assert summary['temperature_min'] == 36.8
+
+if __name__ == "__main__":
+    test_compute_stats()
+    print("统计测试通过")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+from datetime import datetime
+
+from db import ShardedDatabase
+from scheduler import ReportScheduler
+from tenancy import TenantResolver, ShardRouter
+
+TENANTS = {
+    'zhang': {'members': ['ZhangSan', 'LiSi'], 'chats': ['wrZhang'], 'shard': 'shard1'},
+    'wang': {'members': ['WangWu']},
+}
+
+def test_resolve_and_route():
+    """测试按群聊、成员确定租户，以及租户到分片的路由"""
+    resolver = TenantResolver(TENANTS, default_tenant='default', auto=False)
+    assert resolver.resolve('ZhangSan') == 'zhang'
+    assert resolver.resolve('WangWu', 'wrZhang') == 'zhang'
+    assert resolver.resolve('WangWu', 'wrOther') == 'wang'
+    assert resolver.resolve('Stranger') == 'default'
+    assert resolver.resolve_recipient('wrZhang') == 'zhang'
+
+    auto = TenantResolver(TENANTS, default_tenant='default', auto=True)
+    assert auto.resolve('Stranger', 'wrNew') == 'wrNew'
+    assert auto.resolve('Stranger') == 'Stranger'
+
+    router = ShardRouter({'shard1': {'host': '10.0.0.2'}, 'shard2': {'host': '10.0.0.3'}}, TENANTS,
+                         hash_shards=['default', 'shard2'], base_config={'host': 'localhost', 'port': 3306})
+    assert router.shard_for('zhang') == 'shard1'
+    assert router.configs['shard1'] == {'host': '10.0.0.2', 'port': 3306}
+    # 未固定分片的租户按哈希稳定地分布到hash_shards
+    spread = {router.shard_for(f"family{i}") for i in range(50)}
+    assert spread == {'default', 'shard2'}
+    assert router.shard_for('family7') == router.shard_for('family7')
+
+    db = ShardedDatabase(router)
+    assert db.shard('zhang').name == 'shard1'
+    assert db.shard('zhang').config['host'] == '10.0.0.2'
+    assert db.shard('zhang')._listeners is db.shard('family7')._listeners
+
+def test_push_per_tenant():
+    """测试定时推送为每个租户生成一次日报，接收者只收到所属租户的日报"""
+    class FakeQueue:
+        def __init__(self):
+            self.messages = []
+
+        def enqueue(self, recipient, content, coalesce=False, delay=0):
+            self.messages.append((recipient, content))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = FakeQueue()
+        generated = []
+        scheduler = ReportScheduler(push_time='21:00', report_day='today', recipients='ZhangSan,wrZhang,WangWu',
+                                    jitter=0, catchup_days=1, state_path=os.path.join(tmp, 'push.json'),
+                                    queue=queue, resolver=TenantResolver(TENANTS))
+        scheduler.report_func = lambda tenant_id, date_str: generated.append(tenant_id) or f"{tenant_id} {date_str}"
+        scheduler.run_due(datetime(2025, 5, 1, 20, 0))
+        assert scheduler.run_due(datetime(2025, 5, 1, 21, 0)) == ['2025-05-01']
+        assert sorted(generated) == ['wang', 'zhang']
+        assert sorted(queue.messages) == [('WangWu', 'wang 2025-05-01'), ('ZhangSan', 'zhang 2025-05-01'),
+                                          ('wrZhang', 'zhang 2025-05-01')]
+
+if __name__ == "__main__":
+    test_resolve_and_route()
+    test_push_per_tenant()
+    print("多租户测试通过")
@@ -0,0 +1,51 @@
+import time
+
+from tracing import Trace, TraceLog, start_trace, current_trace, current_trace_id, trace_log
+from metrics import stage
+
+
+def test_stages_are_recorded_in_current_trace():
+    """阶段耗时写入当前追踪，Server-Timing按阶段合计"""
+    with start_trace('test') as trace:
+        with stage('db.get_records'):
+            pass
+        with stage('db.get_records'):
+            pass
+        with stage('wechat.decrypt'):
+            pass
+        assert current_trace_id() == trace.trace_id
+    assert current_trace.get() is None
+    assert [span[0] for span in trace.spans] == ['db.get_records', 'db.get_records', 'wechat.decrypt']
+    timing = trace.server_timing()
+    assert timing.count('db.get_records;dur=') == 1
+    assert 'wechat.decrypt;dur=' in timing and 'total;dur=' in timing
+    assert trace_log.find(trace.trace_id) == [trace]
+
+
+def test_slowest_and_zipkin_parents():
+    """环形缓冲区保留最近的追踪，Zipkin导出按时间区间推断父阶段"""
+    log = TraceLog(size=3)
+    for i, duration in enumerate([0.5, 0.1, 0.3, 0.2]):
+        trace = Trace(f"GET /{i}")
+        trace.duration = duration
+        log.record(trace)
+    assert [t.name for t in log.slowest(2)] == ['GET /2', 'GET /3']
+
+    trace = Trace('POST /wechat/callback', 'ab' * 8)
+    base = trace.started
+    trace.add_span('wechat.xml_parse', base + 0.001, base + 0.002)
+    trace.add_span('wechat.decrypt', base + 0.003, base + 0.004)
+    trace.add_span('wechat.verify_signature', base + 0.0025, base + 0.005)
+    trace.finish(200)
+    spans = {span['name']: span for span in trace.to_zipkin()}
+    root = spans['POST /wechat/callback']
+    assert len(root['traceId']) == 32 and 'parentId' not in root
+    assert spans['wechat.xml_parse']['parentId'] == root['id']
+    assert spans['wechat.verify_signature']['parentId'] == root['id']
+    assert spans['wechat.decrypt']['parentId'] == spans['wechat.verify_signature']['id']
+
+
+if __name__ == "__main__":
+    test_stages_are_recorded_in_current_trace()
+    test_slowest_and_zipkin_parents()
+    print("所有测试通过")
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+
+from pymysql.err import OperationalError, DataError
+
+import wal
+from wal import WriteAheadLog, read_log
+
+class FakeDatabase:
+    def __init__(self):
+        self.available = True
+        self.records = {}
+        self.applied = []
+        # 依次作为插入时的异常，模拟锁等待超时、死锁和数据错误
+        self.errors = []
+        self.error = None
+
+    def insert_record(self, tenant_id, record_time, record_type, amount=None, amount_unit=None, description=None):
+        self.error = None
+        if not self.available:
+            self.error = OperationalError(2003, "Can't connect to MySQL server")
+            return None
+        if self.errors:
+            self.error = self.errors.pop(0)
+            return None
+        key = (tenant_id, record_time, record_type)
+        is_update = key in self.records
+        self.records[key] = amount
+        self.applied.append(('insert', record_time, amount))
+        return {'id': 1, 'is_update': is_update}
+
+    def delete_record(self, tenant_id, record_time, record_type):
+        self.error = None
+        if not self.available:
+            self.error = OperationalError(2003, "Can't connect to MySQL server")
+            return None
+        self.applied.append(('delete', record_time, None))
+        if self.records.pop((tenant_id, record_time, record_type), None) is None:
+            return None
+        return {'id': 1, 'amount': None, 'amount_unit': None}
+
+    def is_available(self, tenant_id):
+        return self.available
+
+    def last_error(self, tenant_id):
+        return self.error
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+def test_write_and_rotate():
+    """测试写库后照常返回结果、分段和删除已写库的段文件"""
+    with tempfile.TemporaryDirectory() as tmp:
+        database = FakeDatabase()
+        log = WriteAheadLog(tmp, database, segment_bytes=200, apply_timeout=2, enabled=True)
+        log.start()
+        try:
+            for hour in range(6):
+                applied, result = log.insert('family', datetime(2025, 5, 1, hour), '吃', '100', '毫升', '吃奶')
+                assert applied and result['is_update'] is False
+            assert log.delete('family', datetime(2025, 5, 1, 0), '吃')[1]['id'] == 1
+            # 删除不存在的记录时数据库可用，返回未找到
+            assert log.delete('family', datetime(2025, 5, 2), '吃') == (True, None)
+            wait_until(lambda: log.pending() == 0)
+            segments = [name for name in os.listdir(log.path) if name.endswith('.log')]
+            assert len(segments) == 1
+        finally:
+            log.stop()
+
+def test_outage_and_replay():
+    """测试数据库不可用时先返回已记录，恢复后按顺序写库，以及重启和接管遗留目录后重放"""
+    saved = wal.RETRY_BASE_DELAY
+    wal.RETRY_BASE_DELAY = 0.01
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            database = FakeDatabase()
+            database.available = False
+            log = WriteAheadLog(tmp, database, apply_timeout=0.05, enabled=True)
+            log.start()
+            started = time.monotonic()
+            assert log.insert('family', datetime(2025, 5, 1, 8), '吃', '100') == (False, None)
+            assert log.insert('family', datetime(2025, 5, 1, 8), '吃', '120') == (False, None)
+            assert log.delete('family', datetime(2025, 5, 1, 9), '睡') == (False, None)
+            assert time.monotonic() - started < 1
+            log.stop()
+            assert log.stats()['pending'] == 3
+
+            # 以其他进程的目录名模拟已退出的进程，新实例接管后写库
+            os.rename(log.path, os.path.join(tmp, '999999999'))
+            database.available = True
+            log = WriteAheadLog(tmp, database, enabled=True)
+            log.start()
+            try:
+                wait_until(lambda: log.pending() == 0)
+                assert [item[2] for item in database.applied] == ['100', '120', None]
+                assert database.records == {('family', datetime(2025, 5, 1, 8), '吃'): '120'}
+                assert not os.path.exists(os.path.join(tmp, '999999999'))
+                assert log.counters()['adopted'] == 3
+            finally:
+                log.stop()
+
+            # 同一目录重启时跳过已写库的日志
+            database.applied = []
+            log = WriteAheadLog(tmp, database, enabled=True)
+            log.start()
+            log.stop()
+            assert database.applied == []
+    finally:
+        wal.RETRY_BASE_DELAY = saved
+
+def test_failed_writes():
+    """测试能连接数据库时的临时错误重试后写入，数据错误和重试次数用尽后记入dead.jsonl"""
+    saved = wal.RETRY_BASE_DELAY, wal.WAL_MAX_ATTEMPTS
+    wal.RETRY_BASE_DELAY, wal.WAL_MAX_ATTEMPTS = 0.01, 3
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            database = FakeDatabase()
+            database.errors = [OperationalError(1205, 'Lock wait timeout exceeded'),
+                               OperationalError(1213, 'Deadlock found')]
+            log = WriteAheadLog(tmp, database, apply_timeout=2, enabled=True)
+            log.start()
+            try:
+                applied, result = log.insert('family', datetime(2025, 5, 1, 8), '吃', '100')
+                assert applied and result['id'] == 1
+                assert log.counters()['retried'] == 2
+
+                database.errors = [DataError(1406, 'Data too long')]
+                assert log.insert('family', datetime(2025, 5, 1, 9), '吃', '1' * 100) == (True, None)
+                database.errors = [OperationalError(2013, 'Lost connection')] * 3
+                assert log.insert('family', datetime(2025, 5, 1, 10), '吃', '120') == (True, None)
+                assert log.counters()['retried'] == 4 and log.counters()['dead'] == 2
+                with open(os.path.join(tmp, wal.DEAD_FILE), encoding='utf-8') as f:
+                    assert [json.loads(line)['amount'] for line in f] == ['1' * 100, '120']
+                assert [item[2] for item in database.applied] == ['100']
+            finally:
+                log.stop()
+    finally:
+        wal.RETRY_BASE_DELAY, wal.WAL_MAX_ATTEMPTS = saved
+
+def test_claim_directory():
+    """测试启动时等待中的目录被其他进程接管删除后，以临时名称加锁再改名创建新目录"""
+    if not wal.HAS_FCNTL:
+        return
+    import fcntl
+    with tempfile.TemporaryDirectory() as tmp:
+        # 上一个同进程号的进程遗留的目录，正被其他进程接管
+        path = os.path.join(tmp, str(os.getpid()))
+        os.makedirs(path)
+        fd = os.open(os.path.join(path, wal.LOCK_FILE), os.O_RDWR | os.O_CREAT)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+        def adopt():
+            time.sleep(0.2)
+            shutil.rmtree(path)
+            os.close(fd)
+
+        thread = threading.Thread(target=adopt)
+        thread.start()
+        log = WriteAheadLog(tmp, FakeDatabase(), enabled=True)
+        log.start()
+        try:
+            thread.join()
+            assert os.listdir(tmp) == [str(os.getpid())]
+            # 新目录的锁由本实例持有
+            other = os.open(os.path.join(path, wal.LOCK_FILE), os.O_RDWR)
+            try:
+                fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                assert False
+            except OSError:
+                pass
+            finally:
+                os.close(other)
+            assert log.insert('family', datetime(2025, 5, 1, 8), '吃', '100')[0]
+        finally:
+            log.stop()
+
+def test_torn_tail():
+    """测试崩溃时写了一半的日志尾部被忽略"""
+    with tempfile.TemporaryDirectory() as tmp:
+        database = FakeDatabase()
+        database.available = False
+        log = WriteAheadLog(tmp, database, apply_timeout=0, enabled=True)
+        log.start()
+        log.insert('family', datetime(2025, 5, 1, 8), '吃', '100')
+        log.stop()
+        segment = [name for name in os.listdir(log.path) if name.endswith('.log')][0]
+        with open(os.path.join(log.path, segment), 'ab') as f:
+            f.write(b'\x40\x00\x00\x00\x01\x02')
+        applied_seq, entries, _ = read_log(log.path)
+        assert applied_seq == 0 and [entry['amount'] for entry in entries] == ['100']
+
+if __name__ == "__main__":
+    test_write_and_rotate()
+    test_outage_and_replay()
+    test_failed_writes()
+    test_claim_directory()
+    test_torn_tail()
+    print("写前日志测试通过")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import base64
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+
+import wechat
+from wechat import WeChatAPI, WXBizMsgCrypt
+from loadtest import CallbackGenerator
+
+ENCODING_AES_KEY = base64.b64encode(b"0123456789abcdef0123456789abcdef").decode()[:43]
+
+def test_decode_callback_and_passive_reply():
+    """测试回调解码和加密被动回复的往返"""
+    saved = wechat.TOKEN, wechat.CORP_ID
+    wechat.TOKEN, wechat.CORP_ID = "testtoken", "wwtest"
+    try:
+        check_roundtrip()
+    finally:
+        wechat.TOKEN, wechat.CORP_ID = saved
+
+def check_roundtrip():
+    """使用测试密钥生成回调，解码后构造被动回复并解密校验"""
+    api = WeChatAPI()
+    api.crypto = WXBizMsgCrypt(ENCODING_AES_KEY)
+    generator = CallbackGenerator(token="testtoken", encoding_aes_key=ENCODING_AES_KEY, corp_id="wwtest")
+
+    body, params = generator.build("晚上10点吃奶粉120毫升]]>", from_user="ShenChaoSong")
+    message = api.decode_callback(body, params['msg_signature'], params['timestamp'], params['nonce'])
+    assert message.msg_type == "text"
+    assert message.from_user == "ShenChaoSong"
+    assert message.content == "晚上10点吃奶粉120毫升]]>"
+    assert message.get('MsgId')
+
+    # 签名不匹配的回调被拒绝
+    assert api.decode_callback(body, "0" * 40, params['timestamp'], params['nonce']) is None
+
+    # 被动回复：验证签名并解密出回复内容
+    reply = ET.fromstring(api.build_passive_reply(message, "记录添加成功！]]>", params['nonce']))
+    encrypted = reply.find('Encrypt').text
+    signature = WeChatAPI.calc_signature(reply.find('TimeStamp').text, reply.find('Nonce').text, encrypted)
+    assert signature == reply.find('MsgSignature').text
+    xml_view, receive_id = api.crypto.decrypt_payload(encrypted)
+    inner = ET.fromstring(xml_view)
+    assert receive_id == b"wwtest"
+    assert inner.find('ToUserName').text == "ShenChaoSong"
+    assert inner.find('Content').text == "记录添加成功！]]>"
+
+def stub_fetch(api, fetches):
+    """以计数的假实现替换gettoken请求，每次返回新的令牌"""
+    def fetch():
+        time.sleep(0.05)
+        fetches.append(1)
+        return f"token-{len(fetches)}", time.time() + 7200
+    api._fetch_access_token = fetch
+
+def test_token_single_flight():
+    """测试并发获取令牌只请求一次，以及用过期令牌失效时不会作废其他线程刚刷新的令牌"""
+    saved = wechat.TOKEN_CACHE_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        wechat.TOKEN_CACHE_PATH = os.path.join(tmp, 'access_token.json')
+        try:
+            api = WeChatAPI()
+            fetches = []
+            stub_fetch(api, fetches)
+            barrier = threading.Barrier(16)
+            results = []
+
+            def worker():
+                barrier.wait()
+                results.append(api.get_access_token())
+
+            threads = [threading.Thread(target=worker) for _ in range(16)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert len(fetches) == 1 and results == ['token-1'] * 16
+
+            # 其他进程通过共享缓存文件复用令牌，不再请求
+            other = WeChatAPI()
+            other_fetches = []
+            stub_fetch(other, other_fetches)
+            assert other.get_access_token() == 'token-1' and other_fetches == []
+
+            # token-1被判定失效后刷新为token-2，迟到的token-1失效调用不影响token-2
+            api.invalidate_access_token('token-1')
+            assert api.get_access_token() == 'token-2'
+            api.invalidate_access_token('token-1')
+            other.invalidate_access_token('token-1')
+            assert api.get_access_token() == 'token-2' and len(fetches) == 2
+            assert api._read_token_cache()['access_token'] == 'token-2'
+            assert api._read_token_cache()['expires_at'] > time.time()
+        finally:
+            wechat.TOKEN_CACHE_PATH = saved
+
+if __name__ == "__main__":
+    test_decode_callback_and_passive_reply()
+    test_token_single_flight()
@@ -0,0 +1,198 @@
+import os
+import re
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from config import TRACE_ENABLED, TRACE_BUFFER_SIZE, TRACE_SERVICE_NAME
+
+# 当前请求（或后台任务）的追踪，由阶段耗时统计自动写入
+current_trace = ContextVar('current_trace', default=None)
+
+# 外部传入的追踪ID：16或32位十六进制
+TRACE_ID_PATTERN = re.compile(r'^[0-9a-f]{16}([0-9a-f]{16})?$')
+
+
+def new_trace_id():
+    """生成32位十六进制的追踪ID"""
+    return os.urandom(16).hex()
+
+
+class Trace:
+    """一次请求或后台任务的阶段耗时记录
+
+    spans中每一项为(阶段名, 相对开始时间的偏移秒数, 耗时秒数)，按阶段结束的顺序追加。
+    """
+
+    __slots__ = ('trace_id', 'name', 'started_at', 'started', 'duration', 'status', 'spans')
+
+    def __init__(self, name, trace_id=None):
+        self.trace_id = trace_id or new_trace_id()
+        self.name = name
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.status = None
+        self.spans = []
+
+    def add_span(self, name, started, ended):
+        """记录一个阶段，started/ended为perf_counter时间"""
+        self.spans.append((name, started - self.started, ended - started))
+
+    def finish(self, status=None):
+        self.duration = time.perf_counter() - self.started
+        self.status = status
+
+    def server_timing(self):
+        """生成Server-Timing响应头：同名阶段的耗时相加，另附total"""
+        totals = {}
+        for name, _, duration in self.spans:
+            totals[name] = totals.get(name, 0.0) + duration
+        elapsed = time.perf_counter() - self.started
+        parts = [f"{name};dur={duration * 1000:.3f}" for name, duration in totals.items()]
+        parts.append(f"total;dur={elapsed * 1000:.3f}")
+        return ', '.join(parts)
+
+    def to_dict(self):
+        """完整的阶段明细"""
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'start': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at)),
+            'duration_ms': round((self.duration or 0) * 1000, 3),
+            'status': self.status,
+            'spans': [
+                {'name': name, 'offset_ms': round(offset * 1000, 3), 'duration_ms': round(duration * 1000, 3)}
+                for name, offset, duration in sorted(self.spans, key=lambda span: span[1])
+            ]
+        }
+
+    def to_zipkin(self):
+        """导出为Zipkin v2 JSON格式的span列表，阶段的父子关系按时间区间嵌套推断"""
+        root_id = self.trace_id[:16]
+        base_us = int(self.started_at * 1_000_000)
+        endpoint = {'serviceName': TRACE_SERVICE_NAME}
+        trace_id = self.trace_id if len(self.trace_id) == 32 else self.trace_id.rjust(32, '0')
+        spans = [{
+            'traceId': trace_id,
+            'id': root_id,
+            'name': self.name,
+            'timestamp': base_us,
+            'duration': max(1, int((self.duration or 0) * 1_000_000)),
+            'kind': 'SERVER',
+            'localEndpoint': endpoint,
+            'tags': {'status': str(self.status)} if self.status is not None else {}
+        }]
+        # 按开始时间排序后用栈确定每个阶段所在的外层阶段
+        stack = [(root_id, float('inf'))]
+        ordered = sorted(self.spans, key=lambda span: (span[1], -span[2]))
+        for index, (name, offset, duration) in enumerate(ordered, 1):
+            end = offset + duration
+            while len(stack) > 1 and stack[-1][1] < end:
+                stack.pop()
+            span_id = f"{int(root_id, 16) ^ index:016x}"
+            spans.append({
+                'traceId': trace_id,
+                'id': span_id,
+                'parentId': stack[-1][0],
+                'name': name,
+                'timestamp': base_us + int(offset * 1_000_000),
+                'duration': max(1, int(duration * 1_000_000)),
+                'localEndpoint': endpoint
+            })
+            stack.append((span_id, end))
+        return spans
+
+
+class TraceLog:
+    """最近完成的追踪的环形缓冲区，用于查看最慢的请求"""
+
+    def __init__(self, size=TRACE_BUFFER_SIZE):
+        self._traces = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        with self._lock:
+            self._traces.append(trace)
+
+    def slowest(self, limit=20, name=None):
+        """缓冲区内耗时最长的limit个追踪，name为名称前缀过滤"""
+        with self._lock:
+            traces = list(self._traces)
+        if name:
+            traces = [trace for trace in traces if trace.name.startswith(name)]
+        return sorted(traces, key=lambda trace: trace.duration or 0, reverse=True)[:limit]
+
+    def find(self, trace_id):
+        """按追踪ID查找，后台任务与触发它的请求共用追踪ID"""
+        with self._lock:
+            return [trace for trace in self._traces if trace.trace_id == trace_id]
+
+# 创建追踪记录实例
+trace_log = TraceLog()
+
+
+@contextmanager
+def start_trace(name, trace_id=None):
+    """在当前上下文中开始一个追踪，结束后写入追踪记录；未启用追踪时不做任何事"""
+    if not TRACE_ENABLED:
+        yield None
+        return
+    trace = Trace(name, trace_id)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+        trace.finish(trace.status)
+        trace_log.record(trace)
+
+
+def current_trace_id():
+    """当前追踪ID，不在追踪中时返回None"""
+    trace = current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+# 长时间保持的实时推送连接不记录追踪，否则会占满慢请求记录
+UNTRACED_PATHS = {'/api/records/stream'}
+
+
+class TracingMiddleware:
+    """HTTP请求追踪中间件（ASGI）
+
+    每个请求一个追踪，追踪ID取自请求头X-Trace-Id或新生成，并在响应头X-Trace-Id中返回；
+    请求头带 X-Debug-Timing: 1 时，在响应头Server-Timing中返回各阶段耗时。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not TRACE_ENABLED or scope['path'] in UNTRACED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        trace_id = None
+        debug_timing = False
+        for key, value in scope.get('headers', []):
+            if key == b'x-trace-id':
+                value = value.decode('latin-1').lower()
+                trace_id = value if TRACE_ID_PATTERN.match(value) else None
+            elif key == b'x-debug-timing':
+                debug_timing = value == b'1'
+
+        with start_trace(f"{scope['method']} {scope['path']}", trace_id) as trace:
+            async def send_with_headers(message):
+                if message['type'] == 'http.response.start':
+                    trace.status = message['status']
+                    headers = list(message.get('headers', []))
+                    headers.append((b'x-trace-id', trace.trace_id.encode('ascii')))
+                    if debug_timing:
+                        headers.append((b'server-timing', trace.server_timing().encode('ascii')))
+                    message = dict(message, headers=headers)
+                await send(message)
+
+            await self.app(scope, receive, send_with_headers)
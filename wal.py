@@ -0,0 +1,504 @@
+import os
+import json
+import time
+import zlib
+import struct
+import shutil
+import threading
+from collections import deque
+from datetime import datetime
+
+from pymysql.err import DataError, IntegrityError
+
+from config import (
+    WAL_ENABLED, WAL_DIR, WAL_SEGMENT_BYTES, WAL_APPLY_TIMEOUT, WAL_RETRY_MAX_DELAY, WAL_MAX_ATTEMPTS
+)
+from db import db
+from metrics import registry
+
+# 文件锁仅在类Unix系统上可用，用于判断其他进程的日志目录是否已无人持有
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+# 每条日志的帧头：内容长度和CRC32，读取时遇到不完整或校验失败的帧即停止（进程崩溃时写了一半的尾部）
+FRAME_HEADER = struct.Struct('<II')
+
+# 日志目录中的文件
+LOCK_FILE = 'lock'
+APPLIED_FILE = 'applied'
+DEAD_FILE = 'dead.jsonl'
+SEGMENT_SUFFIX = '.log'
+
+# 写入失败后的首次重试等待时间（秒），之后指数增长到WAL_RETRY_MAX_DELAY
+RETRY_BASE_DELAY = 0.5
+
+# 数据本身的错误，重试也不会成功，直接记入dead.jsonl
+DATA_ERRORS = (DataError, IntegrityError)
+
+# 空闲时检查其他进程遗留日志的间隔（秒）
+ADOPT_INTERVAL = 30
+
+
+def encode_frame(entry):
+    """把一条日志编码为带长度和校验的帧"""
+    payload = json.dumps(entry, ensure_ascii=False).encode('utf-8')
+    return FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_frames(data):
+    """解码一个段文件中的帧，遇到不完整或损坏的帧时停止"""
+    entries = []
+    offset = 0
+    while offset + FRAME_HEADER.size <= len(data):
+        length, crc = FRAME_HEADER.unpack_from(data, offset)
+        payload = data[offset + FRAME_HEADER.size:offset + FRAME_HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        entries.append(json.loads(payload))
+        offset += FRAME_HEADER.size + length
+    return entries
+
+
+def segment_name(first_seq):
+    return f"{first_seq:020d}{SEGMENT_SUFFIX}"
+
+
+def read_log(path):
+    """读取一个日志目录，返回(已写入数据库的序号, 按序号排列的所有日志, 段文件列表)"""
+    try:
+        with open(os.path.join(path, APPLIED_FILE), 'r') as f:
+            applied_seq = int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        applied_seq = 0
+    try:
+        names = sorted(name for name in os.listdir(path) if name.endswith(SEGMENT_SUFFIX))
+    except FileNotFoundError:
+        return applied_seq, [], []
+    entries, segments = [], []
+    for name in names:
+        with open(os.path.join(path, name), 'rb') as f:
+            entries.extend(read_frames(f.read()))
+        segments.append((int(name[:-len(SEGMENT_SUFFIX)]), os.path.join(path, name)))
+    return applied_seq, entries, segments
+
+
+class _Waiter:
+    """等待一条日志写入数据库的结果，数据库不可用时提前唤醒（applied为False）"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.applied = False
+        self.result = None
+
+
+class WriteAheadLog:
+    """记录写入的本地预写日志
+
+    插入和删除先追加到本地日志并fsync，再由后台线程按顺序写入MySQL。回调处理在日志落盘后
+    最多等待WAL_APPLY_TIMEOUT秒：写库完成则照常回复，超时或数据库不可用时先回复“已记录”，
+    记录不会因为数据库故障丢失，回调耗时也不再取决于数据库。
+
+    - 并发的追加合并为一次fsync（组提交）
+    - 日志按WAL_SEGMENT_BYTES分段，段内日志全部写库后删除该段
+    - 数据库不可连接时按指数退避重试同一条日志，保持写入顺序
+    - 能连接但写入失败（锁等待超时、死锁、连接中断等）时同样退避重试，最多尝试WAL_MAX_ATTEMPTS次；
+      数据错误或重试次数用尽后记入dead.jsonl并跳过
+    - 每个进程使用以进程号命名的子目录并持有文件锁；启动时重放本目录未写库的日志，
+      并接管已退出进程遗留的目录（锁已释放），重启、崩溃和工作进程回收后都能继续写入
+    - 重放可能重复写入已写库但未记录进度的日志，插入相同时间和类型的记录为更新，删除不存在的记录无影响
+    """
+
+    def __init__(self, directory=WAL_DIR, database=db, segment_bytes=WAL_SEGMENT_BYTES,
+                 apply_timeout=WAL_APPLY_TIMEOUT, enabled=WAL_ENABLED):
+        self.directory = directory
+        self.database = database
+        self.segment_bytes = segment_bytes
+        self.apply_timeout = apply_timeout
+        self.enabled = enabled
+        self.path = None
+        # 追加锁：分配序号、写入段文件、分段
+        self._lock = threading.Lock()
+        # fsync锁：同一时间只有一个线程执行fsync，其他线程等待后通常已被覆盖
+        self._sync_lock = threading.Lock()
+        # 待写库队列和等待者
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._waiters = {}
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock_fd = None
+        self._fd = None
+        self._segment_size = 0
+        self._segments = []
+        self._retired = []
+        self._next_seq = 1
+        self._synced_seq = 0
+        self._applied_seq = 0
+        self._available = True
+        self._counters = {'logged': 0, 'applied': 0, 'retried': 0, 'dead': 0, 'adopted': 0, 'direct': 0}
+
+    def start(self):
+        """打开本进程的日志目录，重放未写库的日志，接管遗留目录并启动写库线程"""
+        if not self.enabled or self._thread:
+            return
+        self.path = os.path.join(self.directory, str(os.getpid()))
+        self._lock_fd = self._claim_directory()
+
+        # 进程号与之前的进程相同时（如容器中），目录中可能有上次未写库的日志
+        self._applied_seq, entries, self._segments = read_log(self.path)
+        pending = [entry for entry in entries if entry['seq'] > self._applied_seq]
+        self._queue.extend(pending)
+        last_seq = max([self._applied_seq] + [entry['seq'] for entry in entries])
+        self._next_seq = last_seq + 1
+        self._synced_seq = last_seq
+        self._open_segment()
+
+        self._stopping.clear()
+        self._adopt_orphans()
+        self._thread = threading.Thread(target=self._run, name="wal-applier", daemon=True)
+        self._thread.start()
+        print(f"写前日志已启动: {self.path}，待写入数据库 {len(self._queue)} 条", flush=True)
+
+    def _claim_directory(self):
+        """取得本进程日志目录并持有其文件锁，返回锁文件描述符
+
+        新目录先以临时名称创建并加锁，再改名为进程号。其他进程接管遗留目录时只看以进程号命名的目录，
+        看到本目录时锁已被持有，不会把刚创建、尚未加锁的目录当作遗留目录删除。
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        lock_path = os.path.join(self.path, LOCK_FILE)
+        if os.path.isdir(self.path):
+            # 进程号与之前的进程相同时（如容器中）沿用该目录；加锁期间目录可能正被其他进程接管删除
+            try:
+                fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            except OSError:
+                fd = None
+            if fd is not None:
+                if HAS_FCNTL:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    if os.stat(lock_path).st_ino == os.fstat(fd).st_ino:
+                        return fd
+                except FileNotFoundError:
+                    pass
+                os.close(fd)
+
+        temp_path = os.path.join(self.directory, f".{os.getpid()}.{os.urandom(4).hex()}.tmp")
+        os.makedirs(temp_path)
+        fd = os.open(os.path.join(temp_path, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        if HAS_FCNTL:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        os.rename(temp_path, self.path)
+        return fd
+
+    def stop(self, timeout=5):
+        """停止写库线程，未写库的日志保留在目录中，下次启动时重放"""
+        if not self._thread:
+            return
+        self._stopping.set()
+        with self._cond:
+            self._cond.notify_all()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+        with self._lock:
+            for fd in self._retired + [self._fd]:
+                os.fsync(fd)
+                os.close(fd)
+            self._retired, self._fd = [], None
+        os.close(self._lock_fd)
+        self._lock_fd = None
+        if self._queue:
+            print(f"写前日志已停止，仍有 {len(self._queue)} 条未写入数据库", flush=True)
+
+    def insert(self, tenant_id, record_time, record_type, amount=None, amount_unit=None, description=None):
+        """插入或更新记录，返回(是否已写入数据库, insert_record的结果)"""
+        return self._write({
+            'op': 'insert',
+            'tenant_id': tenant_id,
+            'record_time': record_time.isoformat(),
+            'record_type': record_type,
+            'amount': amount,
+            'amount_unit': amount_unit,
+            'description': description
+        })
+
+    def delete(self, tenant_id, record_time, record_type):
+        """删除记录，返回(是否已写入数据库, delete_record的结果)"""
+        return self._write({
+            'op': 'delete',
+            'tenant_id': tenant_id,
+            'record_time': record_time.isoformat(),
+            'record_type': record_type
+        })
+
+    def _write(self, entry):
+        """追加日志并等待写库，未启动或日志写入失败时直接写库"""
+        if not self._thread:
+            return True, self._apply_direct(entry)
+        try:
+            seq, waiter = self._append([entry], wait=True)
+            self._sync(seq)
+        except OSError as e:
+            print(f"写前日志写入失败: {e}，直接写入数据库", flush=True)
+            return True, self._apply_direct(entry)
+        # 数据库已知不可用时不再等待
+        waiter.event.wait(self.apply_timeout if self._available else 0)
+        return waiter.applied, waiter.result
+
+    def _apply_direct(self, entry):
+        with self._cond:
+            self._counters['direct'] += 1
+        return self._apply(entry)[1]
+
+    def _open_segment(self):
+        """以下一个序号为名创建新的段文件，调用方持有追加锁（启动时除外）"""
+        path = os.path.join(self.path, segment_name(self._next_seq))
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._segment_size = 0
+        # 上次运行分段后未写入任何日志时，同名的空段文件已在列表中
+        if not self._segments or self._segments[-1][1] != path:
+            self._segments.append((self._next_seq, path))
+
+    def _append(self, entries, wait=False):
+        """追加日志并放入写库队列，返回最后一条的序号（和等待者），调用方需再调用_sync确保落盘
+
+        写库线程可能在fsync完成之前写库，此时崩溃只会让数据库比日志多一条，重放时不会丢失
+        """
+        waiter = _Waiter() if wait else None
+        with self._lock:
+            if self._segment_size >= self.segment_bytes:
+                # 旧段的文件描述符在下次fsync时落盘并关闭
+                self._retired.append(self._fd)
+                self._open_segment()
+            frames = []
+            for entry in entries:
+                entry = dict(entry, seq=self._next_seq, logged_at=time.time())
+                self._next_seq += 1
+                frames.append((entry, encode_frame(entry)))
+            data = b''.join(frame for _, frame in frames)
+            try:
+                os.write(self._fd, data)
+            except OSError:
+                # 写了一半的帧之后的日志在重放时读不到，之后的日志写入新的段文件
+                self._retired.append(self._fd)
+                self._open_segment()
+                raise
+            self._segment_size += len(data)
+            seq = frames[-1][0]['seq']
+            with self._cond:
+                for entry, _ in frames:
+                    self._queue.append(entry)
+                if waiter:
+                    self._waiters[seq] = waiter
+                self._counters['logged'] += len(frames)
+                self._cond.notify()
+        return (seq, waiter) if wait else seq
+
+    def _sync(self, seq):
+        """确保序号不大于seq的日志已落盘，并发调用时一次fsync覆盖所有已追加的日志"""
+        if self._synced_seq >= seq:
+            return
+        with self._sync_lock:
+            if self._synced_seq >= seq:
+                return
+            with self._lock:
+                target = self._next_seq - 1
+                fd = self._fd
+                retired, self._retired = self._retired, []
+            for old in retired:
+                os.fsync(old)
+                os.close(old)
+            os.fsync(fd)
+            self._synced_seq = target
+
+    def _apply(self, entry):
+        """把一条日志写入数据库，返回(状态, 结果)
+
+        状态为applied、retry（数据库不可用）、failed（能连接但写入失败，可重试）或dead（数据错误）
+        """
+        tenant_id = entry['tenant_id']
+        record_time = datetime.fromisoformat(entry['record_time'])
+        error = None
+        try:
+            if entry['op'] == 'insert':
+                result = self.database.insert_record(
+                    tenant_id,
+                    record_time=record_time,
+                    record_type=entry['record_type'],
+                    amount=entry['amount'],
+                    amount_unit=entry['amount_unit'],
+                    description=entry['description']
+                )
+            else:
+                result = self.database.delete_record(tenant_id, record_time=record_time,
+                                                     record_type=entry['record_type'])
+            if result is None:
+                error = self.database.last_error(tenant_id)
+        except Exception as e:
+            print(f"写前日志: 写入数据库异常: {e}", flush=True)
+            result, error = None, e
+        if result is not None:
+            return 'applied', result
+        # 删除时没有异常说明未找到记录
+        if error is None and entry['op'] == 'delete':
+            return 'applied', None
+        if not self.database.is_available(tenant_id):
+            return 'retry', None
+        if isinstance(error, DATA_ERRORS):
+            return 'dead', None
+        return 'failed', None
+
+    def _run(self):
+        """写库线程主循环：按序号逐条写库，数据库不可用时退避重试同一条"""
+        failures = 0
+        # 队首日志在数据库可连接时写入失败的次数
+        attempts = 0
+        last_adopt = time.monotonic()
+        while not self._stopping.is_set():
+            with self._cond:
+                if not self._queue:
+                    self._cond.wait(timeout=1)
+                entry = self._queue[0] if self._queue else None
+            if entry is None:
+                if time.monotonic() - last_adopt >= ADOPT_INTERVAL:
+                    self._adopt_orphans()
+                    last_adopt = time.monotonic()
+                continue
+
+            status, result = self._apply(entry)
+            if status == 'failed':
+                attempts += 1
+                if attempts < WAL_MAX_ATTEMPTS:
+                    delay = min(WAL_RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** (attempts - 1)))
+                    with self._cond:
+                        self._counters['retried'] += 1
+                    print(f"写前日志: 第{entry['seq']}条第{attempts}次写入失败，{delay:.1f}秒后重试", flush=True)
+                    self._stopping.wait(delay)
+                    continue
+                status = 'dead'
+            if status == 'retry':
+                failures += 1
+                self._available = False
+                delay = min(WAL_RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** (failures - 1)))
+                with self._cond:
+                    self._counters['retried'] += 1
+                    # 唤醒所有等待者，先回复已记录
+                    waiters, self._waiters = self._waiters, {}
+                for waiter in waiters.values():
+                    waiter.event.set()
+                print(f"写前日志: 数据库不可用，{delay:.1f}秒后重试，待写入 {len(self._queue)} 条", flush=True)
+                self._stopping.wait(delay)
+                continue
+            if failures:
+                print(f"写前日志: 数据库已恢复，继续写入 {len(self._queue)} 条", flush=True)
+            failures = 0
+            self._available = True
+            if status == 'dead':
+                self._record_dead(entry)
+
+            attempts = 0
+            with self._cond:
+                self._queue.popleft()
+                waiter = self._waiters.pop(entry['seq'], None)
+                self._counters['applied' if status == 'applied' else 'dead'] += 1
+            if waiter:
+                # 先写结果再标记，等待超时的调用方不会读到已写库但没有结果
+                waiter.result = result
+                waiter.applied = True
+                waiter.event.set()
+            self._mark_applied(entry['seq'])
+
+    def _mark_applied(self, seq):
+        """保存写库进度（不fsync，丢失时只会重复写入），删除已全部写库的段文件"""
+        self._applied_seq = seq
+        temp_path = os.path.join(self.path, APPLIED_FILE + '.tmp')
+        with open(temp_path, 'w') as f:
+            f.write(str(seq))
+        os.replace(temp_path, os.path.join(self.path, APPLIED_FILE))
+        with self._lock:
+            # 下一段的起始序号不大于seq+1时，该段的日志已全部写库；当前段保留
+            while len(self._segments) > 1 and self._segments[1][0] <= seq + 1:
+                _, path = self._segments.pop(0)
+                os.remove(path)
+
+    def _record_dead(self, entry):
+        """记录无法写入数据库的日志，供人工处理"""
+        print(f"写前日志: 第{entry['seq']}条无法写入数据库，已记入 {DEAD_FILE}: {entry}", flush=True)
+        with open(os.path.join(self.directory, DEAD_FILE), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def _adopt_orphans(self):
+        """把已退出进程遗留的日志目录中未写库的日志转入本进程的日志，然后删除该目录"""
+        if not HAS_FCNTL:
+            return
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            # 以.tmp结尾的是其他进程创建目录时的临时名称，锁已释放说明该进程在改名之前退出
+            if not (name.isdigit() or name.endswith('.tmp')) or path == self.path:
+                continue
+            try:
+                fd = os.open(os.path.join(path, LOCK_FILE), os.O_RDWR)
+            except OSError:
+                continue
+            try:
+                # 目录的持有进程仍在运行时拿不到锁
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            try:
+                applied_seq, entries, _ = read_log(path)
+                pending = [{key: value for key, value in entry.items() if key not in ('seq', 'logged_at')}
+                           for entry in entries if entry['seq'] > applied_seq]
+                if pending:
+                    self._sync(self._append(pending))
+                    with self._cond:
+                        self._counters['adopted'] += len(pending)
+                shutil.rmtree(path, ignore_errors=True)
+                print(f"写前日志: 接管遗留目录 {path}，待写入数据库 {len(pending)} 条", flush=True)
+            except Exception as e:
+                print(f"写前日志: 接管目录 {path} 失败: {e}", flush=True)
+            finally:
+                os.close(fd)
+
+    def pending(self):
+        """待写入数据库的日志数"""
+        with self._cond:
+            return len(self._queue)
+
+    def counters(self):
+        """本进程的日志计数"""
+        with self._cond:
+            return dict(self._counters)
+
+    def stats(self):
+        """获取日志状态"""
+        with self._cond:
+            oldest = self._queue[0]['logged_at'] if self._queue else None
+            counters = dict(self._counters)
+            pending = len(self._queue)
+        return {
+            'enabled': self.enabled,
+            'running': self._thread is not None,
+            'path': self.path,
+            'database_available': self._available,
+            'pending': pending,
+            'oldest_pending_age': round(time.time() - oldest, 3) if oldest else None,
+            'next_seq': self._next_seq,
+            'applied_seq': self._applied_seq,
+            'segments': len(self._segments),
+            'counters': counters
+        }
+
+# 创建写前日志实例，记录先写入本地日志再由后台线程写库
+write_log = WriteAheadLog()
+registry.gauge('baby_wal_pending', '写前日志中等待写入数据库的记录数', func=write_log.pending)
+registry.counter('baby_wal_entries_total', '写前日志计数：logged/applied/retried/dead/adopted/direct',
+                 ['event'], func=lambda: {(event,): count for event, count in write_log.counters().items()})
@@ -1,14 +1,29 @@
+import os
 import requests
 import json
 import time
+import threading
 import hashlib
+import hmac
 import base64
 import random
 import string
 import struct
 import socket
 import xml.etree.ElementTree as ET
-from config import CORP_ID, SECRET, AGENT_ID, TOKEN, ENCODING_AES_KEY
+from contextlib import contextmanager
+from metrics import stage, timed, WECHAT_SEND_TOTAL
+from config import (
+    CORP_ID, SECRET, AGENT_ID, TOKEN, ENCODING_AES_KEY, WECHAT_API_BASE_URL, WECHAT_HTTP_TIMEOUT,
+    TOKEN_CACHE_PATH, TOKEN_REFRESH_AHEAD, TOKEN_EXPIRY_MARGIN
+)
+
+# 文件锁仅在类Unix系统上可用，用于多个工作进程共享访问令牌
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
 
 # 尝试导入加密库，如果不可用则提供警告
 try:
@@ -24,6 +39,39 @@ except ImportError:
         print("请安装: pip install pycryptodomex")
         HAS_CRYPTO = False
 
+# 访问令牌失效相关错误码
+TOKEN_ERRCODES = {40014, 41001, 42001}
+
+# 企业微信消息加密使用的PKCS#7分块大小
+PKCS7_BLOCK_SIZE = 32
+
+def to_cdata(text):
+    """包装为CDATA段，内容中的"]]>"拆分到两个CDATA段中"""
+    return "<![CDATA[" + (text or '').replace("]]>", "]]]]><![CDATA[>") + "]]>"
+
+class CallbackMessage:
+    """解码后的企业微信回调消息"""
+    
+    __slots__ = ('fields', 'msg_type', 'from_user', 'to_user', 'create_time', 'content', 'msg_id', 'chat_id', 'event')
+    
+    def __init__(self, fields):
+        self.fields = fields
+        self.msg_type = fields.get('MsgType')
+        self.from_user = fields.get('FromUserName', '')
+        self.to_user = fields.get('ToUserName', '')
+        self.create_time = int(fields.get('CreateTime') or 0)
+        self.content = fields.get('Content') or ''
+        self.msg_id = fields.get('MsgId')
+        self.chat_id = fields.get('ChatId')
+        self.event = fields.get('Event')
+    
+    def get(self, key, default=None):
+        """按XML字段名读取，兼容原先的字典用法"""
+        return self.fields.get(key, default)
+    
+    def __repr__(self):
+        return f"CallbackMessage({self.fields})"
+
 class WXBizMsgCrypt:
     """企业微信消息加解密类"""
     
@@ -46,12 +94,14 @@ class WXBizMsgCrypt:
         try:
             # 生成随机16字节字符串作为填充
             random_str = ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(16))
-            text = random_str.encode('utf-8') + struct.pack("I", socket.htonl(len(text))) + text.encode('utf-8') + corp_id.encode('utf-8')
+            # 长度字段是UTF-8编码后的字节数
+            text_bytes = text.encode('utf-8')
+            text = random_str.encode('utf-8') + struct.pack("I", socket.htonl(len(text_bytes))) + text_bytes + corp_id.encode('utf-8')
             
-            # 使用PKCS#7填充
-            amount_to_pad = AES.block_size - (len(text) % AES.block_size)
+            # 使用PKCS#7填充，企业微信要求按32字节分块
+            amount_to_pad = PKCS7_BLOCK_SIZE - (len(text) % PKCS7_BLOCK_SIZE)
             if amount_to_pad == 0:
-                amount_to_pad = AES.block_size
+                amount_to_pad = PKCS7_BLOCK_SIZE
             pad = chr(amount_to_pad).encode('utf-8') * amount_to_pad
             text = text + pad
             
@@ -63,6 +113,30 @@ class WXBizMsgCrypt:
             print(f"加密消息失败: {e}")
             return None
     
+    @timed('wechat.decrypt')
+    def decrypt_payload(self, text):
+        """解密回调中的Encrypt字段，返回(消息XML, ReceiveId)
+        
+        回调热路径使用，不输出调试日志；数据格式错误时抛出ValueError。
+        返回的消息XML是解密结果上的memoryview切片，避免额外复制。
+        """
+        cipher = AES.new(self.key, AES.MODE_CBC, self.key[:16])
+        decrypted = cipher.decrypt(base64.b64decode(text))
+        pad = decrypted[-1]
+        if pad < 1 or pad > PKCS7_BLOCK_SIZE:
+            pad = 0
+        end = len(decrypted) - pad
+        if end < 20:
+            raise ValueError("解密后内容长度不足")
+        
+        # 16字节随机串 + 4字节网络序长度 + 消息XML + ReceiveId
+        xml_len = struct.unpack_from("!I", decrypted, 16)[0]
+        if 20 + xml_len > end:
+            raise ValueError(f"消息长度字段异常: {xml_len}")
+        view = memoryview(decrypted)
+        return view[20:20 + xml_len], bytes(view[20 + xml_len:end])
+    
+    @timed('wechat.decrypt')
     def decrypt(self, text):
         """解密消息"""
         if not HAS_CRYPTO:
@@ -131,12 +205,15 @@ class WeChatAPI:
     """企业微信API封装"""
     
     # API接口URL
-    API_BASE_URL = "https://qyapi.weixin.qq.com/cgi-bin"
+    API_BASE_URL = WECHAT_API_BASE_URL
     
     def __init__(self):
         self.access_token = None
         self.token_expires_at = 0
         self.crypto = None
+        self._token_lock = threading.Lock()
+        self._refresher_thread = None
+        self._refresher_stopping = threading.Event()
         
         # 初始化加密模块
         if ENCODING_AES_KEY and HAS_CRYPTO:
@@ -145,15 +222,40 @@ class WeChatAPI:
             except Exception as e:
                 print(f"警告: 初始化加密模块失败: {e}")
     
+    @timed('wechat.get_access_token')
     def get_access_token(self):
-        """获取或刷新访问令牌"""
-        now = int(time.time())
-        
-        # 如果令牌未过期，直接返回
-        if self.access_token and now < self.token_expires_at:
+        """获取访问令牌，令牌即将过期时刷新"""
+        # 令牌有效，直接返回（热路径无锁）
+        if self.access_token and time.time() < self.token_expires_at - TOKEN_EXPIRY_MARGIN:
             return self.access_token
+        return self._refresh_access_token(min_ttl=TOKEN_EXPIRY_MARGIN)
+    
+    def _refresh_access_token(self, min_ttl):
+        """刷新访问令牌，保证同一时间只有一个gettoken请求
         
-        # 请求新的访问令牌
+        线程间通过锁串行化，进程间通过共享缓存文件上的文件锁串行化。
+        拿到锁后先检查其他线程或进程是否已经刷新过，剩余有效期超过min_ttl则直接复用。
+        """
+        with self._token_lock:
+            if self.access_token and time.time() < self.token_expires_at - min_ttl:
+                return self.access_token
+            
+            with self._token_file_lock():
+                cached = self._read_token_cache()
+                if cached and time.time() < cached['expires_at'] - min_ttl:
+                    self.access_token = cached['access_token']
+                    self.token_expires_at = cached['expires_at']
+                    return self.access_token
+                
+                token, expires_at = self._fetch_access_token()
+                if token:
+                    self.access_token = token
+                    self.token_expires_at = expires_at
+                    self._write_token_cache(token, expires_at)
+                return token
+    
+    def _fetch_access_token(self):
+        """请求新的访问令牌，返回(令牌, 过期时间戳)"""
         url = f"{self.API_BASE_URL}/gettoken"
         params = {
             "corpid": CORP_ID,
@@ -161,26 +263,129 @@ class WeChatAPI:
         }
         
         try:
-            response = requests.get(url, params=params)
+            now = time.time()
+            response = requests.get(url, params=params, timeout=WECHAT_HTTP_TIMEOUT)
             result = response.json()
             
             if result.get("errcode") == 0:
-                self.access_token = result.get("access_token")
-                self.token_expires_at = now + result.get("expires_in") - 200  # 提前200秒刷新
-                return self.access_token
+                print("已获取新的访问令牌", flush=True)
+                return result.get("access_token"), now + result.get("expires_in")
             else:
                 print(f"获取访问令牌失败: {result}")
-                return None
+                return None, 0
         except Exception as e:
             print(f"请求访问令牌异常: {e}")
+            return None, 0
+    
+    @contextmanager
+    def _token_file_lock(self):
+        """跨进程的令牌刷新锁，不支持文件锁的平台上退化为进程内锁"""
+        if not HAS_FCNTL or not TOKEN_CACHE_PATH:
+            yield
+            return
+        try:
+            directory = os.path.dirname(TOKEN_CACHE_PATH)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            lock_file = open(TOKEN_CACHE_PATH + ".lock", "a")
+        except Exception as e:
+            print(f"打开令牌锁文件失败: {e}", flush=True)
+            yield
+            return
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+    
+    def _read_token_cache(self):
+        """读取共享令牌缓存文件"""
+        if not TOKEN_CACHE_PATH:
             return None
+        try:
+            with open(TOKEN_CACHE_PATH, "r") as f:
+                cached = json.load(f)
+            if cached.get("access_token") and cached.get("expires_at"):
+                return cached
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"读取令牌缓存失败: {e}", flush=True)
+        return None
+    
+    def _write_token_cache(self, token, expires_at):
+        """写入共享令牌缓存文件（先写临时文件再原子替换）"""
+        if not TOKEN_CACHE_PATH:
+            return
+        try:
+            tmp_path = f"{TOKEN_CACHE_PATH}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"access_token": token, "expires_at": expires_at}, f)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, TOKEN_CACHE_PATH)
+        except Exception as e:
+            print(f"写入令牌缓存失败: {e}", flush=True)
+    
+    def invalidate_access_token(self, token=None):
+        """使访问令牌失效，下次调用时重新获取
+        
+        传入token时只在当前令牌仍是该值时失效，避免并发场景下把其他线程刚刷新的令牌作废。
+        """
+        with self._token_lock:
+            if token and token != self.access_token:
+                return
+            token = token or self.access_token
+            self.access_token = None
+            self.token_expires_at = 0
+            with self._token_file_lock():
+                cached = self._read_token_cache()
+                if cached and cached['access_token'] == token:
+                    self._write_token_cache(token, 0)
+    
+    def _token_refresher(self):
+        """后台线程：在令牌过期前TOKEN_REFRESH_AHEAD秒主动续期"""
+        while not self._refresher_stopping.is_set():
+            remaining = self.token_expires_at - time.time() - TOKEN_REFRESH_AHEAD
+            if self.access_token and remaining > 0:
+                # 加入随机抖动，避免多个工作进程同时醒来
+                self._refresher_stopping.wait(remaining + random.uniform(0, 30))
+                continue
+            if not self._refresh_access_token(min_ttl=TOKEN_REFRESH_AHEAD):
+                # 获取失败，稍后重试
+                self._refresher_stopping.wait(30)
+    
+    def start_token_refresher(self):
+        """启动访问令牌主动续期线程"""
+        if not CORP_ID or not SECRET:
+            return
+        if self._refresher_thread and self._refresher_thread.is_alive():
+            return
+        self._refresher_stopping.clear()
+        self._refresher_thread = threading.Thread(target=self._token_refresher, name="token-refresher", daemon=True)
+        self._refresher_thread.start()
+    
+    def stop_token_refresher(self):
+        """停止访问令牌主动续期线程"""
+        self._refresher_stopping.set()
     
     def send_message(self, user_id, content):
-        """发送消息到企业微信用户或群聊"""
+        """发送消息到企业微信用户或群聊，返回是否成功"""
+        return self.send_message_result(user_id, content).get("errcode") == 0
+    
+    def send_message_result(self, user_id, content):
+        """发送消息到企业微信用户或群聊，返回API原始结果（网络异常时errcode为None）"""
+        with stage('wechat.send_message'):
+            result = self._send_message_result(user_id, content)
+        WECHAT_SEND_TOTAL.inc(str(result.get('errcode', 'none')).lower())
+        return result
+    
+    def _send_message_result(self, user_id, content):
+        """调用发送接口"""
         token = self.get_access_token()
         if not token:
             print("获取访问令牌失败，无法发送消息", flush=True)
-            return False
+            return {"errcode": None, "errmsg": "获取访问令牌失败"}
         
         # 默认使用应用消息接口向用户发送消息
         # 企业微信用户消息和群聊消息使用不同的接口
@@ -216,22 +421,24 @@ class WeChatAPI:
         print(f"请求数据: {data}", flush=True)
         
         try:
-            response = requests.post(url, json=data)
+            response = requests.post(url, json=data, timeout=WECHAT_HTTP_TIMEOUT)
             result = response.json()
             
             print(f"API响应: {result}", flush=True)
             
             if result.get("errcode") == 0:
                 print("消息发送成功", flush=True)
-                return True
             else:
                 print(f"发送消息失败: {result}", flush=True)
-                return False
+                if result.get("errcode") in TOKEN_ERRCODES:
+                    # 令牌已失效，作废本次使用的令牌，下次调用时重新获取
+                    self.invalidate_access_token(token)
+            return result
         except Exception as e:
             print(f"发送消息异常: {e}", flush=True)
             import traceback
             traceback.print_exc()
-            return False
+            return {"errcode": None, "errmsg": str(e)}
     
     def verify_url(self, msg_signature, timestamp, nonce, echostr):
         """验证URL有效性"""
@@ -274,6 +481,79 @@ class WeChatAPI:
         print("直接返回echostr作为最后手段", flush=True)
         return echostr
     
+    def decode_callback(self, body, msg_signature, timestamp, nonce):
+        """解码回调请求体：验签、Base64、AES解密和XML解析各只做一次
+        
+        body为原始请求字节，返回CallbackMessage；签名不匹配或数据格式错误时返回None。
+        """
+        try:
+            with stage('wechat.xml_parse'):
+                root = ET.fromstring(body)
+            encrypt_elem = root.find('Encrypt')
+            if encrypt_elem is None:
+                # 明文模式，外层XML就是消息本身
+                return CallbackMessage({child.tag: child.text for child in root})
+            
+            encrypted_msg = encrypt_elem.text or ''
+            if TOKEN:
+                with stage('wechat.verify_signature'):
+                    signature = self.calc_signature(timestamp, nonce, encrypted_msg)
+                    verified = hmac.compare_digest(signature, msg_signature or '')
+                if not verified:
+                    print(f"回调签名验证失败: 计算={signature}, 接收={msg_signature}", flush=True)
+                    return None
+            else:
+                print("警告: 未配置TOKEN，跳过回调签名验证", flush=True)
+            
+            if not self.crypto:
+                print("错误：加密模块未初始化，无法解密回调消息", flush=True)
+                return None
+            
+            xml_view, receive_id = self.crypto.decrypt_payload(encrypted_msg)
+            if CORP_ID and receive_id != CORP_ID.encode('utf-8'):
+                print(f"警告: 回调消息的ReceiveId与CORP_ID不一致: {receive_id}", flush=True)
+            
+            with stage('wechat.xml_parse'):
+                inner = ET.fromstring(xml_view)
+            return CallbackMessage({child.tag: child.text for child in inner})
+        except Exception as e:
+            print(f"解码回调消息失败: {e}", flush=True)
+            return None
+    
+    def build_passive_reply(self, message, content, nonce):
+        """构造加密的被动回复XML，作为回调的HTTP响应体返回，无需再调用发送接口
+        
+        未配置加密模块时返回None，由调用方改用主动发送。
+        """
+        if not self.crypto or not TOKEN:
+            return None
+        create_time = int(time.time())
+        reply_xml = (
+            f"<xml><ToUserName>{to_cdata(message.from_user)}</ToUserName>"
+            f"<FromUserName>{to_cdata(message.to_user or CORP_ID)}</FromUserName>"
+            f"<CreateTime>{create_time}</CreateTime>"
+            f"<MsgType><![CDATA[text]]></MsgType>"
+            f"<Content>{to_cdata(content)}</Content></xml>"
+        )
+        encrypted = self.crypto.encrypt(reply_xml, CORP_ID)
+        if not encrypted:
+            return None
+        encrypted = encrypted.decode('ascii')
+        timestamp = str(create_time)
+        signature = self.calc_signature(timestamp, nonce, encrypted)
+        return (
+            f"<xml><Encrypt><![CDATA[{encrypted}]]></Encrypt>"
+            f"<MsgSignature><![CDATA[{signature}]]></MsgSignature>"
+            f"<TimeStamp>{timestamp}</TimeStamp>"
+            f"<Nonce>{to_cdata(nonce)}</Nonce></xml>"
+        ).encode('utf-8')
+    
+    @staticmethod
+    def calc_signature(timestamp, nonce, encrypted_msg, token=None):
+        """计算消息签名：TOKEN、时间戳、随机数和密文排序后拼接取SHA1"""
+        parts = sorted([token or TOKEN or '', timestamp or '', nonce or '', encrypted_msg])
+        return hashlib.sha1(''.join(parts).encode('utf-8')).hexdigest()
+    
     def parse_message(self, xml_content):
         """解析接收到的XML消息"""
         try: